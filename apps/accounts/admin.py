@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from django.utils.safestring import mark_safe
 from .models import CustomUser, Proyecto, RegistroFichaje
+from .templatetags.avatares import avatar
 
 
 @admin.register(CustomUser)
@@ -29,9 +29,8 @@ class CustomUserAdmin(UserAdmin):
 
     def avatar_preview(self, obj):
         if obj.avatar:
-            return mark_safe(
-                f'<img src="{obj.avatar.url}" style="height:40px; border-radius:50%;" />'
-            )
+            # 40px thumbnail (96px on high-density screens) instead of the uploaded original
+            return avatar(obj, 40, clase='', estilo='height:40px; border-radius:50%;')
         return "—"
 
     avatar_preview.short_description = "Avatar"
@@ -0,0 +1,187 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.timezone import localtime
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .models import CustomUser, EventoFichaje, Proyecto, RegistroFichaje
+from .rollups import actualizar_resumenes
+from .serializers import LoteFichajesSerializer
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def fichaje_batch(request):
+    """
+    Recibe en una sola petición los fichajes acumulados por un terminal de entrada.
+
+    Cada evento lleva una clave de idempotencia: si el terminal reenvía un lote
+    (por ejemplo tras un timeout) los eventos ya procesados no se vuelven a
+    aplicar y se devuelve el resultado guardado con "duplicate": true. Lo mismo
+    si una clave se repite dentro del lote: solo se aplica el primer evento.
+    """
+    serializer = LoteFichajesSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    resultados = procesar_lote_fichajes(serializer.validated_data['events'])
+    return Response({'results': resultados})
+
+
+def procesar_lote_fichajes(eventos):
+    """
+    Aplica un lote de eventos de fichaje en una única transacción y devuelve
+    un resultado por evento, en el mismo orden en que se recibieron.
+    """
+    for intento in range(2):
+        try:
+            with transaction.atomic():
+                return _procesar_lote(eventos)
+        except IntegrityError:
+            # Otro lote (o la vista HTML) ha creado a la vez el mismo registro
+            # o la misma clave; al reintentar ya los encontramos en la base de datos
+            if intento:
+                raise
+
+
+def _procesar_lote(eventos):
+    claves = {evento['idempotency_key'] for evento in eventos}
+    previos = {
+        evento.clave_idempotencia: evento.resultado
+        for evento in EventoFichaje.objects.filter(clave_idempotencia__in=claves)
+    }
+    pendientes = [evento for evento in eventos if evento['idempotency_key'] not in previos]
+
+    usuarios = CustomUser.objects.filter(
+        username__in={evento['user'] for evento in pendientes}, is_active=True
+    ).in_bulk(field_name='username')
+    proyectos = Proyecto.objects.filter(
+        id__in={evento['project'] for evento in pendientes if evento.get('project')}, activo=True
+    ).in_bulk()
+    registros = {
+        (registro.usuario_id, registro.fecha): registro
+        for registro in RegistroFichaje.objects.select_for_update().filter(
+            usuario__in=usuarios.values(),
+            fecha__in={localtime(evento['timestamp']).date() for evento in pendientes},
+        )
+    }
+
+    # Los eventos se aplican en orden cronológico aunque lleguen desordenados
+    # Si una clave se repite dentro del lote solo se aplica su primer evento
+    # (cronológicamente); los demás se devuelven como duplicados de ese
+    resultados, aplicados = {}, {}
+    nuevos, modificados = {}, {}
+    for evento in sorted(pendientes, key=lambda evento: evento['timestamp']):
+        clave = evento['idempotency_key']
+        if clave in resultados:
+            continue
+        aplicados[clave] = evento
+        resultados[clave] = _aplicar_evento(evento, usuarios, proyectos, registros, nuevos, modificados)
+
+    # Escritura en bloque de registros, eventos y resúmenes
+    ahora = timezone.now()
+    for registro in (*nuevos.values(), *modificados.values()):
+        registro.calcular_horas()
+        registro.fecha_actualizacion = ahora
+
+    RegistroFichaje.objects.bulk_create(nuevos.values())
+    RegistroFichaje.objects.bulk_update(modificados.values(), [
+        'hora_entrada', 'hora_salida', 'proyecto', 'jornada',
+        'horas_trabajadas', 'completo', 'fecha_actualizacion',
+    ])
+
+    for resultado in resultados.values():
+        registro = resultado.pop('_registro', None)
+        if registro is not None:
+            resultado['registro'] = registro.pk
+
+    EventoFichaje.objects.bulk_create([
+        EventoFichaje(
+            clave_idempotencia=evento['idempotency_key'],
+            usuario=usuarios.get(evento['user']),
+            accion=evento['action'],
+            momento=evento['timestamp'],
+            resultado=resultados[evento['idempotency_key']],
+        )
+        for evento in aplicados.values()
+    ])
+
+    actualizar_resumenes(
+        [registro._clave_resumen_original for registro in modificados.values()]
+        + [registro.clave_resumen() for registro in (*nuevos.values(), *modificados.values())]
+    )
+
+    respuesta = []
+    for evento in eventos:
+        clave = evento['idempotency_key']
+        if clave in previos:
+            respuesta.append({**previos[clave], 'duplicate': True})
+        elif evento is aplicados[clave]:
+            respuesta.append(resultados[clave])
+        else:
+            respuesta.append({**resultados[clave], 'duplicate': True})
+    return respuesta
+
+
+def _aplicar_evento(evento, usuarios, proyectos, registros, nuevos, modificados):
+    resultado = {
+        'idempotency_key': evento['idempotency_key'],
+        'action': evento['action'],
+        'status': 'error',
+    }
+
+    usuario = usuarios.get(evento['user'])
+    if usuario is None:
+        resultado['detail'] = 'Usuario no encontrado o inactivo'
+        return resultado
+
+    proyecto = None
+    if evento.get('project'):
+        proyecto = proyectos.get(evento['project'])
+        if proyecto is None:
+            resultado['detail'] = 'Proyecto no válido'
+            return resultado
+
+    momento = localtime(evento['timestamp'])
+    hora = momento.time()
+    clave_registro = (usuario.id, momento.date())
+    registro = registros.get(clave_registro)
+
+    if evento['action'] == 'fichar_entrada':
+        if registro is not None and registro.hora_entrada:
+            resultado['detail'] = 'Ya has fichado la entrada hoy'
+            return resultado
+        if proyecto is None and (registro is None or not registro.proyecto_id):
+            resultado['detail'] = 'Debes seleccionar un proyecto antes de fichar la entrada'
+            return resultado
+
+        if registro is None:
+            registro = RegistroFichaje(usuario=usuario, fecha=momento.date(), jornada='presencial')
+            registros[clave_registro] = nuevos[clave_registro] = registro
+        elif clave_registro not in nuevos:
+            modificados[clave_registro] = registro
+
+        if proyecto is not None:
+            registro.proyecto = proyecto
+        if evento.get('jornada'):
+            registro.jornada = evento['jornada']
+        registro.hora_entrada = hora
+        resultado['detail'] = f'Entrada fichada a las {hora.strftime("%H:%M")}'
+
+    else:
+        if registro is None or not registro.hora_entrada:
+            resultado['detail'] = 'Debes fichar la entrada primero'
+            return resultado
+        if registro.hora_salida:
+            resultado['detail'] = 'Ya has fichado la salida hoy'
+            return resultado
+
+        if clave_registro not in nuevos:
+            modificados[clave_registro] = registro
+        registro.hora_salida = hora
+        resultado['detail'] = f'Salida fichada a las {hora.strftime("%H:%M")}'
+
+    resultado['status'] = 'ok'
+    resultado['hora'] = hora.strftime('%H:%M:%S')
+    resultado['_registro'] = registro
+    return resultado
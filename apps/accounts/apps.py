@@ -6,6 +6,21 @@ class AccountsConfig(AppConfig):
     name = 'apps.accounts'
     
     def ready(self):
+        # Keep fichaje rollups in sync on deletes
+        import apps.accounts.rollups
+
+        # Invalidate cached projects and reports when the data changes
+        import apps.accounts.cache
+
+        # Track fichaje changes not yet in the report materialized views
+        import apps.accounts.materializadas
+
+        # Generate avatar thumbnails on upload
+        import apps.accounts.avatares
+
+        # Log slow queries and keep their EXPLAIN (wraps every new connection)
+        import apps.accounts.consultas_lentas
+
         # Import signals when the app is ready
         try:
             import apps.accounts.ldap_signals
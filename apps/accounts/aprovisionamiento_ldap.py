@@ -0,0 +1,312 @@
+"""
+Alta de usuarios en LDAP, de uno en uno o en bloque desde un CSV.
+
+create_user_in_ldap() da de alta un usuario con un add_s y un modify_s por
+cada grupo de su rol. Para dar de alta una promoción entera aprovisionar()
+usa la API asíncrona de python-ldap sobre una única conexión del pool:
+
+- Los add se envían sin esperar la respuesta, con como mucho `ventana`
+  operaciones pendientes; las respuestas se recogen en orden de envío.
+- Los usuarios creados se añaden a sus grupos con un solo modify por grupo
+  (todos los miembros nuevos en el mismo MOD_ADD), también en paralelo. Si
+  el servidor lo rechaza porque alguno ya era miembro, ese grupo se repite
+  usuario a usuario.
+
+El resultado es un informe con una línea por fila del CSV. Si se pierde la
+conexión a mitad, el pool repite la operación una vez con otra conexión y solo
+se reenvían las filas y los grupos que aún no tenían respuesta. Un add que
+estaba enviado cuando se cayó la conexión pudo aplicarse: si al reenviarlo
+devuelve ALREADY_EXISTS y la entrada tiene el nombre y el correo de la fila,
+se da por creado y se sigue con sus grupos.
+"""
+import csv
+import io
+import logging
+from collections import deque
+
+import ldap
+
+from . import ldap_pool
+from .forms import LDAPUserCreationForm
+
+
+logger = logging.getLogger(__name__)
+
+BASE_USUARIOS = 'ou=users,dc=example,dc=com'
+BASE_GRUPOS = 'ou=groups,dc=example,dc=com'
+
+COLUMNAS = ('username', 'first_name', 'last_name', 'email', 'password', 'role', 'is_staff')
+OBLIGATORIAS = COLUMNAS[:-1]
+VERDADEROS = {'1', 'true', 'si', 'sí', 'yes', 'x'}
+
+# Operaciones LDAP pendientes de respuesta a la vez
+VENTANA = 32
+
+CREADO = 'creado'
+ERROR = 'error'
+
+
+class CsvInvalido(Exception):
+    """El CSV no se puede leer o le faltan columnas"""
+
+
+def dn_usuario(username):
+    return f"uid={username},{BASE_USUARIOS}"
+
+
+def dn_grupo(grupo):
+    return f"cn={grupo},{BASE_GRUPOS}"
+
+
+def grupos_del_rol(role, is_staff):
+    """Grupos LDAP de un usuario nuevo según su rol y si es staff"""
+    grupos = ['active']  # Todos los usuarios están activos al crearlos
+    if role == 'admin':
+        grupos.extend(['admin', 'staff', 'superuser'])
+    elif role == 'hr':
+        grupos.append('hr')
+    elif role == 'tech':
+        grupos.extend(['tech', 'staff'])
+    else:  # user
+        grupos.append('user')
+
+    if is_staff and role not in ['admin', 'tech']:
+        grupos.append('staff')
+    return grupos
+
+
+def atributos_usuario(username, first_name, last_name, email, password):
+    """Atributos de la entrada inetOrgPerson (LDAP codifica la contraseña)"""
+    return [
+        ('objectClass', [b'inetOrgPerson']),
+        ('uid', [username.encode('utf-8')]),
+        ('cn', [f"{first_name} {last_name}".encode('utf-8')]),
+        ('sn', [last_name.encode('utf-8')]),
+        ('givenName', [first_name.encode('utf-8')]),
+        ('mail', [email.encode('utf-8')]),
+        ('userPassword', [password.encode('utf-8')]),
+    ]
+
+
+class Fila:
+    """Una fila del CSV: sus datos validados o el motivo por el que no se crea"""
+
+    def __init__(self, numero, username, datos=None, error=None):
+        self.numero = numero
+        self.username = username
+        self.datos = datos
+        self.resultado = ERROR if error else None
+        self.detalle = error or ''
+        self.enviada = False  # El add se envió al menos una vez
+        self.grupos_pendientes = set()  # Grupos de la fila creada aún sin confirmar
+
+    @property
+    def dn(self):
+        return dn_usuario(self.username)
+
+    def fallo(self, detalle):
+        self.resultado = ERROR
+        self.detalle = detalle
+
+    def avisar(self, detalle):
+        self.detalle = f"{self.detalle}; {detalle}" if self.detalle else detalle
+
+
+def leer_csv(fichero):
+    """
+    Lee y valida un CSV (bytes o texto) con una fila por usuario. Las filas no
+    válidas o con un username repetido vuelven ya marcadas como error.
+    """
+    contenido = fichero.read()
+    if isinstance(contenido, bytes):
+        try:
+            contenido = contenido.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise CsvInvalido("El fichero no está en UTF-8")
+
+    lector = csv.DictReader(io.StringIO(contenido))
+    faltan = [columna for columna in OBLIGATORIAS if columna not in (lector.fieldnames or [])]
+    if faltan:
+        raise CsvInvalido(f"Faltan columnas: {', '.join(faltan)}")
+
+    filas = []
+    vistos = set()
+    # La fila 1 es la cabecera
+    for numero, registro in enumerate(lector, start=2):
+        datos = {columna: (registro.get(columna) or '').strip() for columna in COLUMNAS}
+        datos['confirm_password'] = datos['password']
+        datos['is_staff'] = datos['is_staff'].lower() in VERDADEROS
+        username = datos['username']
+
+        formulario = LDAPUserCreationForm(datos)
+        if not formulario.is_valid():
+            errores = '; '.join(
+                f"{campo}: {' '.join(mensajes)}" for campo, mensajes in formulario.errors.items()
+            )
+            filas.append(Fila(numero, username, error=errores))
+        elif username in vistos:
+            filas.append(Fila(numero, username, error="Usuario repetido en el CSV"))
+        else:
+            vistos.add(username)
+            filas.append(Fila(numero, username, datos=formulario.cleaned_data))
+    return filas
+
+
+def _mensaje(error):
+    if isinstance(error, ldap.ALREADY_EXISTS):
+        return "Ya existe en LDAP"
+    info = error.args[0] if error.args else None
+    if isinstance(info, dict):
+        return ' '.join(str(info[clave]) for clave in ('desc', 'info') if info.get(clave))
+    return str(error)
+
+
+def _en_ventana(conexion, operaciones, ventana):
+    """
+    Envía `operaciones` [(enviar(conexion) -> msgid, al_terminar(error))] con
+    como mucho `ventana` pendientes, y recoge sus respuestas en orden.
+    """
+    pendientes = deque()
+
+    def recoger():
+        msgid, al_terminar = pendientes.popleft()
+        try:
+            conexion.result3(msgid)
+        except ldap.SERVER_DOWN:
+            raise
+        except ldap.LDAPError as e:
+            al_terminar(e)
+        else:
+            al_terminar(None)
+
+    for enviar, al_terminar in operaciones:
+        while len(pendientes) >= ventana:
+            recoger()
+        try:
+            pendientes.append((enviar(conexion), al_terminar))
+        except ldap.SERVER_DOWN:
+            raise
+        except ldap.LDAPError as e:
+            al_terminar(e)
+    while pendientes:
+        recoger()
+
+
+def _ya_creada(conexion, fila, atributos):
+    """Si la entrada de `fila` en LDAP es la que envió un add anterior sin respuesta"""
+    esperados = dict(atributos)
+    try:
+        [(_, actuales)] = conexion.search_s(fila.dn, ldap.SCOPE_BASE, attrlist=['cn', 'mail'])
+    except ldap.SERVER_DOWN:
+        raise
+    except ldap.LDAPError:
+        return False
+    return all(actuales.get(nombre) == esperados[nombre] for nombre in ('cn', 'mail'))
+
+
+def _alta(conexion, fila):
+    datos = fila.datos
+    atributos = atributos_usuario(
+        fila.username, datos['first_name'], datos['last_name'], datos['email'], datos['password']
+    )
+    # Reenvío de un add que quedó sin respuesta al caerse la conexión
+    reenvio = fila.enviada
+
+    def enviar(conexion):
+        fila.enviada = True
+        return conexion.add(fila.dn, atributos)
+
+    def al_terminar(error):
+        if error is None or (
+            reenvio and isinstance(error, ldap.ALREADY_EXISTS) and _ya_creada(conexion, fila, atributos)
+        ):
+            fila.resultado = CREADO
+            fila.grupos_pendientes = set(grupos_del_rol(datos['role'], datos['is_staff']))
+        else:
+            fila.fallo(_mensaje(error))
+    return enviar, al_terminar
+
+
+def _miembros(conexion, grupo, filas):
+    """Añade al grupo los usuarios de `filas` con un solo modify"""
+    miembros = [fila.dn.encode('utf-8') for fila in filas]
+
+    def enviar(conexion):
+        return conexion.modify(dn_grupo(grupo), [(ldap.MOD_ADD, 'member', miembros)])
+
+    def al_terminar(error):
+        if isinstance(error, ldap.TYPE_OR_VALUE_EXISTS):
+            # Alguno ya era miembro y el MOD_ADD falla entero: uno a uno
+            for fila in filas:
+                try:
+                    conexion.modify_s(dn_grupo(grupo), [(ldap.MOD_ADD, 'member', [fila.dn.encode('utf-8')])])
+                except ldap.TYPE_OR_VALUE_EXISTS:
+                    pass
+                except ldap.SERVER_DOWN:
+                    raise
+                except ldap.LDAPError as e:
+                    fila.avisar(f"No se añadió al grupo {grupo}: {_mensaje(e)}")
+                fila.grupos_pendientes.discard(grupo)
+        else:
+            for fila in filas:
+                if error is not None:
+                    fila.avisar(f"No se añadió al grupo {grupo}: {_mensaje(error)}")
+                fila.grupos_pendientes.discard(grupo)
+    return enviar, al_terminar
+
+
+def aprovisionar(filas, ventana=VENTANA):
+    """
+    Da de alta en LDAP las filas válidas de leer_csv() y las añade a los
+    grupos de su rol. Anota en cada fila el resultado y devuelve las filas.
+    """
+    validas = [fila for fila in filas if fila.resultado is None]
+    if not validas:
+        return filas
+
+    def operacion(conexion):
+        # Si el pool repite la operación, las filas ya respondidas no se reenvían
+        pendientes = [fila for fila in validas if fila.resultado is None]
+        _en_ventana(conexion, [_alta(conexion, fila) for fila in pendientes], ventana)
+
+        por_grupo = {}
+        for fila in validas:
+            for grupo in sorted(fila.grupos_pendientes):
+                por_grupo.setdefault(grupo, []).append(fila)
+        _en_ventana(
+            conexion,
+            [_miembros(conexion, grupo, miembros) for grupo, miembros in por_grupo.items()],
+            ventana,
+        )
+
+    try:
+        # Se puede repetir: solo reenvía lo que no tuvo respuesta
+        ldap_pool.ejecutar(operacion, idempotente=True)
+    except (ldap.LDAPError, ldap_pool.PoolAgotado) as e:
+        logger.exception("Bulk LDAP provisioning interrupted")
+        for fila in validas:
+            if fila.resultado is None:
+                fila.fallo(f"No se pudo crear: {_mensaje(e)}")
+            elif fila.grupos_pendientes:
+                fila.avisar(f"Grupos sin asignar: {', '.join(sorted(fila.grupos_pendientes))}")
+
+    if any(fila.resultado == CREADO for fila in validas):
+        # Mostrar los usuarios nuevos en la copia local del directorio
+        from .directorio_ldap import espejo_disponible, sincronizar_directorio
+
+        try:
+            if espejo_disponible():
+                sincronizar_directorio()
+        except Exception:
+            logger.exception("Could not sync the LDAP directory mirror after bulk provisioning")
+    return filas
+
+
+def informe_csv(filas):
+    """Informe por fila en CSV: fila, username, resultado y detalle"""
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(['fila', 'username', 'resultado', 'detalle'])
+    for fila in filas:
+        escritor.writerow([fila.numero, fila.username, fila.resultado or ERROR, fila.detalle])
+    return salida.getvalue()
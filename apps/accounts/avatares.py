@@ -0,0 +1,166 @@
+"""
+Miniaturas de CustomUser.avatar.
+
+El avatar se guarda tal cual lo sube el usuario (a veces fotos de varios MB),
+así que las páginas usan en su lugar miniaturas cuadradas de tamaño fijo
+(TAMANOS, en píxeles) en WebP y, para navegadores sin WebP, en JPEG.
+
+Los ficheros se llaman por el hash del contenido del original
+(profiles/miniaturas/<hash>-<tamaño>.<formato>): dos usuarios con la misma
+imagen comparten miniaturas, volver a generarlas no crea copias y, como el
+nombre cambia con la imagen, se pueden servir con caché de larga duración.
+Las rutas generadas se guardan en CustomUser.avatar_thumbnails.
+
+Las miniaturas se generan al guardar un avatar nuevo (tarea de Celery tras
+confirmar la transacción) y, para los que ya existían, con el comando
+generate_avatar_thumbnails.
+"""
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .models import CustomUser
+
+
+logger = logging.getLogger(__name__)
+
+TAMANOS = (40, 96, 256)
+# formato: (formato de Pillow, opciones al guardar)
+FORMATOS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+CARPETA = 'profiles/miniaturas'
+# Avatar que reciben los usuarios que no suben ninguno
+AVATAR_POR_DEFECTO = CustomUser._meta.get_field('avatar').default
+
+
+def huella(contenido):
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def ruta(hash_origen, tamano, formato):
+    return f"{CARPETA}/{hash_origen[:20]}-{tamano}.{formato}"
+
+
+def generar_miniaturas(contenido):
+    """
+    {tamaño: {formato: bytes}} a partir de los bytes de una imagen. No toca la
+    base de datos ni el almacenamiento, así que se puede ejecutar en otro proceso.
+    """
+    imagen = Image.open(io.BytesIO(contenido))
+    # En JPEG decodifica directamente a menor resolución (mucho más rápido)
+    imagen.draft('RGB', (max(TAMANOS) * 2, max(TAMANOS) * 2))
+    imagen = ImageOps.exif_transpose(imagen)
+    if imagen.mode not in ('RGB', 'L'):
+        # Sin transparencia: fondo blanco
+        fondo = Image.new('RGB', imagen.size, 'white')
+        fondo.paste(imagen, mask=imagen.convert('RGBA').getchannel('A'))
+        imagen = fondo
+    imagen = imagen.convert('RGB')
+
+    miniaturas = {}
+    for tamano in sorted(TAMANOS, reverse=True):
+        # Cada tamaño a partir del anterior, que ya es pequeño
+        imagen = ImageOps.fit(imagen, (tamano, tamano), Image.LANCZOS)
+        miniaturas[tamano] = {}
+        for formato, (formato_pil, opciones) in FORMATOS.items():
+            salida = io.BytesIO()
+            imagen.save(salida, formato_pil, **opciones)
+            miniaturas[tamano][formato] = salida.getvalue()
+    return miniaturas
+
+
+def guardar_ficheros(hash_origen, miniaturas):
+    """Guarda los ficheros de generar_miniaturas() que falten y devuelve sus rutas"""
+    rutas = {}
+    for tamano, formatos in miniaturas.items():
+        rutas[str(tamano)] = {}
+        for formato, datos in formatos.items():
+            nombre = ruta(hash_origen, tamano, formato)
+            if not default_storage.exists(nombre):
+                nombre = default_storage.save(nombre, ContentFile(datos))
+            rutas[str(tamano)][formato] = nombre
+    return rutas
+
+
+def anotar(usuarios, origen, hash_origen, rutas):
+    """Guarda en los usuarios (queryset) las rutas de las miniaturas de `origen`"""
+    datos = {'source': origen, 'sha256': hash_origen, 'sizes': rutas}
+    # update() para no volver a disparar post_save (ni invalidar la caché de usuarios)
+    usuarios.update(avatar_thumbnails=datos)
+    return datos
+
+
+def leer_avatar(usuario):
+    """Bytes del avatar del usuario, o None si no tiene o el fichero no existe"""
+    if not usuario.avatar:
+        return None
+    try:
+        with default_storage.open(usuario.avatar.name, 'rb') as fichero:
+            return fichero.read()
+    except (FileNotFoundError, OSError):
+        logger.warning("Avatar file %s of user %s not found", usuario.avatar.name, usuario.pk)
+        return None
+
+
+def al_dia(usuario):
+    """True si las miniaturas guardadas corresponden al avatar actual"""
+    miniaturas = usuario.avatar_thumbnails or {}
+    return bool(usuario.avatar) and miniaturas.get('source') == usuario.avatar.name
+
+
+def actualizar_miniaturas(usuario, forzar=False):
+    """Genera y guarda las miniaturas del avatar si no están al día"""
+    if not forzar and al_dia(usuario):
+        return False
+    contenido = leer_avatar(usuario)
+    if contenido is None:
+        return False
+    try:
+        miniaturas = generar_miniaturas(contenido)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning("Avatar %s of user %s is not a valid image", usuario.avatar.name, usuario.pk)
+        return False
+    hash_origen = huella(contenido)
+    usuario.avatar_thumbnails = anotar(
+        CustomUser.objects.filter(pk=usuario.pk), usuario.avatar.name, hash_origen,
+        guardar_ficheros(hash_origen, miniaturas),
+    )
+    return True
+
+
+def url_miniatura(usuario, tamano, formato='webp'):
+    """
+    URL de la miniatura más pequeña que cubra `tamano`, o la del avatar original
+    si aún no tiene miniaturas. None si el usuario no tiene avatar.
+    """
+    if not usuario.avatar:
+        return None
+    if al_dia(usuario):
+        tamanos = usuario.avatar_thumbnails['sizes']
+        for candidato in sorted(TAMANOS):
+            if candidato >= tamano or candidato == max(TAMANOS):
+                nombre = tamanos.get(str(candidato), {}).get(formato)
+                if nombre:
+                    return default_storage.url(nombre)
+    return usuario.avatar.url
+
+
+@receiver(post_save, sender=CustomUser)
+def avatar_guardado(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if not instance.avatar or instance.avatar.name == AVATAR_POR_DEFECTO or al_dia(instance):
+        return
+    from .tasks import generar_miniaturas_avatar
+
+    usuario_id = instance.pk
+    transaction.on_commit(lambda: generar_miniaturas_avatar.delay(usuario_id))
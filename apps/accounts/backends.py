@@ -0,0 +1,58 @@
+import logging
+from contextvars import ContextVar
+
+import ldap
+from django.dispatch import receiver
+from django_auth_ldap.backend import LDAPBackend, ldap_error
+
+from . import circuito_ldap
+from .mediciones import medir_ldap
+
+
+logger = logging.getLogger(__name__)
+
+# Network errors that mean the directory is unreachable. Anything else
+# (wrong password, unknown user...) is an answer from the server.
+NETWORK_ERRORS = tuple(
+    getattr(ldap, nombre) for nombre in ('SERVER_DOWN', 'TIMEOUT', 'CONNECT_ERROR') if hasattr(ldap, nombre)
+)
+
+# Set by the ldap_error receiver during the current authenticate() call
+_network_error = ContextVar('ldap_network_error', default=False)
+
+
+class CircuitBreakerLDAPBackend(LDAPBackend):
+    """
+    LDAPBackend behind the circuit breaker in circuito_ldap: while the
+    directory is down logins skip LDAP and go straight to the next backend.
+    """
+
+    @medir_ldap
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if not username or not password:
+            return super().authenticate(request, username, password, **kwargs)
+
+        if not circuito_ldap.permitir():
+            logger.debug("LDAP circuit open, skipping LDAP login for %s", username)
+            return None
+
+        token = _network_error.set(False)
+        try:
+            user = super().authenticate(request, username, password, **kwargs)
+            failed = _network_error.get()
+        finally:
+            _network_error.reset(token)
+
+        if failed:
+            circuito_ldap.fallo()
+        else:
+            circuito_ldap.exito()
+        return user
+
+
+@receiver(ldap_error, sender=CircuitBreakerLDAPBackend)
+def record_network_error(sender, context=None, exception=None, **kwargs):
+    # django-auth-ldap only logs the error when nobody listens to ldap_error
+    logger.warning("Caught LDAPError during %s: %s", context, exception)
+    if context == 'authenticate' and isinstance(exception, NETWORK_ERRORS):
+        _network_error.set(True)
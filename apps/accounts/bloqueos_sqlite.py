@@ -0,0 +1,77 @@
+"""
+Escrituras de fichajes con SQLite bajo concurrencia.
+
+SQLite admite un solo escritor a la vez. Con WAL, BEGIN IMMEDIATE y el
+timeout de settings.DATABASES los escritores esperan su turno, pero la espera
+de SQLite comprueba el bloqueo a intervalos de hasta 100 ms, así que en la hora
+punta de fichajes (cientos de entradas en pocos minutos) la cola se dispara
+aunque cada escritura dure unos milisegundos.
+
+reintentar_si_bloqueada() hace dos cosas:
+
+- Dentro de un proceso, los hilos que escriben fichajes esperan su turno en
+  un cerrojo de Python, que despierta al siguiente en cuanto queda libre, y
+  solo compiten por el bloqueo de SQLite con otros procesos.
+- Si aun así SQLite responde "database is locked" (se agotó el timeout, o
+  lo devuelve al momento mientras otra conexión vuelca el WAL), repite la
+  operación unas pocas veces esperando un tiempo aleatorio entre 0 y un
+  máximo que se duplica en cada intento ("full jitter"), para que las
+  peticiones que chocaron no vuelvan a intentarlo todas a la vez.
+
+Solo reintenta fuera de una transacción: dentro de atomic() el error se
+propaga para que se repita la transacción entera. En Postgres no hay cerrojo
+ni se produce este error, así que el decorador no hace nada.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+logger = logging.getLogger(__name__)
+
+# Reentrante: una acción decorada puede llamar a otra
+_escritor = threading.RLock()
+
+
+def bloqueada(error):
+    return isinstance(error, OperationalError) and 'database is locked' in str(error)
+
+
+def espera(intento):
+    """Segundos a esperar antes del reintento `intento` (0, 1, ...)"""
+    base = getattr(settings, 'SQLITE_LOCK_BACKOFF', 0.05)
+    maximo = getattr(settings, 'SQLITE_LOCK_BACKOFF_MAX', 1.0)
+    return random.uniform(0, min(maximo, base * 2 ** intento))
+
+
+def _turno(conexion):
+    return _escritor if conexion.vendor == 'sqlite' else nullcontext()
+
+
+def reintentar_si_bloqueada(funcion):
+    @wraps(funcion)
+    def envoltorio(*args, **kwargs):
+        conexion = transaction.get_connection()
+        intento = 0
+        while True:
+            try:
+                with _turno(conexion):
+                    return funcion(*args, **kwargs)
+            except OperationalError as e:
+                if (
+                    not bloqueada(e)
+                    or intento >= getattr(settings, 'SQLITE_LOCK_RETRIES', 4)
+                    or conexion.in_atomic_block
+                ):
+                    raise
+                pausa = espera(intento)
+                intento += 1
+                logger.info("Database locked in %s, retry %d in %.3f s", funcion.__name__, intento, pausa)
+                time.sleep(pausa)
+    return envoltorio
@@ -0,0 +1,237 @@
+"""
+Caché en dos niveles para datos que cambian poco y se leen en cada petición.
+
+- L1: caché local del proceso (alias 'local' de CACHES), sin red ni disco.
+- L2: caché compartida entre procesos (alias 'default': Redis, fichero o BD).
+
+La invalidación usa contadores de generación guardados en L2: cada entrada se
+guarda con la generación actual de los grupos de los que depende ('proyectos',
+'fichajes', 'usuarios') como parte de la clave, y al escribir en esos modelos
+se incrementa el contador, así que las entradas antiguas dejan de leerse sin
+tener que buscarlas ni borrarlas. Los demás procesos ven el cambio en cuanto
+caduca su copia L1 de la generación (CACHE_GENERATION_L1_TIMEOUT segundos).
+
+Cada uso (UsoCache) cuenta sus aciertos en L1, en L2 y sus fallos; los
+contadores se acumulan en memoria y se vuelcan a L2 cada
+CACHE_STATS_FLUSH_INTERVAL segundos para que sean visibles desde cualquier proceso.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CustomUser, Proyecto
+from .rollups import agregar_resumenes, resumenes_actualizados
+
+
+PREFIJO = 'accounts'
+RESULTADOS = ('l1', 'l2', 'miss')
+
+_usos = {}
+_pendientes = Counter()
+_lock = threading.Lock()
+_ultimo_volcado = time.monotonic()
+
+
+def _l1():
+    return caches['local'] if 'local' in settings.CACHES else caches['default']
+
+
+def _l2():
+    return caches['default']
+
+
+def _clave_generacion(grupo):
+    return f'{PREFIJO}:gen:{grupo}'
+
+
+def _generaciones(grupos):
+    """Generación actual de cada grupo, leída de L1 y, si no está, de L2"""
+    claves = [_clave_generacion(grupo) for grupo in grupos]
+    valores = _l1().get_many(claves)
+
+    faltan = [clave for clave in claves if clave not in valores]
+    if faltan:
+        remotos = _l2().get_many(faltan)
+        for clave in faltan:
+            if clave not in remotos:
+                # Empezar en un valor que no pueda repetir uno anterior aunque
+                # L2 haya perdido el contador
+                _l2().add(clave, time.time_ns(), timeout=None)
+                remotos[clave] = _l2().get(clave, time.time_ns())
+        _l1().set_many(remotos, timeout=getattr(settings, 'CACHE_GENERATION_L1_TIMEOUT', 5))
+        valores.update(remotos)
+
+    return [valores[clave] for clave in claves]
+
+
+def invalidar(*grupos):
+    """
+    Incrementa la generación de los grupos cuando la transacción en curso se
+    confirma, para que nadie vuelva a cachear los datos antiguos entre medias.
+    """
+    transaction.on_commit(lambda: _incrementar(grupos))
+
+
+def _incrementar(grupos):
+    for grupo in grupos:
+        clave = _clave_generacion(grupo)
+        try:
+            _l2().incr(clave)
+        except ValueError:
+            _l2().set(clave, time.time_ns(), timeout=None)
+    # En este proceso el cambio se ve de inmediato
+    _l1().delete_many([_clave_generacion(grupo) for grupo in grupos])
+
+
+def _contar(uso, resultado):
+    global _ultimo_volcado
+    with _lock:
+        _pendientes[(uso, resultado)] += 1
+        ahora = time.monotonic()
+        if ahora - _ultimo_volcado < getattr(settings, 'CACHE_STATS_FLUSH_INTERVAL', 10):
+            return
+        _ultimo_volcado = ahora
+    volcar_contadores()
+
+
+def _clave_contador(uso, resultado):
+    return f'{PREFIJO}:stats:{uso}:{resultado}'
+
+
+def volcar_contadores():
+    """Suma a L2 los aciertos y fallos acumulados en este proceso"""
+    with _lock:
+        pendientes = dict(_pendientes)
+        _pendientes.clear()
+
+    for (uso, resultado), cantidad in pendientes.items():
+        clave = _clave_contador(uso, resultado)
+        try:
+            _l2().incr(clave, cantidad)
+        except ValueError:
+            if not _l2().add(clave, cantidad, timeout=None):
+                _l2().incr(clave, cantidad)
+
+
+def estadisticas():
+    """Aciertos L1, aciertos L2 y fallos de cada uso, sumando todos los procesos"""
+    volcar_contadores()
+    claves = [_clave_contador(uso, resultado) for uso in _usos for resultado in RESULTADOS]
+    valores = _l2().get_many(claves)
+
+    filas = []
+    for uso in _usos.values():
+        fila = {
+            'uso': uso.nombre,
+            'descripcion': uso.descripcion,
+            **{resultado: valores.get(_clave_contador(uso.nombre, resultado), 0) for resultado in RESULTADOS},
+        }
+        total = fila['l1'] + fila['l2'] + fila['miss']
+        fila['total'] = total
+        fila['ratio'] = (fila['l1'] + fila['l2']) / total if total else None
+        filas.append(fila)
+    return filas
+
+
+class UsoCache:
+    """
+    Un uso concreto de la caché: nombre, grupos de los que depende y tiempo
+    máximo de vida en L2. El tiempo en L1 lo marca el alias 'local'.
+    """
+
+    def __init__(self, nombre, grupos, timeout, descripcion=''):
+        self.nombre = nombre
+        self.grupos = tuple(grupos)
+        self.timeout = timeout
+        self.descripcion = descripcion
+        _usos[nombre] = self
+
+    def clave(self, *partes):
+        generaciones = '.'.join(str(generacion) for generacion in _generaciones(self.grupos))
+        resumen = hashlib.md5(repr(partes).encode()).hexdigest()
+        return f'{PREFIJO}:{self.nombre}:{generaciones}:{resumen}'
+
+    def obtener(self, calcular, *partes):
+        """
+        Devuelve el valor cacheado para `partes` o lo calcula con `calcular()`.
+        Las partes deben identificar el resultado (fechas, filtros, ids...).
+        """
+        clave = self.clave(*partes)
+
+        valor = _l1().get(clave)
+        if valor is not None:
+            _contar(self.nombre, 'l1')
+            return valor
+
+        valor = _l2().get(clave)
+        if valor is not None:
+            _contar(self.nombre, 'l2')
+            _l1().set(clave, valor)
+            return valor
+
+        _contar(self.nombre, 'miss')
+        valor = calcular()
+        _l2().set(clave, valor, timeout=self.timeout)
+        _l1().set(clave, valor)
+        return valor
+
+
+PROYECTOS_ACTIVOS = UsoCache(
+    'proyectos_activos', ('proyectos',), timeout=24 * 3600,
+    descripcion='Lista de proyectos activos (página de fichaje)',
+)
+ESTADISTICAS_DASHBOARD = UsoCache(
+    'estadisticas_dashboard', ('proyectos', 'fichajes', 'usuarios'), timeout=15 * 60,
+    descripcion='Estadísticas del dashboard de reportes',
+)
+RESULTADOS_REPORTES = UsoCache(
+    'resultados_reportes', ('proyectos', 'fichajes', 'usuarios'), timeout=60 * 60,
+    descripcion='Totales de los reportes por rango de fechas',
+)
+TOTAL_USUARIOS = UsoCache(
+    'total_usuarios', ('usuarios',), timeout=60 * 60,
+    descripcion='Total de usuarios por filtro (listado de usuarios Django)',
+)
+
+
+def proyectos_activos():
+    """Proyectos activos ordenados como en el modelo"""
+    return PROYECTOS_ACTIVOS.obtener(lambda: list(Proyecto.objects.filter(activo=True)))
+
+
+def agregar_resumenes_en_cache(campos, fecha_desde=None, fecha_hasta=None, **filtros):
+    """
+    agregar_resumenes() a través de la caché. Los filtros deben ser valores
+    simples (ids, booleanos), no instancias de modelos.
+    """
+    return RESULTADOS_REPORTES.obtener(
+        lambda: agregar_resumenes(campos, fecha_desde, fecha_hasta, **filtros),
+        tuple(campos), fecha_desde, fecha_hasta, sorted(filtros.items()),
+    )
+
+
+@receiver([post_save, post_delete], sender=Proyecto)
+def proyecto_modificado(sender, **kwargs):
+    invalidar('proyectos')
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def usuario_modificado(sender, update_fields=None, **kwargs):
+    # El login solo actualiza last_login, que no aparece en ningún reporte
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidar('usuarios')
+
+
+@receiver(resumenes_actualizados)
+def fichajes_modificados(sender, **kwargs):
+    # Los cambios de fichajes (save, delete, update en una sentencia, lotes
+    # del API) pasan todos por el recálculo de resúmenes
+    invalidar('fichajes')
@@ -0,0 +1,105 @@
+"""
+Cortocircuito (circuit breaker) del login contra LDAP.
+
+Si el servidor LDAP está caído o no responde, cada login esperaba el timeout
+de TCP antes de pasar a ModelBackend, incluso el de los superusuarios locales.
+El circuito deja de intentarlo durante un tiempo después de varios fallos:
+
+- cerrado: se intenta LDAP con normalidad. Cada fallo de red (SERVER_DOWN o
+  TIMEOUT) suma uno; un login que llega al servidor, acierte o no la
+  contraseña, pone la cuenta a cero.
+- abierto: tras LDAP_BREAKER_FAILURE_THRESHOLD fallos seguidos no se intenta
+  LDAP durante LDAP_BREAKER_COOLDOWN segundos y el login pasa directamente al
+  siguiente backend.
+- semiabierto: pasado ese tiempo se deja pasar un único login como sonda (los
+  demás siguen sin intentar LDAP). Si llega al servidor el circuito se cierra;
+  si falla se vuelve a abrir otro periodo completo. Si la sonda no termina en
+  LDAP_BREAKER_PROBE_TIMEOUT segundos se permite otra.
+
+El estado se guarda en la caché 'default', compartida por todos los procesos,
+así que basta con que los fallos se produzcan en varios workers para que
+ninguno siga esperando al servidor.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+CLAVE_FALLOS = 'accounts:ldap:circuito:fallos'
+CLAVE_ABIERTO = 'accounts:ldap:circuito:abierto_hasta'
+CLAVE_SONDA = 'accounts:ldap:circuito:sonda'
+
+
+def _cache():
+    return caches['default']
+
+
+def estado():
+    """Estado actual del circuito: CERRADO, ABIERTO o SEMIABIERTO"""
+    abierto_hasta = _cache().get(CLAVE_ABIERTO)
+    if abierto_hasta is None:
+        return CERRADO
+    return ABIERTO if time.time() < abierto_hasta else SEMIABIERTO
+
+
+def permitir():
+    """
+    True si este login debe intentar LDAP. En semiabierto solo lo devuelve
+    para la primera petición, que hace de sonda.
+    """
+    actual = estado()
+    if actual == CERRADO:
+        return True
+    if actual == ABIERTO:
+        return False
+    return _cache().add(CLAVE_SONDA, True, timeout=getattr(settings, 'LDAP_BREAKER_PROBE_TIMEOUT', 10))
+
+
+def exito():
+    """El servidor ha respondido: cierra el circuito si hacía falta"""
+    cache = _cache()
+    anterior = cache.get_many([CLAVE_FALLOS, CLAVE_ABIERTO])
+    if anterior:
+        if CLAVE_ABIERTO in anterior:
+            logger.info("Servidor LDAP disponible de nuevo, se cierra el circuito")
+        cache.delete_many([CLAVE_FALLOS, CLAVE_ABIERTO, CLAVE_SONDA])
+
+
+def fallo():
+    """El servidor no ha respondido: cuenta el fallo y abre el circuito si toca"""
+    cache = _cache()
+    if cache.get(CLAVE_ABIERTO) is not None:
+        # Ha fallado la sonda (o un login que empezó antes de abrirse)
+        _abrir()
+        return
+
+    cache.add(CLAVE_FALLOS, 0, timeout=None)
+    try:
+        fallos = cache.incr(CLAVE_FALLOS)
+    except ValueError:
+        # La clave ha caducado o se ha borrado entre medias
+        cache.set(CLAVE_FALLOS, 1, timeout=None)
+        fallos = 1
+    if fallos >= getattr(settings, 'LDAP_BREAKER_FAILURE_THRESHOLD', 3):
+        _abrir()
+
+
+def _abrir():
+    espera = getattr(settings, 'LDAP_BREAKER_COOLDOWN', 30)
+    cache = _cache()
+    cache.set(CLAVE_ABIERTO, time.time() + espera, timeout=None)
+    cache.delete(CLAVE_SONDA)
+    logger.warning("Servidor LDAP no disponible, no se intentará durante %s segundos", espera)
+
+
+def reiniciar():
+    """Vuelve a cerrar el circuito (pruebas, o a mano tras arreglar el servidor)"""
+    _cache().delete_many([CLAVE_FALLOS, CLAVE_ABIERTO, CLAVE_SONDA])
@@ -0,0 +1,241 @@
+"""
+Registro de consultas lentas con su plan de ejecución.
+
+Cada conexión lleva un execute_wrapper (se añade al abrirla, con la señal
+connection_created) que cronometra las consultas. Las que tardan más de
+SLOW_QUERY_THRESHOLD_MS:
+
+- Se escriben en el logger apps.accounts.consultas_lentas como WARNING, con
+  el SQL, los parámetros, la vista de la petición en curso y el primer frame
+  del código del proyecto que la lanzó.
+- Se acumulan en ConsultaLenta por huella: el SQL normalizado (literales,
+  parámetros y listas IN de cualquier longitud se sustituyen), así que la
+  misma consulta con otros valores cuenta como la misma. La primera vez que
+  aparece una huella se guarda el EXPLAIN (EXPLAIN QUERY PLAN en SQLite) del
+  ejemplo; solo de SELECT, el resto no se explica.
+
+`python manage.py slow_queries` muestra las huellas con más tiempo total.
+
+Las consultas lentas se acumulan en memoria, en este proceso, y se escriben
+fuera de la transacción de quien las lanzó: al momento si la conexión está en
+autocommit y, si no, con transaction.on_commit al confirmarse. Así registrar
+una SELECT lenta no la convierte en escritura dentro de la transacción (en
+SQLite con transaction_mode IMMEDIATE) ni deja filas bloqueadas hasta el
+commit (Postgres). Si la transacción se deshace, lo acumulado se escribe con
+el siguiente volcado. Un fallo al registrar se escribe en el log y no afecta
+a la consulta. SLOW_QUERY_THRESHOLD_MS vale 0 por defecto: desactivado, el
+wrapper solo lee el ajuste.
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+_LISTA_IN = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_CADENA = re.compile(r"'(?:[^']|'')*'")
+_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_ESPACIOS = re.compile(r'\s+')
+
+# Mientras se registra una consulta lenta, sus propias consultas no se miden
+_registrando = ContextVar('registrando_consulta_lenta', default=False)
+
+# (alias, huella) -> datos acumulados desde el último volcado
+_pendientes = {}
+_lock = threading.Lock()
+
+
+def normalizar(sql):
+    """SQL sin valores concretos: parámetros y literales como ?, listas IN como IN (...)"""
+    sql = _CADENA.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _NUMERO.sub('?', sql)
+    sql = _LISTA_IN.sub('IN (...)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+def huella(sql_normalizado):
+    return hashlib.sha1(sql_normalizado.encode('utf-8')).hexdigest()
+
+
+def umbral():
+    """Segundos a partir de los que una consulta es lenta (None: desactivado)"""
+    milisegundos = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 0)
+    return milisegundos / 1000 if milisegundos else None
+
+
+def origen():
+    """fichero:línea en función del primer frame del proyecto en la pila (sin contar este módulo)"""
+    base = str(settings.BASE_DIR) + os.sep
+    frame = sys._getframe(1)
+    while frame is not None:
+        fichero = frame.f_code.co_filename
+        if fichero.startswith(base) and 'site-packages' not in fichero and fichero != __file__:
+            return f'{os.path.relpath(fichero, base)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return ''
+
+
+def vista_actual():
+    """Nombre de la vista de la petición que está en la pila, si la hay"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        request = frame.f_locals.get('request')
+        coincidencia = getattr(request, 'resolver_match', None)
+        if coincidencia is not None:
+            return coincidencia.view_name
+        frame = frame.f_back
+    return ''
+
+
+def _plan_sqlite(filas):
+    # Filas (id, padre, -, detalle): se sangra cada nodo según su profundidad
+    profundidad = {0: -1}
+    lineas = []
+    for id_nodo, padre, _, detalle in filas:
+        profundidad[id_nodo] = profundidad.get(padre, -1) + 1
+        lineas.append('  ' * profundidad[id_nodo] + detalle)
+    return '\n'.join(lineas)
+
+
+def explicar(conexion, sql, params):
+    """Plan de ejecución de una SELECT como texto ('' si no es una SELECT)"""
+    if not re.match(r'\s*(SELECT|WITH)\b', sql, re.IGNORECASE):
+        return ''
+    with conexion.cursor() as cursor:
+        cursor.execute(f'{conexion.ops.explain_query_prefix()} {sql}', params)
+        filas = cursor.fetchall()
+    if conexion.vendor == 'sqlite':
+        return _plan_sqlite(filas)
+    return '\n'.join(' '.join(str(valor) for valor in fila) for fila in filas)
+
+
+def _sumar(consultas, clave, muestra):
+    """Suma las ejecuciones acumuladas a la huella; devuelve si ya existía"""
+    return consultas.filter(huella=clave).update(
+        ejecuciones=F('ejecuciones') + muestra['ejecuciones'],
+        tiempo_total=F('tiempo_total') + muestra['tiempo_total'],
+        tiempo_maximo=Greatest('tiempo_maximo', muestra['tiempo_maximo']),
+        ultima=muestra['ultima'],
+    )
+
+
+def _guardar(alias, clave, muestra):
+    from .models import ConsultaLenta
+
+    consultas = ConsultaLenta.objects.using(alias)
+    if _sumar(consultas, clave, muestra):
+        return
+
+    conexion = connections[alias]
+    try:
+        with transaction.atomic(using=alias):
+            plan = explicar(conexion, muestra['ejemplo'], muestra['params'])
+    except DatabaseError as e:
+        plan = f'EXPLAIN failed: {e}'
+    try:
+        with transaction.atomic(using=alias):
+            consultas.create(
+                huella=clave, sql=muestra['sql'], ejemplo=muestra['ejemplo'], parametros=repr(muestra['params']),
+                plan=plan, vista=muestra['vista'], origen=muestra['origen'][:300],
+                ejecuciones=muestra['ejecuciones'], tiempo_total=muestra['tiempo_total'],
+                tiempo_maximo=muestra['tiempo_maximo'], ultima=muestra['ultima'],
+            )
+    except IntegrityError:
+        # Otro proceso la creó entre medias
+        _sumar(consultas, clave, muestra)
+
+
+def volcar(alias='default'):
+    """
+    Escribe en ConsultaLenta las consultas lentas de `alias` acumuladas en este
+    proceso; dentro de una transacción, cuando se confirme.
+    """
+    if connections[alias].in_atomic_block:
+        transaction.on_commit(lambda: _escribir(alias), using=alias)
+    else:
+        _escribir(alias)
+
+
+def _escribir(alias):
+    with _lock:
+        claves = [clave for clave in _pendientes if clave[0] == alias]
+        pendientes = {clave: _pendientes.pop(clave) for clave in claves}
+
+    token = _registrando.set(True)
+    try:
+        for (_, clave), muestra in pendientes.items():
+            try:
+                _guardar(alias, clave, muestra)
+            except Exception:
+                logger.exception("Could not record slow query")
+    finally:
+        _registrando.reset(token)
+
+
+def registrar(conexion, sql, params, duracion):
+    sql_normalizado = normalizar(sql)
+    clave = huella(sql_normalizado)
+    vista = vista_actual()
+    donde = origen()
+    logger.warning(
+        "Slow query (%.0f ms) in %s at %s: %s; params=%r",
+        duracion * 1000, vista or '-', donde or '-', sql, params,
+        extra={'consulta_lenta': {
+            'huella': clave, 'ms': round(duracion * 1000, 1), 'vista': vista, 'origen': donde,
+        }},
+    )
+
+    with _lock:
+        # El ejemplo, su plan y la vista son los de la primera ejecución desde el último volcado
+        muestra = _pendientes.setdefault((conexion.alias, clave), {
+            'sql': sql_normalizado, 'ejemplo': sql, 'params': params, 'vista': vista, 'origen': donde,
+            'ejecuciones': 0, 'tiempo_total': 0, 'tiempo_maximo': 0,
+        })
+        muestra['ejecuciones'] += 1
+        muestra['tiempo_total'] += duracion
+        muestra['tiempo_maximo'] = max(muestra['tiempo_maximo'], duracion)
+        muestra['ultima'] = timezone.now()
+    volcar(conexion.alias)
+
+
+def cronometrar(execute, sql, params, many, context):
+    """execute_wrapper de todas las conexiones"""
+    limite = umbral()
+    if limite is None or many or _registrando.get():
+        return execute(sql, params, many, context)
+
+    empezar = time.perf_counter()
+    resultado = execute(sql, params, many, context)
+    duracion = time.perf_counter() - empezar
+    if duracion >= limite:
+        token = _registrando.set(True)
+        try:
+            registrar(context['connection'], sql, params, duracion)
+        except Exception:
+            logger.exception("Could not record slow query")
+        finally:
+            _registrando.reset(token)
+    return resultado
+
+
+@receiver(connection_created)
+def instalar(sender, connection, **kwargs):
+    # El primero de la lista es el más exterior, y así connection.execute_wrapper()
+    # (que quita el último al salir) no lo retira aunque la conexión se abra dentro
+    if cronometrar not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, cronometrar)
@@ -0,0 +1,203 @@
+"""
+Datos sintéticos de fichajes para medir los reportes a escala.
+
+sembrar() crea usuarios, proyectos y registros de fichaje con una forma
+parecida a la real, para que los planes de consulta y los tiempos se parezcan
+a los de producción:
+
+- Se ficha casi todos los días laborables (con bajas y vacaciones) y muy
+  pocos fines de semana.
+- Cada usuario tiene un proyecto y una jornada habituales, con cambios
+  ocasionales, y un turno: mañana, tarde o noche (la salida es al día
+  siguiente y horas_trabajadas lo tiene en cuenta como calcular_horas()).
+- Algunos registros no tienen salida (olvidos) o no tienen proyecto.
+
+Los registros se generan hacia atrás desde `fecha_fin`, un día cada vez,
+hasta llegar a `registros`, y se insertan con bulk_create en bloques, con
+horas_trabajadas ya calculada. Al final se reconstruyen los resúmenes de los
+reportes. Todo lo creado lleva `prefijo` en el username y en el nombre del
+proyecto, y borrar() lo elimina.
+
+Con la misma semilla se generan siempre los mismos datos.
+"""
+import random
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import invalidar
+from .models import CustomUser, Proyecto, RegistroFichaje
+from .rollups import reconstruir_resumenes
+
+
+PREFIJO = 'seed_'
+CHUNK_SIZE = 5000
+
+ROLES = {'user': 82, 'tech': 10, 'hr': 5, 'admin': 3}
+JORNADAS = {'presencial': 60, 'remoto': 30, 'desplazamiento': 10}
+TURNOS = {'manana': 80, 'tarde': 14, 'noche': 6}
+# turno: (hora de entrada media, minutos de desviación, duración media en minutos)
+HORARIOS = {
+    'manana': (time(8, 30), 25, 8 * 60),
+    'tarde': (time(14, 0), 20, 7 * 60 + 30),
+    'noche': (time(22, 0), 15, 8 * 60),
+}
+
+PROB_LABORABLE = 0.92       # el resto: vacaciones, bajas, días libres
+PROB_FIN_DE_SEMANA = 0.04
+PROB_OTRO_PROYECTO = 0.15
+PROB_OTRA_JORNADA = 0.25
+PROB_SIN_PROYECTO = 0.02
+PROB_SIN_SALIDA = 0.03
+PROB_INACTIVO = 0.05
+PROB_PROYECTO_INACTIVO = 0.15
+
+
+def usuarios_para(registros):
+    """Plantilla por defecto para un volumen: ~1000 registros (4 años) por usuario"""
+    return min(max(registros // 1000, 20), 5000)
+
+
+def proyectos_para(usuarios):
+    return max(usuarios // 20, 5)
+
+
+def _elegir(aleatorio, pesos):
+    return aleatorio.choices(list(pesos), weights=list(pesos.values()))[0]
+
+
+class _Perfil:
+    """Hábitos de un usuario sintético"""
+
+    def __init__(self, usuario_id, aleatorio, proyectos):
+        self.usuario_id = usuario_id
+        self.proyecto_id = aleatorio.choice(proyectos)
+        self.jornada = _elegir(aleatorio, JORNADAS)
+        self.horario = HORARIOS[_elegir(aleatorio, TURNOS)]
+
+
+def _registro(perfil, fecha, aleatorio, proyectos):
+    entrada_media, desviacion, duracion_media = perfil.horario
+    entrada = datetime.combine(fecha, entrada_media) + timedelta(minutes=round(aleatorio.gauss(0, desviacion)))
+    duracion = timedelta(minutes=round(min(max(aleatorio.gauss(duracion_media, 40), 3 * 60), 12 * 60)))
+
+    proyecto_id = perfil.proyecto_id
+    if aleatorio.random() < PROB_SIN_PROYECTO:
+        proyecto_id = None
+    elif aleatorio.random() < PROB_OTRO_PROYECTO:
+        proyecto_id = aleatorio.choice(proyectos)
+    jornada = perfil.jornada
+    if aleatorio.random() < PROB_OTRA_JORNADA:
+        jornada = _elegir(aleatorio, JORNADAS)
+
+    # La entrada del turno de noche es antes de medianoche: el registro es de `fecha`
+    registro = RegistroFichaje(
+        usuario_id=perfil.usuario_id,
+        fecha=fecha,
+        hora_entrada=entrada.time(),
+        proyecto_id=proyecto_id,
+        jornada=jornada,
+    )
+    if aleatorio.random() >= PROB_SIN_SALIDA:
+        registro.hora_salida = (entrada + duracion).time()
+        registro.horas_trabajadas = duracion
+        registro.completo = True
+    return registro
+
+
+def generar_registros(perfiles, proyectos, registros, fecha_fin, aleatorio):
+    """Genera hasta `registros` RegistroFichaje, del día `fecha_fin` hacia atrás"""
+    generados = 0
+    fecha = fecha_fin
+    while True:
+        probabilidad = PROB_LABORABLE if fecha.weekday() < 5 else PROB_FIN_DE_SEMANA
+        for perfil in perfiles:
+            if aleatorio.random() < probabilidad:
+                yield _registro(perfil, fecha, aleatorio, proyectos)
+                generados += 1
+                if generados >= registros:
+                    return
+        fecha -= timedelta(days=1)
+
+
+def _en_bloques(modelo, objetos, chunk_size, progreso=None):
+    total = 0
+    bloque = []
+    for objeto in objetos:
+        bloque.append(objeto)
+        if len(bloque) >= chunk_size:
+            with transaction.atomic():
+                modelo.objects.bulk_create(bloque)
+            total += len(bloque)
+            bloque = []
+            if progreso:
+                progreso(total)
+    if bloque:
+        with transaction.atomic():
+            modelo.objects.bulk_create(bloque)
+        total += len(bloque)
+        if progreso:
+            progreso(total)
+    return total
+
+
+def sembrar(registros, usuarios=None, proyectos=None, prefijo=PREFIJO, semilla=42, fecha_fin=None,
+            chunk_size=CHUNK_SIZE, progreso=None):
+    """
+    Crea los datos sintéticos y reconstruye los resúmenes. Devuelve
+    {'usuarios': n, 'proyectos': n, 'registros': n}. `progreso(n)` se llama
+    tras insertar cada bloque de registros.
+    """
+    aleatorio = random.Random(semilla)
+    usuarios = usuarios or usuarios_para(registros)
+    proyectos = proyectos or proyectos_para(usuarios)
+    fecha_fin = fecha_fin or timezone.localdate()
+
+    ids_proyectos = [proyecto.id for proyecto in Proyecto.objects.bulk_create([
+        Proyecto(nombre=f'{prefijo}proyecto_{i}', activo=aleatorio.random() >= PROB_PROYECTO_INACTIVO)
+        for i in range(proyectos)
+    ])]
+    creados = CustomUser.objects.bulk_create([
+        CustomUser(
+            username=f'{prefijo}{i}', email=f'{prefijo}{i}@example.com', password='!',
+            first_name='Usuario', last_name=f'Sintético {i}', role=_elegir(aleatorio, ROLES),
+            is_active=aleatorio.random() >= PROB_INACTIVO,
+        )
+        for i in range(usuarios)
+    ], batch_size=chunk_size)
+    perfiles = [_Perfil(usuario.pk, aleatorio, ids_proyectos) for usuario in creados]
+
+    total = _en_bloques(
+        RegistroFichaje,
+        generar_registros(perfiles, ids_proyectos, registros, fecha_fin, aleatorio),
+        chunk_size,
+        progreso,
+    )
+    reconstruir_resumenes(chunk_size=chunk_size)
+    invalidar('usuarios', 'proyectos')
+    return {'usuarios': len(perfiles), 'proyectos': len(ids_proyectos), 'registros': total}
+
+
+def borrar(prefijo=PREFIJO):
+    """Borra los usuarios y proyectos sintéticos con sus registros; devuelve los registros borrados"""
+    usuarios = CustomUser.objects.filter(username__startswith=prefijo)
+    qn = connection.ops.quote_name
+    with transaction.atomic():
+        # Un solo DELETE: en cascada, la señal post_delete de los resúmenes haría
+        # que Django cargara y recalculara cada registro por separado. Solo tocan
+        # los resúmenes de los usuarios sintéticos, que se borran con ellos.
+        subconsulta, parametros = usuarios.values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(RegistroFichaje._meta.db_table)} "
+                f"WHERE {qn(RegistroFichaje._meta.get_field('usuario').column)} IN ({subconsulta})",
+                parametros,
+            )
+            borrados = cursor.rowcount
+        usuarios.delete()
+        # Las señales de Proyecto recalculan los resúmenes de otros usuarios con
+        # registros en estos proyectos (pasan a "sin proyecto")
+        Proyecto.objects.filter(nombre__startswith=prefijo).delete()
+    invalidar('usuarios', 'proyectos')
+    return borrados
@@ -0,0 +1,301 @@
+"""
+Búsqueda paginada de usuarios en el directorio LDAP.
+
+Las búsquedas piden solo los atributos que se muestran (uid, cn, mail, sn), de
+modo que nunca viajan los hash de userPassword, y usan el control Simple Paged
+Results (RFC 2696): el servidor devuelve como mucho `tamano` entradas y un
+cookie para pedir la siguiente página.
+
+El cookie solo vale en la conexión que hizo la búsqueda, y la siguiente
+petición HTTP puede llegar a otro proceso u obtener otra conexión del pool.
+Por eso el cursor que se da a la interfaz lleva también el número de página:
+si el servidor rechaza el cookie, la búsqueda se repite desde el principio
+hasta llegar a esa página.
+
+Las pantallas de administración no consultan el servidor en cada petición: leen
+la copia local (LdapDirectoryEntry) que mantiene sincronizar_directorio(). La
+búsqueda en vivo solo se usa mientras no se ha sincronizado nunca.
+
+La sincronización es incremental: pide solo las entradas con modifyTimestamp
+igual o posterior a la más reciente de la copia y guarda en bloque las que han
+cambiado (entryCSN o atributos). Las bajas se detectan con una segunda búsqueda
+que solo devuelve DNs; los CustomUser cuya entrada desaparece quedan marcados
+con ldap_missing_since.
+"""
+import base64
+import json
+from datetime import datetime, timezone as dt_timezone
+
+import ldap
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from ldap.controls import SimplePagedResultsControl
+from ldap.filter import escape_filter_chars
+
+from . import ldap_pool
+from .models import CustomUser, LdapDirectoryEntry, LdapDirectorySync
+
+
+BASE_USUARIOS = "ou=users,dc=example,dc=com"
+ATRIBUTOS = ['uid', 'cn', 'mail', 'sn']
+TAMANOS_PAGINA = (25, 50, 100, 200)
+TAMANO_PAGINA = 50
+# Atributos operacionales: el servidor solo los devuelve si se piden
+ATRIBUTOS_ESPEJO = ATRIBUTOS + ['modifyTimestamp', 'entryCSN']
+# Entradas por página al recorrer el directorio entero
+TAMANO_PAGINA_SINCRONIZACION = 500
+
+# Respuestas de OpenLDAP y otros servidores a un cookie de otra conexión o caducado
+_COOKIE_RECHAZADO = (ldap.UNWILLING_TO_PERFORM, ldap.PROTOCOL_ERROR)
+
+
+def filtro_usuarios(texto=''):
+    """Filtro LDAP de usuarios cuyo uid, nombre, apellido o email contiene `texto`"""
+    texto = texto.strip()
+    if not texto:
+        return '(objectClass=inetOrgPerson)'
+    valor = escape_filter_chars(texto)
+    condiciones = ''.join(f'({atributo}=*{valor}*)' for atributo in ATRIBUTOS)
+    return f'(&(objectClass=inetOrgPerson)(|{condiciones}))'
+
+
+def codificar_cursor(pagina, posicion):
+    """Cursor opaco con el número de página y el cookie LDAP (o el último DN de la copia)"""
+    datos = [pagina, base64.b64encode(posicion).decode()]
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(página, posición) de un cursor, o (1, b'') si no hay o no es válido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        pagina, cookie = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return max(int(pagina), 1), base64.b64decode(cookie)
+    except (ValueError, TypeError):
+        return 1, b''
+
+
+def _valor(atributos, nombre):
+    return atributos.get(nombre, [b''])[0].decode('utf-8')
+
+
+def _pagina(conexion, filtro, tamano, cookie, atributos=ATRIBUTOS):
+    """Una página de resultados: (entradas, cookie de la siguiente o b'')"""
+    control = SimplePagedResultsControl(True, size=tamano, cookie=cookie)
+    msgid = conexion.search_ext(
+        BASE_USUARIOS, ldap.SCOPE_SUBTREE, filtro, atributos, serverctrls=[control]
+    )
+    _, entradas, _, controles = conexion.result3(msgid)
+
+    siguiente = b''
+    for respuesta in controles:
+        if respuesta.controlType == SimplePagedResultsControl.controlType:
+            siguiente = respuesta.cookie
+    return [(dn, atributos) for dn, atributos in entradas if dn], siguiente
+
+
+def _recorrer(conexion, filtro, atributos):
+    """Todas las entradas del filtro, página a página en la misma conexión"""
+    cookie = b''
+    while True:
+        entradas, cookie = _pagina(conexion, filtro, TAMANO_PAGINA_SINCRONIZACION, cookie, atributos)
+        yield from entradas
+        if not cookie:
+            return
+
+
+class PaginaUsuarios:
+    """Una página de usuarios LDAP y el cursor de la siguiente"""
+
+    def __init__(self, usuarios, numero, cursor_siguiente):
+        self.usuarios = usuarios
+        self.numero = numero
+        self.cursor_siguiente = cursor_siguiente
+
+    @property
+    def hay_siguiente(self):
+        return self.cursor_siguiente is not None
+
+
+def buscar_usuarios(texto='', tamano=TAMANO_PAGINA, cursor=''):
+    """
+    PaginaUsuarios con los usuarios que coinciden con `texto` en la página del
+    cursor, buscando en el servidor LDAP
+    """
+    filtro = filtro_usuarios(texto)
+    numero, cookie = decodificar_cursor(cursor)
+
+    def buscar(conexion):
+        if cookie:
+            try:
+                return _pagina(conexion, filtro, tamano, cookie)
+            except _COOKIE_RECHAZADO:
+                pass
+        # Primera página, o el cookie era de otra conexión: avanzar desde el principio
+        siguiente = b''
+        for _ in range(numero - 1):
+            _, siguiente = _pagina(conexion, filtro, tamano, siguiente)
+            if not siguiente:
+                return [], b''
+        return _pagina(conexion, filtro, tamano, siguiente)
+
+    entradas, siguiente = ldap_pool.ejecutar(buscar, idempotente=True)
+    usuarios = [
+        {
+            'dn': dn,
+            'username': _valor(atributos, 'uid'),
+            'name': _valor(atributos, 'cn'),
+            'email': _valor(atributos, 'mail'),
+            'surname': _valor(atributos, 'sn'),
+        }
+        for dn, atributos in entradas
+    ]
+    return PaginaUsuarios(usuarios, numero, codificar_cursor(numero + 1, siguiente) if siguiente else None)
+
+
+def espejo_disponible():
+    """True si la copia local se ha sincronizado al menos una vez"""
+    return LdapDirectorySync.objects.filter(finished_at__isnull=False, error='').exists()
+
+
+def listar_espejo(texto='', tamano=TAMANO_PAGINA, cursor=''):
+    """Como buscar_usuarios() pero leyendo de la copia local, por orden de DN"""
+    numero, posicion = decodificar_cursor(cursor)
+    entradas = LdapDirectoryEntry.objects.order_by('dn')
+    texto = texto.strip()
+    if texto:
+        entradas = entradas.filter(
+            Q(uid__icontains=texto) | Q(cn__icontains=texto) | Q(mail__icontains=texto) | Q(sn__icontains=texto)
+        )
+    if posicion:
+        entradas = entradas.filter(dn__gt=posicion.decode('utf-8', 'replace'))
+
+    filas = list(entradas.values_list('dn', 'uid', 'cn', 'mail', 'sn')[:tamano + 1])
+    usuarios = [
+        {'dn': dn, 'username': uid, 'name': cn, 'email': mail, 'surname': sn}
+        for dn, uid, cn, mail, sn in filas[:tamano]
+    ]
+    siguiente = None
+    if len(filas) > tamano:
+        siguiente = codificar_cursor(numero + 1, usuarios[-1]['dn'].encode())
+    return PaginaUsuarios(usuarios, numero, siguiente)
+
+
+def _fecha_ldap(valor):
+    """datetime UTC de un GeneralizedTime de LDAP (20251018165700Z o con fracción)"""
+    try:
+        return datetime.strptime(valor[:14], '%Y%m%d%H%M%S').replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        return None
+
+
+def _entrada(dn, atributos, ahora):
+    modificada = _valor(atributos, 'modifyTimestamp')
+    return LdapDirectoryEntry(
+        dn=dn,
+        uid=_valor(atributos, 'uid'),
+        cn=_valor(atributos, 'cn'),
+        sn=_valor(atributos, 'sn'),
+        mail=_valor(atributos, 'mail'),
+        modify_timestamp=_fecha_ldap(modificada) if modificada else None,
+        entry_csn=_valor(atributos, 'entryCSN'),
+        synced_at=ahora,
+    )
+
+
+CAMPOS_ENTRADA = ['uid', 'cn', 'sn', 'mail', 'modify_timestamp', 'entry_csn']
+
+
+def _guardar(leidas, ahora):
+    """
+    Inserta o actualiza en bloque las entradas leídas que han cambiado.
+    Devuelve (nuevas, actualizadas, sin_cambios).
+    """
+    existentes = LdapDirectoryEntry.objects.in_bulk([dn for dn, _ in leidas], field_name='dn')
+    cambiadas = []
+    nuevas = sin_cambios = 0
+    for dn, atributos in leidas:
+        entrada = _entrada(dn, atributos, ahora)
+        actual = existentes.get(dn)
+        if actual is None:
+            nuevas += 1
+        elif all(getattr(actual, campo) == getattr(entrada, campo) for campo in CAMPOS_ENTRADA):
+            sin_cambios += 1
+            continue
+        cambiadas.append(entrada)
+
+    LdapDirectoryEntry.objects.bulk_create(
+        cambiadas,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['dn'],
+        update_fields=CAMPOS_ENTRADA + ['synced_at'],
+    )
+    # Si la entrada vuelve a aparecer, el usuario deja de estar marcado
+    CustomUser.objects.filter(
+        username__in={entrada.uid for entrada in cambiadas}, ldap_missing_since__isnull=False
+    ).update(ldap_missing_since=None)
+    return nuevas, len(cambiadas) - nuevas, sin_cambios
+
+
+def sincronizar_directorio(completa=False):
+    """
+    Actualiza la copia local del directorio y devuelve el LdapDirectorySync
+    con el resumen. Con `completa` se vuelven a leer todas las entradas.
+    """
+    sincronizacion = LdapDirectorySync.objects.create(full=completa)
+    filtro = filtro_usuarios()
+    desde = None if completa else LdapDirectoryEntry.objects.aggregate(desde=Max('modify_timestamp'))['desde']
+    if desde:
+        # >= porque modifyTimestamp tiene resolución de segundos
+        marca = desde.astimezone(dt_timezone.utc).strftime('%Y%m%d%H%M%SZ')
+        filtro_cambios = f'(&{filtro}(modifyTimestamp>={marca}))'
+    else:
+        filtro_cambios = filtro
+
+    def leer(conexion):
+        cambiadas = list(_recorrer(conexion, filtro_cambios, ATRIBUTOS_ESPEJO))
+        # '1.1' = ningún atributo: solo los DNs, para detectar bajas
+        dns = {dn for dn, _ in _recorrer(conexion, filtro, ['1.1'])}
+        return cambiadas, dns
+
+    try:
+        leidas, dns = ldap_pool.ejecutar(leer, idempotente=True)
+    except Exception as e:
+        sincronizacion.error = str(e)
+        sincronizacion.finished_at = timezone.now()
+        sincronizacion.save(update_fields=['error', 'finished_at'])
+        raise
+
+    ahora = timezone.now()
+    with transaction.atomic():
+        nuevas, actualizadas, sin_cambios = _guardar(leidas, ahora)
+
+        desaparecidas = [
+            (dn, uid) for dn, uid in LdapDirectoryEntry.objects.values_list('dn', 'uid') if dn not in dns
+        ]
+        for inicio in range(0, len(desaparecidas), 500):
+            LdapDirectoryEntry.objects.filter(dn__in=[dn for dn, _ in desaparecidas[inicio:inicio + 500]]).delete()
+        marcados = CustomUser.objects.filter(
+            username__in={uid for _, uid in desaparecidas}, ldap_missing_since__isnull=True
+        ).update(ldap_missing_since=ahora)
+
+        sincronizacion.created = nuevas
+        sincronizacion.updated = actualizadas
+        sincronizacion.unchanged = sin_cambios
+        sincronizacion.deleted = len(desaparecidas)
+        sincronizacion.users_flagged = marcados
+        sincronizacion.finished_at = timezone.now()
+        sincronizacion.save()
+    return sincronizacion
+
+
+def sincronizar_usuario(uid):
+    """Copia al espejo una sola entrada, por ejemplo justo después de crearla"""
+    filtro = f'(&{filtro_usuarios()}(uid={escape_filter_chars(uid)}))'
+    leidas = ldap_pool.ejecutar(
+        lambda conexion: list(_recorrer(conexion, filtro, ATRIBUTOS_ESPEJO)), idempotente=True,
+    )
+    with transaction.atomic():
+        _guardar(leidas, timezone.now())
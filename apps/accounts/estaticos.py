@@ -0,0 +1,118 @@
+"""
+Ficheros estáticos versionados y comprimidos.
+
+collectstatic copia los estáticos a STATIC_ROOT con el hash del contenido en el
+nombre (css/dashboard.3f2a1c9b0e4d.css) y un manifiesto con la correspondencia,
+de modo que {% static %} apunta siempre a la versión actual y el navegador
+puede guardarla en caché sin volver a preguntar: si el fichero cambia, cambia
+el nombre. De cada fichero de texto se guarda además una copia .gz ya
+comprimida con el máximo nivel, para no comprimir en cada petición.
+
+servir() entrega esos ficheros desde STATIC_ROOT: la copia .gz si el
+navegador acepta gzip y, para los nombres con hash, con caché de un año.
+
+Sin manifiesto {% static %} falla, así que en desarrollo y en los tests
+(settings.STORAGES) se usa StaticFilesStorage con los ficheros originales.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+
+# Extensiones que se guardan también comprimidas
+COMPRIMIBLES = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+# Por debajo de este tamaño gzip no compensa
+TAMANO_MINIMO = 256
+
+UN_ANO = 365 * 24 * 60 * 60
+# Los ficheros sin hash pueden cambiar en cualquier despliegue
+CACHE_SIN_HASH = 'public, max-age=300'
+CACHE_CON_HASH = f'public, max-age={UN_ANO}, immutable'
+
+
+class EstaticosComprimidos(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage que además guarda <fichero>.gz de los ficheros de texto"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        procesados = []
+        for original, con_hash, procesado in super().post_process(paths, dry_run, **options):
+            if con_hash and not isinstance(procesado, Exception):
+                procesados.append(con_hash)
+            yield original, con_hash, procesado
+        if not dry_run:
+            for nombre in procesados:
+                self.comprimir(nombre)
+
+    def comprimir(self, nombre):
+        """Guarda nombre.gz si es un fichero de texto y comprimido ocupa menos"""
+        if not nombre.endswith(COMPRIMIBLES):
+            return None
+        with self.open(nombre) as fichero:
+            contenido = fichero.read()
+        if len(contenido) < TAMANO_MINIMO:
+            return None
+        # mtime=0: el mismo fichero da siempre el mismo .gz
+        comprimido = gzip.compress(contenido, compresslevel=9, mtime=0)
+        if len(comprimido) >= len(contenido):
+            return None
+        destino = f"{nombre}.gz"
+        if self.exists(destino):
+            self.delete(destino)
+        return self._save(destino, ContentFile(comprimido))
+
+
+# css/dashboard.3f2a1c9b0e4d.css -> css/dashboard + .css
+CON_HASH = re.compile(r'^(?P<base>.+)\.[0-9a-f]{12}(?P<extension>\.[^./]+)?$')
+
+
+def versionado(nombre):
+    """True si `nombre` es la versión con hash actual de un fichero del manifiesto"""
+    partes = CON_HASH.match(nombre)
+    if not partes:
+        return False
+    original = partes['base'] + (partes['extension'] or '')
+    return getattr(staticfiles_storage, 'hashed_files', {}).get(original) == nombre
+
+
+def servir(request, path):
+    """Vista para STATIC_URL cuando no hay otro servidor de estáticos delante"""
+    nombre = posixpath.normpath(path).lstrip('/')
+    if not settings.STATIC_ROOT or nombre.endswith('.gz'):
+        raise Http404
+    try:
+        ruta = safe_join(settings.STATIC_ROOT, nombre)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(ruta):
+        raise Http404
+
+    comprimido = f"{ruta}.gz"
+    usar_gzip = 'gzip' in request.headers.get('Accept-Encoding', '') and os.path.isfile(comprimido)
+    fichero = comprimido if usar_gzip else ruta
+    estado = os.stat(fichero)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), estado.st_mtime):
+        respuesta = HttpResponseNotModified()
+    else:
+        tipo, _ = mimetypes.guess_type(ruta)
+        respuesta = FileResponse(
+            open(fichero, 'rb'), content_type=tipo or 'application/octet-stream',
+            filename=os.path.basename(ruta),
+        )
+        respuesta['Last-Modified'] = http_date(estado.st_mtime)
+        if usar_gzip:
+            respuesta['Content-Encoding'] = 'gzip'
+    if os.path.isfile(comprimido):
+        respuesta['Vary'] = 'Accept-Encoding'
+    respuesta['Cache-Control'] = CACHE_CON_HASH if versionado(nombre) else CACHE_SIN_HASH
+    return respuesta
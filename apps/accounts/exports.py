@@ -0,0 +1,186 @@
+"""
+Exportaciones CSV de los reportes de fichajes.
+
+Las respuestas se generan fila a fila con StreamingHttpResponse: los registros
+se leen con .iterator(chunk_size=...) (cursor de servidor en Postgres) y cada
+línea se envía en cuanto se escribe, así que la memoria no crece con el número
+de filas y el cliente recibe datos desde el primer bloque.
+
+El formato está pensado para abrirse directamente en Excel con configuración
+española: UTF-8 con BOM, separador ';' y coma decimal en las horas.
+"""
+import csv
+from datetime import timedelta
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import CustomUser, Proyecto, RegistroFichaje
+
+
+CHUNK_SIZE = 2000
+# Tamaño aproximado de cada bloque enviado al cliente
+TAMANO_BLOQUE = 64 * 1024
+JORNADAS = [jornada for jornada, _ in RegistroFichaje.JORNADA_CHOICES]
+
+
+class _Eco:
+    """Pseudo-fichero para csv.writer: devuelve la línea en lugar de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def respuesta_csv(nombre, cabecera, filas):
+    """StreamingHttpResponse que escribe `cabecera` y las `filas` de un iterable"""
+    writer = csv.writer(_Eco(), delimiter=';')
+
+    def bloques():
+        # Agrupar líneas evita una escritura al socket por cada fila
+        bloque = ['\ufeff' + writer.writerow(cabecera)]
+        tamano = 0
+        for fila in filas:
+            linea = writer.writerow([_sin_formula(valor) for valor in fila])
+            bloque.append(linea)
+            tamano += len(linea)
+            if tamano >= TAMANO_BLOQUE:
+                yield ''.join(bloque)
+                bloque = []
+                tamano = 0
+        if bloque:
+            yield ''.join(bloque)
+
+    response = StreamingHttpResponse(bloques(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    # Que ningún proxy intermedio acumule la respuesta entera antes de enviarla
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _sin_formula(valor):
+    """Evita que Excel interprete como fórmula un texto introducido por usuarios"""
+    if isinstance(valor, str) and valor[:1] in ('=', '+', '-', '@'):
+        return "'" + valor
+    return valor
+
+
+def nombre_fichero(prefijo, fecha_desde=None, fecha_hasta=None):
+    partes = [prefijo]
+    if fecha_desde:
+        partes.append(f'desde_{fecha_desde:%Y-%m-%d}')
+    if fecha_hasta:
+        partes.append(f'hasta_{fecha_hasta:%Y-%m-%d}')
+    return '_'.join(partes) + '.csv'
+
+
+def horas(valor):
+    """Duración en horas decimales con coma (8,50), vacía si no hay horas"""
+    if valor is None:
+        return ''
+    return f'{valor / timedelta(hours=1):.2f}'.replace('.', ',')
+
+
+def _fecha(valor):
+    return valor.strftime('%d/%m/%Y') if valor else ''
+
+
+def _hora(valor):
+    return valor.strftime('%H:%M') if valor else ''
+
+
+def _horas_con_datos(filas):
+    filas = [datos for datos in filas if datos['registros_con_horas']]
+    return sum((datos['horas'] for datos in filas), timedelta()) if filas else None
+
+
+def filas_trabajadores(totales):
+    """
+    Una fila por trabajador activo a partir de los totales de agregar_resumenes()
+    agrupados por ('usuario_id', 'proyecto_id', 'jornada').
+    """
+    por_usuario = {}
+    for (usuario_id, proyecto_id, jornada), datos in totales.items():
+        por_usuario.setdefault(usuario_id, []).append((proyecto_id, jornada, datos))
+
+    trabajadores = CustomUser.objects.filter(is_active=True).order_by('username').values_list(
+        'id', 'username', 'first_name', 'last_name', 'email', 'role'
+    )
+    for usuario_id, username, first_name, last_name, email, role in trabajadores.iterator(chunk_size=CHUNK_SIZE):
+        filas = por_usuario.get(usuario_id, [])
+        ultimos_dias = [datos['ultimo_dia'] for _, _, datos in filas if datos['ultimo_dia']]
+        yield [
+            username, first_name, last_name, email, role,
+            len({proyecto_id for proyecto_id, _, _ in filas if proyecto_id}),
+            sum(datos['registros'] for _, _, datos in filas),
+            horas(_horas_con_datos([datos for _, _, datos in filas])),
+            *(
+                horas(_horas_con_datos([datos for _, j, datos in filas if j == jornada]))
+                for jornada in JORNADAS
+            ),
+            _fecha(max(ultimos_dias) if ultimos_dias else None),
+        ]
+
+
+CABECERA_TRABAJADORES = [
+    'usuario', 'nombre', 'apellidos', 'email', 'rol', 'proyectos', 'dias',
+    'horas', *(f'horas_{jornada}' for jornada in JORNADAS), 'ultimo_fichaje',
+]
+
+
+def filas_proyectos(totales):
+    """
+    Una fila por proyecto activo a partir de los totales de agregar_resumenes()
+    agrupados por ('proyecto_id', 'usuario_id', 'jornada').
+    """
+    por_proyecto = {}
+    for (proyecto_id, usuario_id, jornada), datos in totales.items():
+        por_proyecto.setdefault(proyecto_id, []).append((usuario_id, jornada, datos))
+
+    proyectos = Proyecto.objects.filter(activo=True).order_by('nombre').values_list(
+        'id', 'nombre', 'fecha_creacion'
+    )
+    for proyecto_id, nombre, fecha_creacion in proyectos.iterator(chunk_size=CHUNK_SIZE):
+        filas = por_proyecto.get(proyecto_id, [])
+        yield [
+            nombre, _fecha(timezone.localdate(fecha_creacion)),
+            len({usuario_id for usuario_id, _, _ in filas}),
+            sum(datos['registros'] for _, _, datos in filas),
+            horas(_horas_con_datos([datos for _, _, datos in filas])),
+            *(
+                horas(_horas_con_datos([datos for _, j, datos in filas if j == jornada]))
+                for jornada in JORNADAS
+            ),
+        ]
+
+
+CABECERA_PROYECTOS = [
+    'proyecto', 'fecha_creacion', 'trabajadores', 'registros', 'horas',
+    *(f'horas_{jornada}' for jornada in JORNADAS),
+]
+
+
+def filas_registros(fecha_desde=None, fecha_hasta=None, **filtros):
+    """Registros de fichaje uno a uno, en orden cronológico"""
+    registros = RegistroFichaje.objects.filter(**filtros)
+    if fecha_desde:
+        registros = registros.filter(fecha__gte=fecha_desde)
+    if fecha_hasta:
+        registros = registros.filter(fecha__lte=fecha_hasta)
+
+    registros = registros.order_by('fecha', 'hora_entrada', 'id').values_list(
+        'fecha', 'usuario__username', 'usuario__first_name', 'usuario__last_name',
+        'proyecto__nombre', 'jornada', 'hora_entrada', 'hora_salida', 'horas_trabajadas', 'completo',
+    )
+    for (fecha, username, first_name, last_name, proyecto, jornada,
+         hora_entrada, hora_salida, horas_trabajadas, completo) in registros.iterator(chunk_size=CHUNK_SIZE):
+        yield [
+            _fecha(fecha), username, first_name, last_name, proyecto or '', jornada,
+            _hora(hora_entrada), _hora(hora_salida), horas(horas_trabajadas),
+            'sí' if completo else 'no',
+        ]
+
+
+CABECERA_REGISTROS = [
+    'fecha', 'usuario', 'nombre', 'apellidos', 'proyecto', 'jornada',
+    'hora_entrada', 'hora_salida', 'horas', 'completo',
+]
@@ -0,0 +1,149 @@
+"""
+Acciones de fichaje de un usuario sobre su registro del día.
+
+Cada acción es una única sentencia condicional (UPDATE ... WHERE o INSERT ...
+ON CONFLICT), de modo que dobles clics o varias pestañas abiertas no pueden
+provocar IntegrityError en (usuario, fecha) ni pisar el fichaje de otra petición:
+la base de datos decide qué petición gana y las demás no modifican nada.
+La salida y el cambio de proyecto recalculan además, en la misma transacción,
+los resúmenes del día para los reportes.
+
+Si SQLite sigue ocupado por otros escritores (hora punta de entradas), cada
+acción se reintenta con reintentar_si_bloqueada().
+"""
+from django.db import transaction
+from django.db.models import DurationField, ExpressionWrapper, F, TimeField, Value
+from django.utils import timezone
+from django.utils.timezone import localtime
+
+from .bloqueos_sqlite import reintentar_si_bloqueada
+from .models import RegistroFichaje
+from .rollups import actualizar_resumenes_dia
+
+
+# Resultados posibles de una acción de fichaje
+OK = 'ok'
+SIN_PROYECTO = 'sin_proyecto'
+SIN_ENTRADA = 'sin_entrada'
+YA_FICHADO = 'ya_fichado'
+
+
+@reintentar_si_bloqueada
+def fichar_entrada(usuario, momento=None):
+    """
+    Ficha la entrada del día. Devuelve (resultado, hora).
+    Solo la primera petición que encuentra hora_entrada vacía la rellena.
+    """
+    momento = localtime(momento or timezone.now())
+    hora = momento.time()
+
+    actualizados = RegistroFichaje.objects.filter(
+        usuario=usuario,
+        fecha=momento.date(),
+        proyecto__isnull=False,
+        hora_entrada__isnull=True,
+        hora_salida__isnull=True,
+    ).update(hora_entrada=hora, fecha_actualizacion=timezone.now())
+
+    # Una entrada sin salida no cambia los resúmenes (sigue sin horas)
+    if actualizados:
+        return OK, hora
+
+    registro = _registro_del_dia(usuario, momento.date())
+    if registro is None or not registro.proyecto_id:
+        return SIN_PROYECTO, None
+    return YA_FICHADO, registro.hora_entrada
+
+
+@reintentar_si_bloqueada
+def fichar_salida(usuario, momento=None):
+    """
+    Ficha la salida del día calculando horas_trabajadas en la misma sentencia.
+    Devuelve (resultado, hora).
+    """
+    momento = localtime(momento or timezone.now())
+    hora = momento.time()
+
+    # El UPDATE bloquea la fila hasta el commit, así el recálculo de
+    # resúmenes de peticiones concurrentes del mismo usuario no se cruza
+    with transaction.atomic():
+        actualizados = RegistroFichaje.objects.filter(
+            usuario=usuario,
+            fecha=momento.date(),
+            proyecto__isnull=False,
+            hora_entrada__isnull=False,
+            hora_entrada__lte=hora,
+            hora_salida__isnull=True,
+        ).update(
+            hora_salida=hora,
+            horas_trabajadas=ExpressionWrapper(
+                Value(hora, output_field=TimeField()) - F('hora_entrada'),
+                output_field=DurationField(),
+            ),
+            completo=True,
+            fecha_actualizacion=timezone.now(),
+        )
+        if actualizados:
+            actualizar_resumenes_dia(usuario.pk, momento.date())
+
+    if actualizados:
+        return OK, hora
+
+    registro = _registro_del_dia(usuario, momento.date())
+    if registro is None or not registro.proyecto_id:
+        return SIN_PROYECTO, None
+    if not registro.hora_entrada:
+        return SIN_ENTRADA, None
+    if registro.hora_salida:
+        return YA_FICHADO, registro.hora_salida
+
+    # La hora actual es anterior a la de entrada (p. ej. cambio de hora):
+    # calcular_horas() lo trata como salida al día siguiente. La escritura
+    # sigue siendo condicional para no pisar otra salida fichada entre medias.
+    registro.hora_salida = hora
+    registro.calcular_horas()
+    with transaction.atomic():
+        actualizados = RegistroFichaje.objects.filter(
+            pk=registro.pk,
+            hora_entrada=registro.hora_entrada,
+            hora_salida__isnull=True,
+        ).update(
+            hora_salida=hora,
+            horas_trabajadas=registro.horas_trabajadas,
+            completo=True,
+            fecha_actualizacion=timezone.now(),
+        )
+        if actualizados:
+            actualizar_resumenes_dia(usuario.pk, momento.date())
+
+    if actualizados:
+        return OK, hora
+    return YA_FICHADO, _registro_del_dia(usuario, momento.date()).hora_salida
+
+
+@reintentar_si_bloqueada
+def actualizar_proyecto(usuario, proyecto=None, jornada=None, fecha=None):
+    """
+    Asigna proyecto y/o jornada al registro del día creándolo si no existe,
+    con un único INSERT ... ON CONFLICT (usuario, fecha) DO UPDATE.
+    """
+    fecha = fecha or timezone.localdate()
+
+    campos = ['fecha_actualizacion']
+    if proyecto is not None:
+        campos.append('proyecto')
+    if jornada:
+        campos.append('jornada')
+
+    with transaction.atomic():
+        RegistroFichaje.objects.bulk_create(
+            [RegistroFichaje(usuario=usuario, fecha=fecha, proyecto=proyecto, jornada=jornada or 'presencial')],
+            update_conflicts=True,
+            unique_fields=['usuario', 'fecha'],
+            update_fields=campos,
+        )
+        actualizar_resumenes_dia(usuario.pk, fecha)
+
+
+def _registro_del_dia(usuario, fecha):
+    return RegistroFichaje.objects.filter(usuario=usuario, fecha=fecha).first()
@@ -335,3 +335,18 @@ class LDAPUserCreationForm(forms.Form):
                 "El nombre de usuario solo puede contener letras, números, puntos, guiones y guiones bajos"
             )
         return username
+
+
+# Bulk LDAP provisioning from a CSV file
+class LDAPBulkProvisionForm(forms.Form):
+    archivo = forms.FileField(
+        label="Fichero CSV",
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv,text/csv'
+        }),
+        help_text=(
+            "Una fila por usuario con las columnas username, first_name, last_name, "
+            "email, password, role (admin, hr, tech o user) y, opcionalmente, is_staff"
+        )
+    )
@@ -0,0 +1,221 @@
+"""
+Pool de conexiones LDAP autenticadas con la cuenta de servicio.
+
+Crear un usuario o listar el directorio abría antes una conexión nueva en cada
+petición (TCP, TLS si procede y bind) y la cerraba al terminar. El pool guarda
+conexiones ya autenticadas con AUTH_LDAP_BIND_DN y las reutiliza:
+
+- Como mucho LDAP_POOL_MAX_SIZE conexiones por proceso; si están todas en uso
+  se espera hasta LDAP_POOL_WAIT_TIMEOUT segundos a que se libere una.
+- Las que llevan más de LDAP_POOL_IDLE_TIMEOUT segundos sin usarse se cierran.
+- Antes de reutilizar una conexión que lleva más de LDAP_POOL_CHECK_INTERVAL
+  segundos parada se comprueba con un whoami; si falla se abre otra.
+- Si una conexión reutilizada devuelve SERVER_DOWN (el servidor se reinició o
+  cerró la conexión) se descarta. Las operaciones idempotentes (búsquedas) se
+  repiten una vez con una nueva; el resto no, porque la petición pudo llegar a
+  aplicarse antes de la caída (un add repetido daría ALREADY_EXISTS).
+
+Cada conexión la usa un solo hilo a la vez, así que el pool se puede compartir
+entre los hilos de gunicorn. Tras un fork (workers de gunicorn) cada proceso
+empieza con un pool vacío en lugar de heredar los sockets del padre.
+"""
+import logging
+import os
+import threading
+import time
+
+import ldap
+from django.conf import settings
+
+from .mediciones import medir_ldap
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolAgotado(Exception):
+    """Todas las conexiones del pool siguen en uso tras el tiempo de espera"""
+
+
+class PoolLDAP:
+
+    def __init__(self, uri, bind_dn, password, max_conexiones=4, tiempo_inactivo=300,
+                 intervalo_comprobacion=30, tiempo_espera=5, opciones=None, start_tls=False):
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.password = password
+        self.max_conexiones = max_conexiones
+        self.tiempo_inactivo = tiempo_inactivo
+        self.intervalo_comprobacion = intervalo_comprobacion
+        self.tiempo_espera = tiempo_espera
+        self.opciones = opciones or {}
+        self.start_tls = start_tls
+
+        self._condicion = threading.Condition()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._pid = os.getpid()
+        self._libres = []  # [(conexión, momento en que se devolvió)], la última devuelta al final
+        self._en_uso = 0
+
+    def _conectar(self):
+        conexion = ldap.initialize(self.uri)
+        for opcion, valor in self.opciones.items():
+            conexion.set_option(opcion, valor)
+        if self.start_tls:
+            conexion.start_tls_s()
+        conexion.simple_bind_s(self.bind_dn, self.password)
+        return conexion
+
+    def _cerrar(self, conexion):
+        try:
+            conexion.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _sana(self, conexion):
+        try:
+            conexion.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def _tomar(self):
+        """Devuelve (conexión, reutilizada) y la marca como en uso"""
+        caducadas = []
+        reutilizable = None
+        with self._condicion:
+            if self._pid != os.getpid():
+                self._reiniciar()
+
+            limite = time.monotonic() + self.tiempo_espera
+            while True:
+                ahora = time.monotonic()
+                # Las más antiguas están al principio
+                while self._libres and ahora - self._libres[0][1] > self.tiempo_inactivo:
+                    caducadas.append(self._libres.pop(0)[0])
+                if self._libres:
+                    reutilizable = self._libres.pop()
+                    break
+                if self._en_uso < self.max_conexiones:
+                    break
+                restante = limite - ahora
+                if restante <= 0:
+                    raise PoolAgotado(f"Las {self.max_conexiones} conexiones LDAP del pool están en uso")
+                self._condicion.wait(restante)
+            self._en_uso += 1
+
+        # La red, fuera del lock
+        for conexion in caducadas:
+            self._cerrar(conexion)
+        try:
+            if reutilizable:
+                conexion, devuelta = reutilizable
+                if time.monotonic() - devuelta < self.intervalo_comprobacion or self._sana(conexion):
+                    return conexion, True
+                logger.info("Conexión LDAP del pool caída, se abre una nueva")
+                self._cerrar(conexion)
+            return self._conectar(), False
+        except BaseException:
+            self._liberar()
+            raise
+
+    def _devolver(self, conexion):
+        with self._condicion:
+            if self._pid == os.getpid():
+                self._libres.append((conexion, time.monotonic()))
+                self._en_uso -= 1
+                self._condicion.notify()
+                return
+        self._cerrar(conexion)
+
+    def _descartar(self, conexion):
+        self._cerrar(conexion)
+        self._liberar()
+
+    def _liberar(self):
+        with self._condicion:
+            if self._pid == os.getpid():
+                self._en_uso -= 1
+                self._condicion.notify()
+
+    def ejecutar(self, operacion, idempotente=False):
+        """
+        Llama a `operacion(conexion)` con una conexión autenticada del pool y
+        devuelve su resultado. Las excepciones LDAP se propagan tal cual.
+        Con `idempotente`, un SERVER_DOWN en una conexión reutilizada se
+        reintenta una vez con una conexión nueva.
+        """
+        conexion, reutilizada = self._tomar()
+        try:
+            resultado = operacion(conexion)
+        except ldap.SERVER_DOWN:
+            self._descartar(conexion)
+            if not (reutilizada and idempotente):
+                raise
+            # La conexión guardada ya no servía: una sola vez con una nueva
+            logger.info("SERVER_DOWN en una conexión LDAP reutilizada, se reintenta")
+            conexion, _ = self._tomar_nueva()
+            try:
+                resultado = operacion(conexion)
+            except ldap.SERVER_DOWN:
+                self._descartar(conexion)
+                raise
+            except BaseException:
+                self._devolver(conexion)
+                raise
+        except BaseException:
+            self._devolver(conexion)
+            raise
+        self._devolver(conexion)
+        return resultado
+
+    def _tomar_nueva(self):
+        """Como _tomar() pero sin reutilizar: las libres probablemente también están caídas"""
+        with self._condicion:
+            libres, self._libres = self._libres, []
+        for conexion, _ in libres:
+            self._cerrar(conexion)
+        return self._tomar()
+
+    def cerrar(self):
+        """Cierra las conexiones libres (las que están en uso se cierran al devolverlas)"""
+        with self._condicion:
+            libres, self._libres = self._libres, []
+        for conexion, _ in libres:
+            self._cerrar(conexion)
+
+    def estado(self):
+        with self._condicion:
+            return {'libres': len(self._libres), 'en_uso': self._en_uso, 'max': self.max_conexiones}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool():
+    """Pool del proceso, creado con la configuración LDAP de settings la primera vez"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolLDAP(
+                    settings.AUTH_LDAP_SERVER_URI,
+                    settings.AUTH_LDAP_BIND_DN,
+                    settings.AUTH_LDAP_BIND_PASSWORD,
+                    max_conexiones=getattr(settings, 'LDAP_POOL_MAX_SIZE', 4),
+                    tiempo_inactivo=getattr(settings, 'LDAP_POOL_IDLE_TIMEOUT', 300),
+                    intervalo_comprobacion=getattr(settings, 'LDAP_POOL_CHECK_INTERVAL', 30),
+                    tiempo_espera=getattr(settings, 'LDAP_POOL_WAIT_TIMEOUT', 5),
+                    opciones=getattr(settings, 'AUTH_LDAP_CONNECTION_OPTIONS', {}),
+                    start_tls=getattr(settings, 'AUTH_LDAP_START_TLS', False),
+                )
+    return _pool
+
+
+@medir_ldap
+def ejecutar(operacion, idempotente=False):
+    """Ejecuta `operacion(conexion)` con una conexión del pool del proceso (ver PoolLDAP.ejecutar)"""
+    return obtener_pool().ejecutar(operacion, idempotente=idempotente)
@@ -1,4 +1,7 @@
+from functools import lru_cache
+
 from django.dispatch import receiver
+from django.core.signals import setting_changed
 from django_auth_ldap.backend import populate_user
 from django.conf import settings
 import logging
@@ -6,42 +9,53 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# Role priority: admin > hr > tech > user
+ROLE_PRIORITY = ('admin', 'hr', 'tech', 'user')
+
+
+@lru_cache(maxsize=None)
+def role_groups():
+    """
+    (role, group name) pairs in priority order, parsed once from
+    AUTH_LDAP_PROFILE_FLAGS_BY_GROUP instead of on every login.
+    """
+    role_dns = getattr(settings, 'AUTH_LDAP_PROFILE_FLAGS_BY_GROUP', {}).get('role', {})
+    pairs = []
+    for role in ROLE_PRIORITY:
+        group_name = extract_group_name(role_dns.get(role, ''))
+        if group_name:
+            pairs.append((role, group_name))
+    return tuple(pairs)
+
+
+@receiver(setting_changed)
+def reset_role_groups(setting=None, **kwargs):
+    if setting == 'AUTH_LDAP_PROFILE_FLAGS_BY_GROUP':
+        role_groups.cache_clear()
+
+
 @receiver(populate_user)
 def ldap_user_role_mapping(sender, user=None, ldap_user=None, **kwargs):
     """
     Signal handler to map LDAP groups to user roles.
-    This is called after an LDAP user is authenticated and their attributes are populated.
+    This is called after an LDAP user is authenticated and their attributes are populated,
+    right before django-auth-ldap saves the user, so the role is only set here.
     """
     if user and ldap_user:
-        # Get LDAP groups for this user
+        # Get LDAP groups for this user (cached by django-auth-ldap for AUTH_LDAP_CACHE_TIMEOUT)
         ldap_groups = ldap_user.group_names
-        logger.info(f"LDAP groups for user {user.username}: {ldap_groups}")
-        
-        # Default role
-        user.role = 'user'
+        logger.debug(f"LDAP groups for user {user.username}: {ldap_groups}")
         
-        # Check group membership and assign role accordingly
-        # Priority: admin > hr > tech > user
-        if hasattr(settings, 'AUTH_LDAP_PROFILE_FLAGS_BY_GROUP'):
-            role_groups = settings.AUTH_LDAP_PROFILE_FLAGS_BY_GROUP.get('role', {})
-            
-            # Extract group names from DN strings
-            admin_group = extract_group_name(role_groups.get('admin', ''))
-            hr_group = extract_group_name(role_groups.get('hr', ''))
-            tech_group = extract_group_name(role_groups.get('tech', ''))
-            user_group = extract_group_name(role_groups.get('user', ''))
-            
-            if admin_group in ldap_groups:
-                user.role = 'admin'
-            elif hr_group in ldap_groups:
-                user.role = 'hr'
-            elif tech_group in ldap_groups:
-                user.role = 'tech'
-            elif user_group in ldap_groups:
-                user.role = 'user'
+        # First matching role group, 'user' by default
+        user.role = next((role for role, group in role_groups() if group in ldap_groups), 'user')
         
-        # Save the updated user
-        user.save()
+        # Existing users: the backend's save() only writes the columns this login changed
+        loaded_values = getattr(user, '_loaded_values', None)
+        if loaded_values is not None:
+            user._ldap_changed_fields = [
+                field.attname for field in user._meta.concrete_fields
+                if field.attname in loaded_values and getattr(user, field.attname) != loaded_values[field.attname]
+            ]
         logger.info(f"Assigned role '{user.role}' to user {user.username}")
 
 
@@ -0,0 +1,126 @@
+"""
+Listado paginado de usuarios de Django para el panel de administración.
+
+Cada página se pide por clave (keyset) sobre username, que es único y tiene
+índice: "los 50 siguientes a X" en lugar de OFFSET, así que cualquier página
+cuesta lo mismo que la primera. Solo se leen con .values() las columnas que
+muestra la tabla, sin crear instancias del modelo.
+
+Los filtros usan columnas con índice:
+
+- texto: prefijo de username o de email (ambos únicos; en Postgres Django les
+  añade además un índice *_like para LIKE 'texto%').
+- rol: índice (role, username), que también da el orden de la página.
+- activo y staff: se aplican sobre el recorrido por username.
+
+El total de cada combinación de filtros se guarda en la caché con la
+generación 'usuarios', así que solo se recalcula cuando cambia algún usuario.
+"""
+from django.db.models import Q
+
+from .cache import TOTAL_USUARIOS
+from .models import CustomUser, LdapDirectoryEntry
+from .paginacion import PARAMETRO_ANTES, PARAMETRO_DESPUES, PaginaRegistros
+
+
+COLUMNAS = (
+    'id', 'username', 'first_name', 'last_name', 'email', 'role', 'is_active', 'is_staff',
+    'is_superuser', 'last_login', 'date_joined', 'ldap_missing_since',
+)
+
+TAMANOS_PAGINA = (25, 50, 100, 200)
+TAMANO_PAGINA = 50
+
+ROLES = [rol for rol, _ in CustomUser.ROLE_CHOICES]
+SI_NO = {'si': True, 'no': False}
+
+
+class FiltrosUsuarios:
+    """Filtros del listado leídos de los parámetros GET; los no válidos se ignoran"""
+
+    def __init__(self, parametros):
+        self.texto = parametros.get('q', '').strip()
+        self.rol = parametros.get('rol', '')
+        if self.rol not in ROLES:
+            self.rol = ''
+        self.activo = parametros.get('activo', '')
+        if self.activo not in SI_NO:
+            self.activo = ''
+        self.staff = parametros.get('staff', '')
+        if self.staff not in SI_NO:
+            self.staff = ''
+
+    def clave(self):
+        return (self.texto, self.rol, self.activo, self.staff)
+
+    @property
+    def hay_filtros(self):
+        return any(self.clave())
+
+    def aplicar(self, queryset):
+        if self.texto:
+            queryset = queryset.filter(Q(username__startswith=self.texto) | Q(email__startswith=self.texto))
+        if self.rol:
+            queryset = queryset.filter(role=self.rol)
+        if self.activo:
+            queryset = queryset.filter(is_active=SI_NO[self.activo])
+        if self.staff:
+            queryset = queryset.filter(is_staff=SI_NO[self.staff])
+        return queryset
+
+
+class PaginaUsuarios(PaginaRegistros):
+    """Página de usuarios (diccionarios de .values()); el cursor es el username"""
+
+    @property
+    def usuarios(self):
+        return self.registros
+
+    @property
+    def cursor_siguiente(self):
+        return self.registros[-1]['username'] if self.hay_siguiente and self.registros else None
+
+    @property
+    def cursor_anterior(self):
+        return self.registros[0]['username'] if self.hay_anterior and self.registros else None
+
+
+def paginar_usuarios(queryset, parametros, tamano):
+    """
+    Página de `queryset` ordenada por username indicada por los parámetros GET
+    ('despues' o 'antes' un username). Sin cursor devuelve la primera.
+    """
+    despues = parametros.get(PARAMETRO_DESPUES, '')
+    antes = parametros.get(PARAMETRO_ANTES, '') if not despues else ''
+    filas = queryset.values(*COLUMNAS)
+
+    if antes:
+        usuarios = list(filas.filter(username__lt=antes).order_by('-username')[:tamano + 1])
+        hay_anterior = len(usuarios) > tamano
+        return PaginaUsuarios(usuarios[:tamano][::-1], True, hay_anterior, parametros)
+
+    if despues:
+        filas = filas.filter(username__gt=despues)
+    usuarios = list(filas.order_by('username')[:tamano + 1])
+    hay_siguiente = len(usuarios) > tamano
+    return PaginaUsuarios(usuarios[:tamano], hay_siguiente, bool(despues), parametros)
+
+
+def contar_usuarios(filtros):
+    """Total de usuarios con estos filtros, de la caché mientras no cambien los usuarios"""
+    return TOTAL_USUARIOS.obtener(lambda: filtros.aplicar(CustomUser.objects.all()).count(), filtros.clave())
+
+
+def listar_usuarios(parametros, tamano=TAMANO_PAGINA):
+    """
+    (página, filtros, total) del listado. Cada usuario de la página lleva
+    in_ldap: si tiene entrada en la copia local del directorio LDAP.
+    """
+    filtros = FiltrosUsuarios(parametros)
+    pagina = paginar_usuarios(filtros.aplicar(CustomUser.objects.all()), parametros, tamano)
+
+    usernames = [usuario['username'] for usuario in pagina.usuarios]
+    en_ldap = set(LdapDirectoryEntry.objects.filter(uid__in=usernames).values_list('uid', flat=True))
+    for usuario in pagina.usuarios:
+        usuario['in_ldap'] = usuario['username'] in en_ldap
+    return pagina, filtros, contar_usuarios(filtros)
@@ -0,0 +1,99 @@
+import statistics
+import threading
+import time
+from queue import Empty, Queue
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from apps.accounts import fichajes
+from apps.accounts.models import CustomUser, Proyecto
+
+
+PREFIJO = 'bench_fichaje_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate the morning clock-in burst: every worker sets the project of the day and '
+        'clocks in, from parallel threads against the configured database, and report the '
+        f'latency percentiles. Uses temporary users ({PREFIJO}*) that are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trabajadores', type=int, default=200, help='Workers clocking in (default: 200)')
+        parser.add_argument('--hilos', type=int, default=32, help='Parallel writers (default: 32)')
+
+    def handle(self, *args, **options):
+        if options['trabajadores'] < 1 or options['hilos'] < 1:
+            raise CommandError('--trabajadores and --hilos must be at least 1')
+        if CustomUser.objects.filter(username__startswith=PREFIJO).exists():
+            raise CommandError(f'Users named {PREFIJO}* already exist; delete them first')
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                modo = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+                sincronizacion = cursor.execute('PRAGMA synchronous').fetchone()[0]
+            self.stdout.write(f"SQLite journal_mode={modo} synchronous={sincronizacion}")
+
+        proyecto = Proyecto.objects.create(nombre=f'{PREFIJO}proyecto')
+        usuarios = CustomUser.objects.bulk_create([
+            CustomUser(username=f'{PREFIJO}{i}', email=f'{PREFIJO}{i}@example.com', password='!')
+            for i in range(options['trabajadores'])
+        ])
+        momento = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        try:
+            tiempos, errores, duracion = self.fichar(usuarios, proyecto, momento, options['hilos'])
+        finally:
+            CustomUser.objects.filter(username__startswith=PREFIJO).delete()
+            proyecto.delete()
+
+        tiempos.sort()
+        self.stdout.write(
+            f"{len(tiempos)} clock-ins with {options['hilos']} writers in {duracion:.2f} s "
+            f"({len(tiempos) / duracion:.0f}/s)"
+        )
+        if tiempos:
+            self.stdout.write(
+                f"  median {statistics.median(tiempos):7.1f} ms   "
+                f"p95 {tiempos[max(int(len(tiempos) * 0.95) - 1, 0)]:7.1f} ms   "
+                f"p99 {tiempos[max(int(len(tiempos) * 0.99) - 1, 0)]:7.1f} ms   "
+                f"max {tiempos[-1]:7.1f} ms"
+            )
+        if errores:
+            self.stderr.write(self.style.ERROR(f"{len(errores)} failed, e.g. {errores[0]!r}"))
+
+    def fichar(self, usuarios, proyecto, momento, hilos):
+        """Proyecto del día + entrada de cada usuario desde `hilos` hilos"""
+        pendientes = Queue()
+        for usuario in usuarios:
+            pendientes.put(usuario)
+        tiempos = []
+        errores = []
+
+        def trabajar():
+            try:
+                while True:
+                    try:
+                        usuario = pendientes.get_nowait()
+                    except Empty:
+                        return
+                    empezar = time.perf_counter()
+                    try:
+                        fichajes.actualizar_proyecto(usuario, proyecto, fecha=momento.date())
+                        fichajes.fichar_entrada(usuario, momento)
+                    except Exception as e:
+                        errores.append(e)
+                    else:
+                        tiempos.append((time.perf_counter() - empezar) * 1000)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=trabajar) for _ in range(hilos)]
+        empezar = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return tiempos, errores, time.perf_counter() - empezar
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Time LDAP logins (authenticate) against AUTH_LDAP_SERVER_URI, e.g. the slapd '
+        'container of docker-compose seeded from ldap/*.ldif: user search with a cold '
+        'cache, user search with cached DN and groups, and direct bind. '
+        'The cold-cache variant clears the default cache.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', type=str, help='LDAP username')
+        parser.add_argument('password', type=str, help='LDAP password')
+        parser.add_argument('--iteraciones', type=int, default=50, help='Logins per variant (default: 50)')
+        parser.add_argument(
+            '--dn-template', default='uid=%(user)s,ou=users,dc=example,dc=com',
+            help='User DN template for the direct bind variant'
+        )
+
+    def handle(self, *args, **options):
+        busqueda = {'AUTH_LDAP_USER_DN_TEMPLATE': None, 'AUTH_LDAP_BIND_AS_AUTHENTICATING_USER': False}
+        directo = {
+            'AUTH_LDAP_USER_DN_TEMPLATE': options['dn_template'],
+            'AUTH_LDAP_BIND_AS_AUTHENTICATING_USER': True,
+        }
+        variantes = [
+            ('search, cold cache', busqueda, True),
+            ('search, cached DN + groups', busqueda, False),
+            ('direct bind, cached groups', directo, False),
+        ]
+
+        self.stdout.write(f"LDAP server: {settings.AUTH_LDAP_SERVER_URI}")
+        for nombre, ajustes, limpiar in variantes:
+            tiempos = []
+            consultas = []
+            with override_settings(**ajustes):
+                # Una primera vez para llenar la caché
+                if not authenticate(username=options['username'], password=options['password']):
+                    self.stdout.write(self.style.ERROR(f"✗ Authentication failed ({nombre})"))
+                    return
+                for _ in range(options['iteraciones']):
+                    if limpiar:
+                        cache.clear()
+                    with CaptureQueriesContext(connection) as contexto:
+                        empezar = time.perf_counter()
+                        authenticate(username=options['username'], password=options['password'])
+                        tiempos.append((time.perf_counter() - empezar) * 1000)
+                    consultas.append(sum(
+                        1 for consulta in contexto.captured_queries if consulta['sql'].startswith('UPDATE')
+                    ))
+            tiempos.sort()
+            self.stdout.write(
+                f"  {nombre:<28} median {statistics.median(tiempos):7.2f} ms   "
+                f"p95 {tiempos[int(len(tiempos) * 0.95) - 1]:7.2f} ms   "
+                f"UPDATEs/login {statistics.mean(consultas):.1f}"
+            )
@@ -0,0 +1,59 @@
+import statistics
+import time
+
+import ldap
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.accounts.ldap_pool import PoolLDAP
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare a connect + bind + search + unbind per call with the pooled connections '
+        'used by the LDAP admin views. Runs against AUTH_LDAP_SERVER_URI (e.g. the slapd '
+        'container of docker-compose).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=200, help='Searches per variant (default: 200)')
+        parser.add_argument('--base', default='ou=users,dc=example,dc=com', help='Search base')
+
+    def handle(self, *args, **options):
+        base = options['base']
+        opciones = getattr(settings, 'AUTH_LDAP_CONNECTION_OPTIONS', {})
+
+        def buscar(conexion):
+            return conexion.search_s(base, ldap.SCOPE_ONELEVEL, '(objectClass=inetOrgPerson)', ['uid'])
+
+        def sin_pool():
+            conexion = ldap.initialize(settings.AUTH_LDAP_SERVER_URI)
+            for opcion, valor in opciones.items():
+                conexion.set_option(opcion, valor)
+            conexion.simple_bind_s(settings.AUTH_LDAP_BIND_DN, settings.AUTH_LDAP_BIND_PASSWORD)
+            try:
+                return buscar(conexion)
+            finally:
+                conexion.unbind_s()
+
+        pool = PoolLDAP(
+            settings.AUTH_LDAP_SERVER_URI, settings.AUTH_LDAP_BIND_DN, settings.AUTH_LDAP_BIND_PASSWORD,
+            max_conexiones=1, opciones=opciones,
+        )
+
+        self.stdout.write(f"LDAP server: {settings.AUTH_LDAP_SERVER_URI}")
+        for nombre, funcion in [
+            ('connect + bind per call', sin_pool),
+            ('pooled connection', lambda: pool.ejecutar(buscar, idempotente=True)),
+        ]:
+            tiempos = []
+            for _ in range(options['iteraciones']):
+                empezar = time.perf_counter()
+                funcion()
+                tiempos.append((time.perf_counter() - empezar) * 1000)
+            tiempos.sort()
+            self.stdout.write(
+                f"  {nombre:<26} median {statistics.median(tiempos):7.2f} ms   "
+                f"p95 {tiempos[int(len(tiempos) * 0.95) - 1]:7.2f} ms"
+            )
+        pool.cerrar()
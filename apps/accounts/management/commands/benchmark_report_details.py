@@ -0,0 +1,143 @@
+import random
+import statistics
+import time as timer
+from datetime import date, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+
+from apps.accounts.models import CustomUser, Proyecto, RegistroFichaje
+from apps.accounts.rollups import agregar_registros, agregar_resumenes, reconstruir_resumenes
+
+
+JORNADAS = [jornada for jornada, _ in RegistroFichaje.JORNADA_CHOICES]
+
+
+class _Rollback(Exception):
+    pass
+
+
+def condicionales(modelo, relacion, filtro, fecha_desde, fecha_hasta):
+    """
+    Previous detail views: five filtered aggregates over the join plus DISTINCT.
+    `relacion` is the reverse relation to RegistroFichaje ('fichajes' or 'registrofichaje').
+    """
+    filtro = {f'{relacion}__{campo}': valor for campo, valor in filtro.items()}
+    base = Q(**filtro, **{f'{relacion}__fecha__gte': fecha_desde, f'{relacion}__fecha__lte': fecha_hasta})
+    con_horas = base & Q(**{f'{relacion}__horas_trabajadas__isnull': False})
+    horas = f'{relacion}__horas_trabajadas'
+    return list(modelo.objects.filter(**filtro).annotate(
+        total_horas=Sum(horas, filter=con_horas),
+        total_dias=Count(relacion, filter=base),
+        **{
+            f'horas_{jornada}': Sum(horas, filter=con_horas & Q(**{f'{relacion}__jornada': jornada}))
+            for jornada in JORNADAS
+        },
+    ).distinct().order_by('-total_horas'))
+
+
+def _pivotar(modelo, filas, campo):
+    pivote = {}
+    for fila in filas:
+        datos = pivote.setdefault(fila[campo], {'total_dias': 0, 'total_horas': timedelta()})
+        datos['total_dias'] += fila['dias']
+        datos['total_horas'] += fila['horas'] or timedelta()
+        datos[f"horas_{fila['jornada']}"] = fila['horas']
+    objetos = list(modelo.objects.filter(id__in=pivote))
+    for objeto in objetos:
+        for nombre, valor in pivote[objeto.id].items():
+            setattr(objeto, nombre, valor)
+    return objetos
+
+
+def agrupado(modelo, campo, filtro, fecha_desde, fecha_hasta):
+    """One GROUP BY (campo, jornada) on RegistroFichaje pivoted in Python (worker detail)"""
+    return _pivotar_totales(modelo, campo, agregar_registros((campo, 'jornada'), fecha_desde, fecha_hasta, **filtro))
+
+
+def resumenes(modelo, campo, filtro, fecha_desde, fecha_hasta):
+    """The same grouping read from the rollup tables (project detail)"""
+    return _pivotar_totales(modelo, campo, agregar_resumenes((campo, 'jornada'), fecha_desde, fecha_hasta, **filtro))
+
+
+def _pivotar_totales(modelo, campo, totales):
+    filas = [
+        {campo: valor, 'jornada': jornada, 'dias': datos['registros'], 'horas': datos['horas']}
+        for (valor, jornada), datos in totales.items()
+    ]
+    return _pivotar(modelo, filas, campo)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the project/worker detail aggregations (previous conditional aggregates vs '
+        'one GROUP BY on registros vs the rollup tables) on a seeded dataset. '
+        'Everything runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=60, help='Seeded users (default: 60)')
+        parser.add_argument('--proyectos', type=int, default=8, help='Seeded projects (default: 8)')
+        parser.add_argument('--dias', type=int, default=365, help='Days of fichajes per user (default: 365)')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Runs per variant (default: 5)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._ejecutar(options)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _ejecutar(self, options):
+        self.stdout.write("Seeding fichajes...")
+        aleatorio = random.Random(42)
+        usuarios = CustomUser.objects.bulk_create([
+            CustomUser(username=f'benchmark_{i}', email=f'benchmark_{i}@example.com')
+            for i in range(options['usuarios'])
+        ])
+        proyectos = Proyecto.objects.bulk_create([
+            Proyecto(nombre=f'Benchmark {i}') for i in range(options['proyectos'])
+        ])
+        inicio = date.today() - timedelta(days=options['dias'])
+        registros = []
+        for usuario in usuarios:
+            for dia in range(options['dias']):
+                minutos = aleatorio.randint(6 * 60, 9 * 60)
+                registros.append(RegistroFichaje(
+                    usuario=usuario,
+                    fecha=inicio + timedelta(days=dia),
+                    hora_entrada=time(8, 0),
+                    hora_salida=time(8 + minutos // 60, minutos % 60),
+                    horas_trabajadas=timedelta(minutes=minutos),
+                    completo=True,
+                    proyecto=aleatorio.choice(proyectos),
+                    jornada=aleatorio.choice(JORNADAS),
+                ))
+        RegistroFichaje.objects.bulk_create(registros, batch_size=2000)
+        reconstruir_resumenes()
+        self.stdout.write(f"{len(registros)} registros on {connection.vendor}\n")
+
+        fecha_desde, fecha_hasta = inicio, date.today()
+        detalles = [
+            ('admin_project_detail', CustomUser, 'fichajes', 'usuario_id', {'proyecto_id': proyectos[0].id}),
+            ('admin_worker_detail', Proyecto, 'registrofichaje', 'proyecto_id', {'usuario_id': usuarios[0].id}),
+        ]
+        for vista, modelo, relacion, campo, filtro in detalles:
+            self.stdout.write(vista)
+            variantes = [
+                ('conditional Sum/Count + distinct (before)', lambda: condicionales(modelo, relacion, filtro, fecha_desde, fecha_hasta)),
+                ('one GROUP BY on registros + pivot', lambda: agrupado(modelo, campo, filtro, fecha_desde, fecha_hasta)),
+                ('one GROUP BY on rollups + pivot', lambda: resumenes(modelo, campo, filtro, fecha_desde, fecha_hasta)),
+            ]
+            for nombre, funcion in variantes:
+                tiempos = []
+                for _ in range(options['repeticiones']):
+                    empezar = timer.perf_counter()
+                    funcion()
+                    tiempos.append((timer.perf_counter() - empezar) * 1000)
+                self.stdout.write(
+                    f"  {nombre:<42} median {statistics.median(tiempos):8.2f} ms   "
+                    f"min {min(tiempos):8.2f} ms"
+                )
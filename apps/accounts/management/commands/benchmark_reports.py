@@ -0,0 +1,219 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.accounts import datos_sinteticos
+from apps.accounts.cache import invalidar
+from apps.accounts.mediciones import Medicion
+from apps.accounts.models import CustomUser, Proyecto
+
+
+ESCALAS = '10000,1000000,10000000'
+FORMATO = 1
+
+
+def vistas(proyecto, trabajador):
+    """(nombre, url) de cada vista que se mide"""
+    hoy = timezone.localdate()
+    ultimo_mes = {'fecha_desde': (hoy - timedelta(days=30)).isoformat(), 'fecha_hasta': hoy.isoformat()}
+    ultimo_ano = {'fecha_desde': (hoy - timedelta(days=365)).isoformat(), 'fecha_hasta': hoy.isoformat()}
+
+    def url(nombre, parametros=None, **kwargs):
+        ruta = reverse(nombre, kwargs=kwargs or None)
+        if parametros:
+            ruta += '?' + '&'.join(f'{clave}={valor}' for clave, valor in parametros.items())
+        return ruta
+
+    return [
+        ('admin_dashboard', url('admin_dashboard')),
+        ('admin_reports_dashboard', url('admin_reports_dashboard')),
+        ('admin_projects_report 30d', url('admin_projects_report', ultimo_mes)),
+        ('admin_projects_report 365d', url('admin_projects_report', ultimo_ano)),
+        ('admin_workers_report 30d', url('admin_workers_report', ultimo_mes)),
+        ('admin_workers_report 365d', url('admin_workers_report', ultimo_ano)),
+        ('admin_project_detail', url('admin_project_detail', project_id=proyecto)),
+        ('admin_worker_detail', url('admin_worker_detail', user_id=trabajador)),
+        ('admin_export_workers 30d', url('admin_export_workers', ultimo_mes)),
+        ('admin_export_projects 30d', url('admin_export_projects', ultimo_mes)),
+        ('admin_export_registros worker', url('admin_export_registros', {'usuario': trabajador})),
+        ('list_django_users', url('list_django_users')),
+        ('list_django_users search', url('list_django_users', {'q': f'{datos_sinteticos.PREFIJO}1'})),
+        ('user_fichaje', url('user_fichaje')),
+    ]
+
+
+def _host():
+    """Un host que acepte ALLOWED_HOSTS para las peticiones del cliente"""
+    for host in settings.ALLOWED_HOSTS:
+        return 'localhost' if host == '*' else host.lstrip('.')
+    return 'localhost'
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic fichajes at several volumes (seed_fichajes) and measure the report, '
+        'export and list views at each one: status, queries, DB time, template render time, '
+        'total time and peak Python memory. Writes a JSON report; pass --comparar with the '
+        'report of another commit to print the differences. Run it on an otherwise empty '
+        'database: the views aggregate every fichaje, not only the synthetic ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--escalas', default=ESCALAS,
+            help=f'Comma-separated fichaje volumes (default: {ESCALAS})',
+        )
+        parser.add_argument('--repeticiones', type=int, default=3, help='Timed runs per view (default: 3)')
+        parser.add_argument('--salida', default='benchmark_reports.json', help='JSON report path')
+        parser.add_argument('--comparar', help='Previous JSON report to compare with')
+        parser.add_argument(
+            '--conservar', action='store_true', help='Keep the synthetic data of the last volume',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            escalas = [int(escala) for escala in options['escalas'].split(',')]
+        except ValueError:
+            raise CommandError('--escalas must be a comma-separated list of integers')
+        if options['repeticiones'] < 1 or any(escala < 1 for escala in escalas):
+            raise CommandError('--repeticiones and the volumes must be at least 1')
+        anterior = None
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as fichero:
+                anterior = json.load(fichero)
+        if CustomUser.objects.filter(username__startswith=datos_sinteticos.PREFIJO).exists():
+            raise CommandError('Synthetic data already exists; run seed_fichajes --borrar first')
+
+        informe = {
+            'formato': FORMATO,
+            'fecha': timezone.now().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'base_datos': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'repeticiones': options['repeticiones'],
+            'escalas': [],
+        }
+        try:
+            for escala in escalas:
+                informe['escalas'].append(self.medir_escala(escala, options['repeticiones']))
+                if escala != escalas[-1] or not options['conservar']:
+                    datos_sinteticos.borrar()
+        except BaseException:
+            datos_sinteticos.borrar()
+            raise
+
+        with open(options['salida'], 'w', encoding='utf-8') as fichero:
+            json.dump(informe, fichero, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"✓ Report written to {options['salida']}"))
+        if anterior:
+            self.comparar(anterior, informe)
+
+    def medir_escala(self, escala, repeticiones):
+        self.stdout.write(f"Seeding {escala} fichajes...")
+        empezar = time.perf_counter()
+        creados = datos_sinteticos.sembrar(escala)
+        siembra = time.perf_counter() - empezar
+
+        admin = CustomUser.objects.create_user(
+            f'{datos_sinteticos.PREFIJO}admin', f'{datos_sinteticos.PREFIJO}admin@example.com', None,
+            role='admin', is_staff=True,
+        )
+        cliente = Client(HTTP_HOST=_host())
+        cliente.force_login(admin, backend='django.contrib.auth.backends.ModelBackend')
+        proyecto = Proyecto.objects.filter(nombre__startswith=datos_sinteticos.PREFIJO).order_by('id').first()
+        trabajador = CustomUser.objects.filter(username=f'{datos_sinteticos.PREFIJO}0').get()
+
+        resultados = {}
+        self.stdout.write(
+            f"{'view':<32}{'status':>7}{'queries':>9}{'db ms':>10}{'render ms':>11}"
+            f"{'total ms':>10}{'cached ms':>11}{'peak KiB':>10}"
+        )
+        for nombre, url in vistas(proyecto.id, trabajador.id):
+            resultados[nombre] = datos = self.medir_vista(cliente, url, repeticiones)
+            self.stdout.write(
+                f"{nombre:<32}{datos['estado']:>7}{datos['consultas']:>9}{datos['bd_ms']:>10.1f}"
+                f"{datos['plantillas_ms']:>11.1f}{datos['total_ms']:>10.1f}{datos['total_cache_ms']:>11.1f}"
+                f"{datos['memoria_pico_kib']:>10}"
+            )
+        return {**creados, 'siembra_s': round(siembra, 1), 'vistas': resultados}
+
+    def medir_vista(self, cliente, url, repeticiones):
+        """Mediana de `repeticiones` peticiones sin caché, una con caché y una con tracemalloc"""
+
+        def peticion():
+            medicion = Medicion()
+            empezar = time.perf_counter()
+            with medicion.medir():
+                respuesta = cliente.get(url)
+                tamano = len(b''.join(respuesta.streaming_content) if respuesta.streaming else respuesta.content)
+            return respuesta.status_code, tamano, medicion, time.perf_counter() - empezar
+
+        frias = []
+        for _ in range(repeticiones):
+            invalidar('fichajes', 'proyectos', 'usuarios')
+            frias.append(peticion())
+        estado, tamano, _, _ = frias[-1]
+        _, _, _, caliente = peticion()
+
+        invalidar('fichajes', 'proyectos', 'usuarios')
+        tracemalloc.start()
+        try:
+            peticion()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'url': url,
+            'estado': estado,
+            'bytes': tamano,
+            'consultas': frias[-1][2].consultas,
+            'bd_ms': round(statistics.median(medicion.bd for _, _, medicion, _ in frias) * 1000, 2),
+            'plantillas_ms': round(statistics.median(medicion.plantillas for _, _, medicion, _ in frias) * 1000, 2),
+            'total_ms': round(statistics.median(total for _, _, _, total in frias) * 1000, 2),
+            'total_cache_ms': round(caliente * 1000, 2),
+            'memoria_pico_kib': pico // 1024,
+        }
+
+    def comparar(self, anterior, actual):
+        """Diferencias de tiempo total y consultas por escala y vista"""
+        self.stdout.write(f"\nCompared with {anterior.get('commit') or anterior.get('fecha', '?')}:")
+        previas = {escala['registros']: escala['vistas'] for escala in anterior.get('escalas', [])}
+        for escala in actual['escalas']:
+            antes = previas.get(escala['registros'])
+            if antes is None:
+                continue
+            self.stdout.write(f"  {escala['registros']} fichajes")
+            for nombre, datos in escala['vistas'].items():
+                previo = antes.get(nombre)
+                if not previo:
+                    continue
+                cambio = (datos['total_ms'] - previo['total_ms']) / previo['total_ms'] * 100 if previo['total_ms'] else 0
+                estilo = self.style.ERROR if cambio > 10 else self.style.SUCCESS if cambio < -10 else str
+                self.stdout.write(estilo(
+                    f"    {nombre:<32}{previo['total_ms']:>10.1f} -> {datos['total_ms']:>10.1f} ms "
+                    f"({cambio:+.0f}%)   queries {previo['consultas']} -> {datos['consultas']}"
+                ))
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.aprovisionamiento_ldap import (
+    CREADO, VENTANA, CsvInvalido, aprovisionar, informe_csv, leer_csv,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create LDAP users from a CSV (username, first_name, last_name, email, password, role '
+        'and optionally is_staff) and add them to the groups of their role. Adds and group '
+        'changes are pipelined on one connection; prints a per-row report as CSV.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', help='Path of the CSV file')
+        parser.add_argument(
+            '--ventana', type=int, default=VENTANA,
+            help=f'LDAP operations in flight at once (default: {VENTANA})',
+        )
+        parser.add_argument('--informe', help='Write the per-row report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['ventana'] < 1:
+            raise CommandError('--ventana must be at least 1')
+
+        try:
+            with open(options['csv'], 'rb') as fichero:
+                filas = leer_csv(fichero)
+        except (OSError, CsvInvalido) as e:
+            raise CommandError(str(e))
+
+        empezar = time.perf_counter()
+        aprovisionar(filas, ventana=options['ventana'])
+        duracion = time.perf_counter() - empezar
+
+        informe = informe_csv(filas)
+        if options['informe']:
+            with open(options['informe'], 'w', encoding='utf-8', newline='') as salida:
+                salida.write(informe)
+        else:
+            self.stdout.write(informe, ending='')
+
+        creados = sum(1 for fila in filas if fila.resultado == CREADO)
+        resumen = f"{creados} of {len(filas)} users created in {duracion:.2f} s"
+        if creados == len(filas):
+            self.stderr.write(self.style.SUCCESS(f"✓ {resumen}"))
+        else:
+            self.stderr.write(self.style.WARNING(f"{resumen}; {len(filas) - creados} rows failed"))
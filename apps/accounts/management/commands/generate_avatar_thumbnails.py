@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from apps.accounts.avatares import anotar, generar_miniaturas, guardar_ficheros, huella, leer_avatar
+from apps.accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the avatar thumbnails of users that do not have them yet (avatars uploaded '
+        'before the thumbnail pipeline). Images are resized in a process pool; each distinct '
+        'file is processed once even if several users share it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)',
+        )
+        parser.add_argument('--forzar', action='store_true', help='Regenerate existing thumbnails too')
+
+    def handle(self, *args, **options):
+        if options['procesos'] < 1:
+            raise CommandError('--procesos must be at least 1')
+
+        # Users grouped by avatar file: the default avatar is shared by many
+        por_origen = {}
+        usuarios = CustomUser.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        for usuario in usuarios.only('id', 'avatar', 'avatar_thumbnails').iterator():
+            if options['forzar'] or (usuario.avatar_thumbnails or {}).get('source') != usuario.avatar.name:
+                por_origen.setdefault(usuario.avatar.name, []).append(usuario)
+        self.stdout.write(f"{sum(map(len, por_origen.values()))} users, {len(por_origen)} distinct avatar files")
+
+        self.generados = self.fallidos = 0
+        limite = options['procesos'] * 2
+        # django.setup() so workers can import the app modules whatever the start method
+        with ProcessPoolExecutor(max_workers=options['procesos'], initializer=django.setup) as pool:
+            pendientes = {}
+            for origen, grupo in por_origen.items():
+                contenido = leer_avatar(grupo[0])
+                if contenido is None:
+                    self.fallidos += len(grupo)
+                    continue
+                pendientes[pool.submit(generar_miniaturas, contenido)] = (origen, huella(contenido), grupo)
+                # Bounded in flight: the file contents travel to the workers
+                while len(pendientes) >= limite:
+                    self._terminar(pendientes, wait(pendientes, return_when=FIRST_COMPLETED).done)
+            self._terminar(pendientes, list(pendientes))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {self.generados} users updated, {self.fallidos} skipped (missing or invalid image)"
+        ))
+
+    def _terminar(self, pendientes, terminados):
+        for futuro in terminados:
+            origen, hash_origen, grupo = pendientes.pop(futuro)
+            try:
+                miniaturas = futuro.result()
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                self.stderr.write(f"{origen}: {e}")
+                self.fallidos += len(grupo)
+                continue
+            rutas = guardar_ficheros(hash_origen, miniaturas)
+            anotar(CustomUser.objects.filter(id__in=[usuario.id for usuario in grupo]), origen, hash_origen, rutas)
+            self.generados += len(grupo)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.rollups import reconstruir_resumenes
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and monthly fichaje rollup tables from RegistroFichaje'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows read and inserted per batch (default: 2000)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding fichaje rollups...")
+
+        total_diarios, total_mensuales = reconstruir_resumenes(chunk_size=options['chunk_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ Rollups rebuilt: {total_diarios} daily and {total_mensuales} monthly buckets"
+            )
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts import materializadas
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the report materialized views (Postgres) with REFRESH ... CONCURRENTLY. '
+        'Meant to run on a schedule, e.g. nightly from cron.'
+    )
+
+    def handle(self, *args, **options):
+        if not materializadas.activas():
+            self.stdout.write(
+                "Materialized views are disabled (they need REPORTS_MATERIALIZED_VIEWS=True "
+                "and Postgres); reports read the live rollups."
+            )
+            return
+
+        self.stdout.write("Refreshing report materialized views...")
+        estado = materializadas.refrescar()
+        self.stdout.write(
+            self.style.SUCCESS(f"✓ {estado.nombre} covers fichajes before {estado.cubre_hasta:%Y-%m-%d}")
+        )
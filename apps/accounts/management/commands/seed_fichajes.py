@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts import datos_sinteticos
+from apps.accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-create synthetic users, projects and fichajes with realistic distributions '
+        '(jornadas, night shifts crossing midnight, missing clock-outs, weekends) and rebuild '
+        'the report rollups. Everything is named with --prefijo; --borrar removes it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registros', type=int, default=10_000, help='Fichajes to create (default: 10000)')
+        parser.add_argument(
+            '--usuarios', type=int,
+            help='Users (default: about one per 1000 fichajes, between 20 and 5000)',
+        )
+        parser.add_argument('--proyectos', type=int, help='Projects (default: one per 20 users, at least 5)')
+        parser.add_argument('--semilla', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--chunk-size', type=int, default=datos_sinteticos.CHUNK_SIZE,
+            help=f'Rows per bulk_create (default: {datos_sinteticos.CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--prefijo', default=datos_sinteticos.PREFIJO,
+            help=f'Prefix of the synthetic usernames and project names (default: {datos_sinteticos.PREFIJO})',
+        )
+        parser.add_argument('--borrar', action='store_true', help='Delete the synthetic data and exit')
+
+    def handle(self, *args, **options):
+        prefijo = options['prefijo']
+        if not prefijo:
+            raise CommandError('--prefijo cannot be empty')
+
+        if options['borrar']:
+            borrados = datos_sinteticos.borrar(prefijo)
+            self.stdout.write(self.style.SUCCESS(f"✓ Synthetic data deleted ({borrados} fichajes)"))
+            return
+
+        if options['registros'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--registros and --chunk-size must be at least 1')
+        if CustomUser.objects.filter(username__startswith=prefijo).exists():
+            raise CommandError(f'Synthetic data with prefix {prefijo!r} already exists; run with --borrar first')
+
+        empezar = time.perf_counter()
+
+        def progreso(total):
+            if options['verbosity'] >= 2 or total == options['registros']:
+                transcurrido = time.perf_counter() - empezar
+                self.stdout.write(f"  {total} fichajes ({total / transcurrido:.0f}/s)")
+
+        creados = datos_sinteticos.sembrar(
+            options['registros'],
+            usuarios=options['usuarios'],
+            proyectos=options['proyectos'],
+            prefijo=prefijo,
+            semilla=options['semilla'],
+            chunk_size=options['chunk_size'],
+            progreso=progreso,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {creados['registros']} fichajes for {creados['usuarios']} users and "
+            f"{creados['proyectos']} projects in {time.perf_counter() - empezar:.1f} s (rollups rebuilt)"
+        ))
@@ -0,0 +1,59 @@
+import textwrap
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import ExpressionWrapper, F, FloatField
+
+from apps.accounts.models import ConsultaLenta
+
+
+ORDENES = {
+    'total': '-tiempo_total',
+    'max': '-tiempo_maximo',
+    'count': '-ejecuciones',
+    'avg': '-media',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'List the slow-query fingerprints recorded above SLOW_QUERY_THRESHOLD_MS, worst total '
+        'time first, with the view and code that ran them and their captured EXPLAIN.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=10, help='Fingerprints to show (default: 10)')
+        parser.add_argument(
+            '--orden', choices=sorted(ORDENES), default='total',
+            help='Sort by total time, max time, run count or average time (default: total)',
+        )
+        parser.add_argument('--sin-plan', action='store_true', help='Do not print the EXPLAIN output')
+        parser.add_argument('--vaciar', action='store_true', help='Delete every recorded fingerprint and exit')
+
+    def handle(self, *args, **options):
+        if options['vaciar']:
+            borradas, _ = ConsultaLenta.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"✓ {borradas} slow-query fingerprints deleted"))
+            return
+        if options['limite'] < 1:
+            raise CommandError('--limite must be at least 1')
+
+        consultas = ConsultaLenta.objects.annotate(
+            media=ExpressionWrapper(F('tiempo_total') / F('ejecuciones'), output_field=FloatField()),
+        ).order_by(ORDENES[options['orden']], 'id')[:options['limite']]
+        if not consultas:
+            self.stdout.write("No slow queries recorded.")
+            return
+
+        for posicion, consulta in enumerate(consultas, 1):
+            self.stdout.write(self.style.WARNING(
+                f"#{posicion} {consulta.huella[:12]}  total {consulta.tiempo_total:.2f} s  "
+                f"runs {consulta.ejecuciones}  avg {consulta.media * 1000:.0f} ms  "
+                f"max {consulta.tiempo_maximo * 1000:.0f} ms  last {consulta.ultima:%Y-%m-%d %H:%M}"
+            ))
+            self.stdout.write(f"  view: {consulta.vista or '-'}  at: {consulta.origen or '-'}")
+            sql = consulta.sql if options['verbosity'] >= 2 else textwrap.shorten(consulta.sql, 400)
+            self.stdout.write(textwrap.indent(sql, '  '))
+            if consulta.plan and not options['sin_plan']:
+                self.stdout.write("  plan:")
+                self.stdout.write(textwrap.indent(consulta.plan, '    '))
+            self.stdout.write("")
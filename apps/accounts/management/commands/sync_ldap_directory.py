@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.directorio_ldap import sincronizar_directorio
+
+
+class Command(BaseCommand):
+    help = (
+        'Sync the local LDAP directory mirror used by the admin user screens. Incremental '
+        '(entries modified since the last sync) unless --full; also flags Django users whose '
+        'LDAP entry disappeared. Meant to run on a schedule, e.g. every few minutes from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Re-read every entry')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Syncing LDAP directory...")
+
+        sincronizacion = sincronizar_directorio(completa=options['full'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ {sincronizacion.created} new, {sincronizacion.updated} updated, "
+                f"{sincronizacion.unchanged} unchanged, {sincronizacion.deleted} removed; "
+                f"{sincronizacion.users_flagged} Django users flagged as missing from LDAP"
+            )
+        )
@@ -0,0 +1,124 @@
+"""
+Vista materializada de totales mensuales para los reportes (solo Postgres).
+
+Con REPORTS_MATERIALIZED_VIEWS activo y base de datos Postgres, los totales por
+proyecto y por trabajador de un rango se leen de accounts_totalmensualreporte
+(una fila por usuario, proyecto, jornada y mes) siempre que la vista cubra el
+rango entero. Si no lo cubre, o en SQLite, se calculan como siempre a partir
+de los resúmenes (agregar_resumenes_en_cache).
+
+La vista solo incluye los fichajes anteriores a VistaMaterializada.cubre_hasta,
+que el comando refresh_report_views fija en el día en que se refresca. Un rango
+está cubierto si:
+
+- empieza el día 1 de un mes (o no tiene inicio),
+- termina el último día de un mes o el día anterior a cubre_hasta, y
+- ningún fichaje de antes de su fin se ha modificado desde el último refresco.
+
+Lo último se controla con cambios_desde: cada cambio de fichajes anterior a
+cubre_hasta lo rebaja, en la misma transacción que el cambio, y el refresco lo
+vuelve a dejar vacío mientras tiene la fila bloqueada, así que ningún cambio
+se pierde entre medias.
+"""
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import DateField, F, Max, Sum, Value
+from django.db.models.functions import Least
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import agregar_resumenes_en_cache
+from .models import TotalMensualReporte, VistaMaterializada
+from .rollups import resumenes_actualizados
+
+
+NOMBRE = TotalMensualReporte._meta.db_table
+
+
+def activas():
+    """True si los reportes deben usar la vista materializada"""
+    return getattr(settings, 'REPORTS_MATERIALIZED_VIEWS', False) and connection.vendor == 'postgresql'
+
+
+def cubre(fecha_desde, fecha_hasta):
+    """True si la vista materializada tiene los totales exactos del rango"""
+    if not activas() or fecha_hasta is None:
+        return False
+    if fecha_desde and fecha_desde.day != 1:
+        return False
+
+    estado = VistaMaterializada.objects.filter(nombre=NOMBRE).values('cubre_hasta', 'cambios_desde').first()
+    if not estado or not estado['cubre_hasta'] or fecha_hasta >= estado['cubre_hasta']:
+        return False
+    siguiente = fecha_hasta + timedelta(days=1)
+    if siguiente.day != 1 and siguiente != estado['cubre_hasta']:
+        return False
+    return estado['cambios_desde'] is None or fecha_hasta < estado['cambios_desde']
+
+
+def agregar_vista(campos, fecha_desde=None, fecha_hasta=None, **filtros):
+    """Como agregar_resumenes(), leyendo los meses del rango de la vista materializada"""
+    totales = TotalMensualReporte.objects.filter(**filtros)
+    if fecha_desde:
+        totales = totales.filter(mes__gte=fecha_desde)
+    if fecha_hasta:
+        totales = totales.filter(mes__lte=fecha_hasta)
+
+    filas = totales.order_by().values(*campos).annotate(
+        total_registros=Sum('registros'),
+        total_con_horas=Sum('registros_con_horas'),
+        total_horas=Sum('horas'),
+        dia_max=Max('ultimo_dia'),
+    )
+    return {
+        tuple(fila[campo] for campo in campos): {
+            'registros': fila['total_registros'] or 0,
+            'registros_con_horas': fila['total_con_horas'] or 0,
+            'horas': fila['total_horas'] or timedelta(),
+            'ultimo_dia': fila['dia_max'],
+        }
+        for fila in filas
+    }
+
+
+def agregar_totales(campos, fecha_desde=None, fecha_hasta=None, **filtros):
+    """
+    Totales de los reportes: de la vista materializada si cubre el rango y,
+    si no, de los resúmenes a través de la caché.
+    """
+    if cubre(fecha_desde, fecha_hasta):
+        return agregar_vista(campos, fecha_desde, fecha_hasta, **filtros)
+    return agregar_resumenes_en_cache(campos, fecha_desde, fecha_hasta, **filtros)
+
+
+def refrescar():
+    """
+    Refresca la vista con los fichajes anteriores a hoy sin bloquear a quien
+    la esté leyendo (REFRESH ... CONCURRENTLY). Devuelve el estado resultante.
+    """
+    with transaction.atomic():
+        # Mientras dure el refresco, los cambios de días ya cubiertos esperan
+        # a poder anotar cambios_desde en esta fila
+        estado, _ = VistaMaterializada.objects.select_for_update().get_or_create(nombre=NOMBRE)
+        estado.cubre_hasta = timezone.localdate()
+        estado.cambios_desde = None
+        estado.actualizada = timezone.now()
+        estado.save()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {NOMBRE}')
+    return estado
+
+
+@receiver(resumenes_actualizados)
+def fichajes_modificados(sender, claves=None, **kwargs):
+    if not activas():
+        return
+    # Sin claves se han reconstruido todos los resúmenes
+    desde = min(clave[3] for clave in claves) if claves else date.min
+    VistaMaterializada.objects.filter(nombre=NOMBRE, cubre_hasta__gt=desde).update(
+        # En Postgres LEAST ignora los NULL
+        cambios_desde=Least(F('cambios_desde'), Value(desde, output_field=DateField())),
+    )
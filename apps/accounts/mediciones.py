@@ -0,0 +1,104 @@
+"""
+Medición del coste de una petición: consultas, tiempo en base de datos,
+tiempo renderizando plantillas y tiempo esperando a LDAP.
+
+    medicion = Medicion()
+    with medicion.medir():
+        respuesta = vista(request)
+    medicion.consultas, medicion.bd, medicion.plantillas, medicion.ldap   # segundos
+
+Las consultas se cuentan con connection.execute_wrapper(). Para las plantillas
+se envuelve una sola vez Template.render: la medición activa se guarda en una
+ContextVar, así que cada hilo o petición suma solo lo suyo, y solo cuenta el
+render exterior (las plantillas incluidas o heredadas ya están dentro).
+El tiempo de plantillas incluye el de las consultas que se lanzan al
+renderizar (querysets perezosos usados en la plantilla).
+
+Las operaciones LDAP se marcan con el decorador medir_ldap; igual que con las
+plantillas, si una llama a otra solo cuenta la exterior. Sin una medición
+activa el decorador solo cuesta leer la ContextVar.
+"""
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import connections
+from django.template.base import Template
+
+
+_actual = ContextVar('medicion', default=None)
+
+
+class Medicion:
+
+    def __init__(self):
+        self.consultas = 0
+        self.bd = 0.0
+        self.plantillas = 0.0
+        self.ldap = 0.0
+        self._profundidad = 0
+        self._profundidad_ldap = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        empezar = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.bd += time.perf_counter() - empezar
+            self.consultas += 1
+
+    @contextmanager
+    def medir(self, bases_datos=None):
+        """Mide lo que ocurre dentro del bloque en este hilo"""
+        instrumentar_plantillas()
+        token = _actual.set(self)
+        try:
+            with ExitStack() as pila:
+                for alias in bases_datos or connections:
+                    pila.enter_context(connections[alias].execute_wrapper(self))
+                yield self
+        finally:
+            _actual.reset(token)
+
+
+def instrumentar_plantillas():
+    """Envuelve Template.render para sumar su tiempo a la medición activa (idempotente)"""
+    if getattr(Template.render, '_medido', False):
+        return
+    original = Template.render
+
+    @wraps(original)
+    def render(self, context):
+        medicion = _actual.get()
+        if medicion is None:
+            return original(self, context)
+        medicion._profundidad += 1
+        empezar = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            medicion._profundidad -= 1
+            if not medicion._profundidad:
+                medicion.plantillas += time.perf_counter() - empezar
+
+    render._medido = True
+    Template.render = render
+
+
+def medir_ldap(funcion):
+    """Suma a la medición activa el tiempo de `funcion`"""
+    @wraps(funcion)
+    def envoltorio(*args, **kwargs):
+        medicion = _actual.get()
+        if medicion is None:
+            return funcion(*args, **kwargs)
+        medicion._profundidad_ldap += 1
+        empezar = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            medicion._profundidad_ldap -= 1
+            if not medicion._profundidad_ldap:
+                medicion.ldap += time.perf_counter() - empezar
+    return envoltorio
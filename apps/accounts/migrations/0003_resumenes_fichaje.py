@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:28
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_proyecto_registrofichaje'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenFichajeDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jornada', models.CharField(choices=[('presencial', 'Presencial'), ('remoto', 'Remoto'), ('desplazamiento', 'Desplazamiento')], max_length=20)),
+                ('registros', models.PositiveIntegerField(default=0)),
+                ('registros_con_horas', models.PositiveIntegerField(default=0)),
+                ('horas', models.DurationField(default=datetime.timedelta)),
+                ('fecha', models.DateField()),
+                ('proyecto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.proyecto')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de fichajes',
+                'verbose_name_plural': 'Resúmenes diarios de fichajes',
+                'indexes': [models.Index(fields=['fecha'], name='accounts_re_fecha_2ac872_idx'), models.Index(fields=['proyecto', 'fecha'], name='accounts_re_proyect_c288d3_idx')],
+                'unique_together': {('usuario', 'proyecto', 'jornada', 'fecha')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenFichajeMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jornada', models.CharField(choices=[('presencial', 'Presencial'), ('remoto', 'Remoto'), ('desplazamiento', 'Desplazamiento')], max_length=20)),
+                ('registros', models.PositiveIntegerField(default=0)),
+                ('registros_con_horas', models.PositiveIntegerField(default=0)),
+                ('horas', models.DurationField(default=datetime.timedelta)),
+                ('mes', models.DateField()),
+                ('primer_dia', models.DateField(blank=True, null=True)),
+                ('ultimo_dia', models.DateField(blank=True, null=True)),
+                ('proyecto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.proyecto')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual de fichajes',
+                'verbose_name_plural': 'Resúmenes mensuales de fichajes',
+                'indexes': [models.Index(fields=['mes'], name='accounts_re_mes_95365b_idx'), models.Index(fields=['proyecto', 'mes'], name='accounts_re_proyect_975e67_idx')],
+                'unique_together': {('usuario', 'proyecto', 'jornada', 'mes')},
+            },
+        ),
+    ]
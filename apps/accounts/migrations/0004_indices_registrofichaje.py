@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_resumenes_fichaje'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registrofichaje',
+            index=models.Index(fields=['fecha'], name='registro_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrofichaje',
+            index=models.Index(fields=['proyecto', 'fecha'], name='registro_proyecto_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrofichaje',
+            index=models.Index(fields=['jornada', 'fecha'], name='registro_jornada_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrofichaje',
+            index=models.Index(condition=models.Q(('horas_trabajadas__isnull', False)), fields=['usuario', 'fecha'], name='registro_con_horas_idx'),
+        ),
+    ]
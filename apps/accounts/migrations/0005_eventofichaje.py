@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_indices_registrofichaje'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoFichaje',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave_idempotencia', models.CharField(max_length=64, unique=True)),
+                ('accion', models.CharField(max_length=20)),
+                ('momento', models.DateTimeField()),
+                ('resultado', models.JSONField(default=dict)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Evento de fichaje',
+                'verbose_name_plural': 'Eventos de fichaje',
+            },
+        ),
+    ]
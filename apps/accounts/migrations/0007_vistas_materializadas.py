@@ -0,0 +1,92 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:57
+
+import datetime
+from django.db import migrations, models
+
+
+# Totales mensuales de los fichajes anteriores a cubre_hasta. El id de texto
+# es el índice único que necesita REFRESH MATERIALIZED VIEW CONCURRENTLY.
+CREAR_VISTA = """
+CREATE MATERIALIZED VIEW accounts_totalmensualreporte AS
+SELECT
+    concat_ws(':', r.usuario_id, coalesce(r.proyecto_id, 0), r.jornada,
+              date_trunc('month', r.fecha)::date) AS id,
+    r.usuario_id,
+    r.proyecto_id,
+    r.jornada,
+    date_trunc('month', r.fecha)::date AS mes,
+    count(*) AS registros,
+    count(r.horas_trabajadas) AS registros_con_horas,
+    coalesce(sum(r.horas_trabajadas), interval '0') AS horas,
+    max(r.fecha) AS ultimo_dia
+FROM accounts_registrofichaje r
+WHERE r.fecha < (
+    SELECT v.cubre_hasta FROM accounts_vistamaterializada v
+    WHERE v.nombre = 'accounts_totalmensualreporte'
+)
+GROUP BY r.usuario_id, r.proyecto_id, r.jornada, date_trunc('month', r.fecha)
+"""
+
+CREAR_INDICES = [
+    "CREATE UNIQUE INDEX accounts_totalmensualreporte_id ON accounts_totalmensualreporte (id)",
+    "CREATE INDEX accounts_totalmensualreporte_mes ON accounts_totalmensualreporte (mes)",
+    "CREATE INDEX accounts_totalmensualreporte_proyecto_mes ON accounts_totalmensualreporte (proyecto_id, mes)",
+]
+
+
+def crear_vista(apps, schema_editor):
+    # En SQLite los reportes siguen leyendo de los resúmenes
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREAR_VISTA)
+    for sql in CREAR_INDICES:
+        schema_editor.execute(sql)
+
+
+def borrar_vista(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP MATERIALIZED VIEW IF EXISTS accounts_totalmensualreporte")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_trabajoreporte'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TotalMensualReporte',
+            fields=[
+                ('id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('jornada', models.CharField(choices=[('presencial', 'Presencial'), ('remoto', 'Remoto'), ('desplazamiento', 'Desplazamiento')], max_length=20)),
+                ('mes', models.DateField()),
+                ('registros', models.PositiveIntegerField(default=0)),
+                ('registros_con_horas', models.PositiveIntegerField(default=0)),
+                ('horas', models.DurationField(default=datetime.timedelta)),
+                ('ultimo_dia', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Total mensual de reporte',
+                'verbose_name_plural': 'Totales mensuales de reporte',
+                'db_table': 'accounts_totalmensualreporte',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='VistaMaterializada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=63, unique=True)),
+                ('cubre_hasta', models.DateField(blank=True, null=True)),
+                ('cambios_desde', models.DateField(blank=True, null=True)),
+                ('actualizada', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Vista materializada',
+                'verbose_name_plural': 'Vistas materializadas',
+            },
+        ),
+        migrations.RunPython(crear_vista, borrar_vista),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_vistas_materializadas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LdapDirectorySync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('updated', models.PositiveIntegerField(default=0)),
+                ('unchanged', models.PositiveIntegerField(default=0)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('users_flagged', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'LDAP directory sync',
+                'verbose_name_plural': 'LDAP directory syncs',
+            },
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='ldap_missing_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='LdapDirectoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dn', models.CharField(max_length=255, unique=True)),
+                ('uid', models.CharField(max_length=150)),
+                ('cn', models.CharField(blank=True, max_length=255)),
+                ('sn', models.CharField(blank=True, max_length=150)),
+                ('mail', models.CharField(blank=True, max_length=255)),
+                ('modify_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('entry_csn', models.CharField(blank=True, max_length=64)),
+                ('synced_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'LDAP directory entry',
+                'verbose_name_plural': 'LDAP directory entries',
+                'indexes': [models.Index(fields=['uid'], name='ldap_entry_uid_idx'), models.Index(fields=['modify_timestamp'], name='ldap_entry_modified_idx')],
+            },
+        ),
+    ]
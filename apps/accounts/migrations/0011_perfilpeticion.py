@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_miniaturas_avatar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilPeticion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metodo', models.CharField(max_length=10)),
+                ('ruta', models.CharField(max_length=500)),
+                ('vista', models.CharField(blank=True, max_length=200)),
+                ('estado', models.PositiveSmallIntegerField()),
+                ('duracion', models.FloatField()),
+                ('muestras', models.PositiveIntegerField(default=0)),
+                ('fichero', models.CharField(max_length=100)),
+                ('funciones', models.JSONField(default=list)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Perfil de petición',
+                'verbose_name_plural': 'Perfiles de petición',
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
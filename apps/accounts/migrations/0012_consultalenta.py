@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_perfilpeticion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultaLenta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('huella', models.CharField(max_length=40, unique=True)),
+                ('sql', models.TextField()),
+                ('ejemplo', models.TextField()),
+                ('parametros', models.TextField(blank=True)),
+                ('plan', models.TextField(blank=True)),
+                ('vista', models.CharField(blank=True, max_length=200)),
+                ('origen', models.CharField(blank=True, max_length=300)),
+                ('ejecuciones', models.PositiveIntegerField(default=0)),
+                ('tiempo_total', models.FloatField(default=0)),
+                ('tiempo_maximo', models.FloatField(default=0)),
+                ('primera', models.DateTimeField(auto_now_add=True)),
+                ('ultima', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Consulta lenta',
+                'verbose_name_plural': 'Consultas lentas',
+            },
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.utils import timezone
 from datetime import datetime, timedelta
@@ -38,12 +38,37 @@ class CustomUser(AbstractUser):
         null=True,
         default="profiles/default.jpg"
     )
+    # Fixed-size variants of the avatar, generated by apps/accounts/avatares.py
+    avatar_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Set by sync_ldap_directory when the user's LDAP entry disappears
+    ldap_missing_since = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Column values as loaded, to compare them after an LDAP login (see ldap_signals)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Set by ldap_user_role_mapping: only the columns the LDAP login changed
+        changed_fields = self.__dict__.pop('_ldap_changed_fields', None)
+        if changed_fields is not None and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = changed_fields
+        super().save(*args, **kwargs)
+
     objects = CustomManagerUser()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Listado de usuarios filtrado por rol, en orden de username
+            models.Index(fields=['role', 'username'], name='accounts_user_role_idx'),
+        ]
+
 
 # Modelo para proyectos
 class Proyecto(models.Model):
@@ -99,9 +124,30 @@ class RegistroFichaje(models.Model):
             self.horas_trabajadas = None
             self.completo = False
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guardamos la clave de resumen original para poder recalcular
+        # también el bucket antiguo si cambia fecha, proyecto o jornada
+        if not {'usuario_id', 'proyecto_id', 'jornada', 'fecha'} & instance.get_deferred_fields():
+            instance._clave_resumen_original = instance.clave_resumen()
+        return instance
+
+    def clave_resumen(self):
+        """Devuelve la clave (usuario, proyecto, jornada, fecha) de los resúmenes"""
+        return (self.usuario_id, self.proyecto_id, self.jornada, self.fecha)
+
     def save(self, *args, **kwargs):
+        from .rollups import actualizar_resumenes
+
         self.calcular_horas()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            actualizar_resumenes([
+                getattr(self, '_clave_resumen_original', None),
+                self.clave_resumen(),
+            ])
+        self._clave_resumen_original = self.clave_resumen()
 
     def __str__(self):
         return f"{self.usuario.username} - {self.fecha}"
@@ -111,3 +157,260 @@ class RegistroFichaje(models.Model):
         verbose_name_plural = "Registros de Fichaje"
         unique_together = ('usuario', 'fecha')  # Un registro por usuario por día
         ordering = ['-fecha', '-hora_entrada']
+        # (usuario, fecha) ya está cubierto por el índice de unique_together
+        indexes = [
+            models.Index(fields=['fecha'], name='registro_fecha_idx'),
+            models.Index(fields=['proyecto', 'fecha'], name='registro_proyecto_fecha_idx'),
+            models.Index(fields=['jornada', 'fecha'], name='registro_jornada_fecha_idx'),
+            models.Index(
+                fields=['usuario', 'fecha'],
+                name='registro_con_horas_idx',
+                condition=models.Q(horas_trabajadas__isnull=False),
+            ),
+        ]
+
+
+# Resúmenes precalculados de fichajes para los reportes de administración
+class ResumenFichajeBase(models.Model):
+    usuario = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    proyecto = models.ForeignKey(Proyecto, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    jornada = models.CharField(max_length=20, choices=RegistroFichaje.JORNADA_CHOICES)
+
+    registros = models.PositiveIntegerField(default=0)
+    registros_con_horas = models.PositiveIntegerField(default=0)
+    horas = models.DurationField(default=timedelta)
+
+    class Meta:
+        abstract = True
+
+
+# Un bucket por usuario, proyecto, jornada y día
+class ResumenFichajeDiario(ResumenFichajeBase):
+    fecha = models.DateField()
+
+    def __str__(self):
+        return f"{self.usuario_id} - {self.proyecto_id} - {self.jornada} - {self.fecha}"
+
+    class Meta:
+        verbose_name = "Resumen diario de fichajes"
+        verbose_name_plural = "Resúmenes diarios de fichajes"
+        unique_together = ('usuario', 'proyecto', 'jornada', 'fecha')
+        indexes = [
+            models.Index(fields=['fecha']),
+            models.Index(fields=['proyecto', 'fecha']),
+        ]
+
+
+# Un bucket por usuario, proyecto, jornada y mes (mes = primer día del mes)
+class ResumenFichajeMensual(ResumenFichajeBase):
+    mes = models.DateField()
+    primer_dia = models.DateField(null=True, blank=True)
+    ultimo_dia = models.DateField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.usuario_id} - {self.proyecto_id} - {self.jornada} - {self.mes:%Y-%m}"
+
+    class Meta:
+        verbose_name = "Resumen mensual de fichajes"
+        verbose_name_plural = "Resúmenes mensuales de fichajes"
+        unique_together = ('usuario', 'proyecto', 'jornada', 'mes')
+        indexes = [
+            models.Index(fields=['mes']),
+            models.Index(fields=['proyecto', 'mes']),
+        ]
+
+
+# Eventos de fichaje recibidos en lote desde los terminales de entrada
+class EventoFichaje(models.Model):
+    clave_idempotencia = models.CharField(max_length=64, unique=True)
+    usuario = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    accion = models.CharField(max_length=20)
+    momento = models.DateTimeField()
+    resultado = models.JSONField(default=dict)  # Respuesta devuelta al terminal
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.clave_idempotencia} - {self.accion}"
+
+    class Meta:
+        verbose_name = "Evento de fichaje"
+        verbose_name_plural = "Eventos de fichaje"
+
+
+# Reportes calculados en segundo plano (Celery) para rangos de fechas grandes
+class TrabajoReporte(models.Model):
+    TIPO_CHOICES = [
+        ('proyectos', 'Reporte de proyectos'),
+        ('trabajadores', 'Reporte de trabajadores'),
+    ]
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+    ESTADOS_ACTIVOS = ('pendiente', 'en_curso')
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    parametros = models.JSONField(default=dict)  # Filtros del reporte
+    huella = models.CharField(max_length=64)  # Hash de tipo + parámetros, para deduplicar
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    solicitado_por = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    expira = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.parametros} - {self.estado}"
+
+    class Meta:
+        verbose_name = "Trabajo de reporte"
+        verbose_name_plural = "Trabajos de reporte"
+        indexes = [
+            models.Index(fields=['huella', 'estado'], name='trabajo_reporte_huella_idx'),
+            models.Index(fields=['expira'], name='trabajo_reporte_expira_idx'),
+        ]
+        constraints = [
+            # Como mucho un trabajo en marcha por reporte: las peticiones
+            # idénticas simultáneas esperan al mismo
+            models.UniqueConstraint(
+                fields=['huella'],
+                condition=models.Q(estado__in=['pendiente', 'en_curso']),
+                name='trabajo_reporte_activo_unico',
+            ),
+        ]
+
+
+# Estado de una vista materializada de reportes (solo Postgres, ver materializadas.py)
+class VistaMaterializada(models.Model):
+    nombre = models.CharField(max_length=63, unique=True)
+    cubre_hasta = models.DateField(null=True, blank=True)  # Primer día que la vista no incluye
+    cambios_desde = models.DateField(null=True, blank=True)  # Primer día con fichajes modificados tras refrescarla
+    actualizada = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.nombre
+
+    class Meta:
+        verbose_name = "Vista materializada"
+        verbose_name_plural = "Vistas materializadas"
+
+
+# Totales mensuales por usuario, proyecto y jornada de la vista materializada
+# accounts_totalmensualreporte. No la gestiona Django: la crea la migración 0007
+# solo en Postgres y la refresca el comando refresh_report_views.
+class TotalMensualReporte(models.Model):
+    id = models.CharField(max_length=100, primary_key=True)
+    usuario = models.ForeignKey(
+        CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    proyecto = models.ForeignKey(
+        Proyecto, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    jornada = models.CharField(max_length=20, choices=RegistroFichaje.JORNADA_CHOICES)
+    mes = models.DateField()
+
+    registros = models.PositiveIntegerField(default=0)
+    registros_con_horas = models.PositiveIntegerField(default=0)
+    horas = models.DurationField(default=timedelta)
+    ultimo_dia = models.DateField(null=True, blank=True)
+
+    class Meta:
+        managed = False
+        db_table = 'accounts_totalmensualreporte'
+        verbose_name = "Total mensual de reporte"
+        verbose_name_plural = "Totales mensuales de reporte"
+
+
+# Local mirror of the LDAP user entries (see directorio_ldap.sincronizar_directorio)
+class LdapDirectoryEntry(models.Model):
+    dn = models.CharField(max_length=255, unique=True)
+    uid = models.CharField(max_length=150)
+    cn = models.CharField(max_length=255, blank=True)
+    sn = models.CharField(max_length=150, blank=True)
+    mail = models.CharField(max_length=255, blank=True)
+
+    modify_timestamp = models.DateTimeField(null=True, blank=True)  # modifyTimestamp in LDAP
+    entry_csn = models.CharField(max_length=64, blank=True)  # entryCSN (OpenLDAP)
+    synced_at = models.DateTimeField()  # Last time the entry was written by a sync
+
+    def __str__(self):
+        return self.dn
+
+    class Meta:
+        verbose_name = "LDAP directory entry"
+        verbose_name_plural = "LDAP directory entries"
+        indexes = [
+            models.Index(fields=['uid'], name='ldap_entry_uid_idx'),
+            models.Index(fields=['modify_timestamp'], name='ldap_entry_modified_idx'),
+        ]
+
+
+# One run of sync_ldap_directory
+class LdapDirectorySync(models.Model):
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    unchanged = models.PositiveIntegerField(default=0)
+    deleted = models.PositiveIntegerField(default=0)
+    users_flagged = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} - {self.created}/{self.updated}/{self.deleted}"
+
+    class Meta:
+        verbose_name = "LDAP directory sync"
+        verbose_name_plural = "LDAP directory syncs"
+
+
+# Perfil de una petición pedido por un administrador (ver perfilado.py)
+class PerfilPeticion(models.Model):
+    usuario = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    metodo = models.CharField(max_length=10)
+    ruta = models.CharField(max_length=500)
+    vista = models.CharField(max_length=200, blank=True)
+    estado = models.PositiveSmallIntegerField()
+    duracion = models.FloatField()  # Segundos
+    muestras = models.PositiveIntegerField(default=0)  # Pilas recogidas por el muestreador
+    fichero = models.CharField(max_length=100)  # Nombre base en PROFILING_DIR (.prof y .txt)
+    funciones = models.JSONField(default=list)  # Funciones con más tiempo propio
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.fecha:%Y-%m-%d %H:%M} {self.metodo} {self.ruta} ({self.duracion:.2f} s)"
+
+    class Meta:
+        verbose_name = "Perfil de petición"
+        verbose_name_plural = "Perfiles de petición"
+        ordering = ['-fecha']
+
+
+# Consultas que superaron SLOW_QUERY_THRESHOLD_MS, una fila por huella (ver consultas_lentas.py)
+class ConsultaLenta(models.Model):
+    huella = models.CharField(max_length=40, unique=True)  # Hash del SQL normalizado
+    sql = models.TextField()  # SQL normalizado: literales y listas IN sustituidos
+    ejemplo = models.TextField()  # Primera consulta lenta con esta huella, tal cual
+    parametros = models.TextField(blank=True)  # repr() de sus parámetros
+    plan = models.TextField(blank=True)  # EXPLAIN del ejemplo, capturado una sola vez
+    vista = models.CharField(max_length=200, blank=True)
+    origen = models.CharField(max_length=300, blank=True)  # fichero:línea en función, del código del proyecto
+    ejecuciones = models.PositiveIntegerField(default=0)
+    tiempo_total = models.FloatField(default=0)  # Segundos
+    tiempo_maximo = models.FloatField(default=0)
+    primera = models.DateTimeField(auto_now_add=True)
+    ultima = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.huella[:12]} x{self.ejecuciones} ({self.tiempo_total:.2f} s)"
+
+    class Meta:
+        verbose_name = "Consulta lenta"
+        verbose_name_plural = "Consultas lentas"
@@ -0,0 +1,132 @@
+"""
+Paginación por clave (keyset) de listados de RegistroFichaje.
+
+Los registros se ordenan del más reciente al más antiguo por
+(fecha, hora_entrada, id) y cada página se pide "después de" o "antes de" la
+última/primera fila de la anterior, en lugar de con OFFSET. La base de datos
+entra directamente por el índice de fecha en el punto del cursor, así que la
+página 500 cuesta lo mismo que la primera, y los fichajes nuevos (que caen al
+principio del listado) no desplazan las páginas que ya se están recorriendo.
+
+hora_entrada admite NULL (registros con proyecto elegido pero sin entrada):
+dentro de cada día esos registros van al final, igual en SQLite y Postgres.
+"""
+import base64
+import json
+from datetime import date, time
+
+from django.db.models import F, Q
+
+
+PARAMETRO_DESPUES = 'despues'
+PARAMETRO_ANTES = 'antes'
+
+
+def codificar_cursor(registro):
+    """Cursor opaco con la clave de ordenación de un registro"""
+    datos = [
+        registro.fecha.isoformat(),
+        registro.hora_entrada.isoformat() if registro.hora_entrada else None,
+        registro.pk,
+    ]
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(fecha, hora_entrada, id) de un cursor, o None si no es válido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        fecha, hora, pk = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return date.fromisoformat(fecha), time.fromisoformat(hora) if hora else None, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def _mas_antiguos(fecha, hora, pk):
+    """Registros que van después de la clave en el orden descendente"""
+    if hora is None:
+        mismo_dia = Q(fecha=fecha, hora_entrada__isnull=True, id__lt=pk)
+    else:
+        mismo_dia = Q(fecha=fecha) & (
+            Q(hora_entrada__lt=hora) | Q(hora_entrada__isnull=True) | Q(hora_entrada=hora, id__lt=pk)
+        )
+    # fecha__lte redundante para que el índice acote el rango
+    return Q(fecha__lte=fecha) & (Q(fecha__lt=fecha) | mismo_dia)
+
+
+def _mas_recientes(fecha, hora, pk):
+    """Registros que van antes de la clave en el orden descendente"""
+    if hora is None:
+        mismo_dia = Q(fecha=fecha) & (Q(hora_entrada__isnull=False) | Q(id__gt=pk))
+    else:
+        mismo_dia = Q(fecha=fecha, hora_entrada__gt=hora) | Q(fecha=fecha, hora_entrada=hora, id__gt=pk)
+    return Q(fecha__gte=fecha) & (Q(fecha__gt=fecha) | mismo_dia)
+
+
+ORDEN_DESCENDENTE = ('-fecha', F('hora_entrada').desc(nulls_last=True), '-id')
+ORDEN_ASCENDENTE = ('fecha', F('hora_entrada').asc(nulls_first=True), 'id')
+
+
+class PaginaRegistros:
+    """Una página del listado con los cursores para moverse a las vecinas"""
+
+    def __init__(self, registros, hay_siguiente, hay_anterior, parametros):
+        self.registros = registros
+        self.hay_siguiente = hay_siguiente
+        self.hay_anterior = hay_anterior
+        self._parametros = parametros
+
+    def __iter__(self):
+        return iter(self.registros)
+
+    def __len__(self):
+        return len(self.registros)
+
+    @property
+    def cursor_siguiente(self):
+        return codificar_cursor(self.registros[-1]) if self.hay_siguiente and self.registros else None
+
+    @property
+    def cursor_anterior(self):
+        return codificar_cursor(self.registros[0]) if self.hay_anterior and self.registros else None
+
+    def _query(self, parametro, cursor):
+        if cursor is None:
+            return None
+        parametros = self._parametros.copy()
+        parametros.pop(PARAMETRO_DESPUES, None)
+        parametros.pop(PARAMETRO_ANTES, None)
+        parametros[parametro] = cursor
+        return '?' + parametros.urlencode()
+
+    @property
+    def query_siguiente(self):
+        """Query string de la página siguiente (más antigua), conservando los filtros"""
+        return self._query(PARAMETRO_DESPUES, self.cursor_siguiente)
+
+    @property
+    def query_anterior(self):
+        """Query string de la página anterior (más reciente), conservando los filtros"""
+        return self._query(PARAMETRO_ANTES, self.cursor_anterior)
+
+
+def paginar_registros(queryset, parametros, tamano):
+    """
+    Devuelve la PaginaRegistros de `queryset` indicada por los parámetros GET
+    ('despues' o 'antes'). Sin cursor, o con uno inválido, devuelve la primera.
+    """
+    despues = decodificar_cursor(parametros.get(PARAMETRO_DESPUES, ''))
+    antes = decodificar_cursor(parametros.get(PARAMETRO_ANTES, '')) if not despues else None
+
+    if antes:
+        # Página anterior: se leen hacia atrás y se devuelven en el orden normal
+        registros = list(queryset.filter(_mas_recientes(*antes)).order_by(*ORDEN_ASCENDENTE)[:tamano + 1])
+        hay_anterior = len(registros) > tamano
+        registros = registros[:tamano][::-1]
+        return PaginaRegistros(registros, True, hay_anterior, parametros)
+
+    if despues:
+        queryset = queryset.filter(_mas_antiguos(*despues))
+    registros = list(queryset.order_by(*ORDEN_DESCENDENTE)[:tamano + 1])
+    hay_siguiente = len(registros) > tamano
+    return PaginaRegistros(registros[:tamano], hay_siguiente, despues is not None, parametros)
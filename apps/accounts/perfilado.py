@@ -0,0 +1,230 @@
+"""
+Perfilado bajo demanda de una petición concreta, para administradores.
+
+Un administrador añade ?_perfil=1 a la URL (o la cabecera X-Profile: 1) y
+PerfiladoMiddleware ejecuta esa petición bajo cProfile y, a la vez, con un
+muestreador que cada PROFILING_SAMPLE_INTERVAL segundos apunta la pila del
+hilo de la petición. Se guardan en PROFILING_DIR:
+
+- <nombre>.prof: estadísticas de cProfile, para pstats, snakeviz, etc.
+- <nombre>.txt: pilas colapsadas ("a;b;c 12" por línea), la entrada de
+  flamegraph.pl, speedscope o inferno.
+
+y un PerfilPeticion con las funciones con más tiempo propio, que se listan en
+/reports/profiles/. Se conservan los PROFILING_KEEP más recientes.
+
+Para que no sirva para tumbar el sitio:
+
+- Solo los usuarios con rol admin pueden pedirlo; para el resto el
+  parámetro se ignora.
+- Como mucho PROFILING_RATE_LIMIT perfiles cada PROFILING_RATE_WINDOW
+  segundos entre todos los procesos (contador en la caché compartida).
+- Un solo perfil a la vez por proceso.
+Si no se puede perfilar, la petición se atiende normalmente y la cabecera
+X-Profile de la respuesta dice por qué ('limit' o 'busy'); si se perfila,
+lleva el id del perfil.
+
+Sin PROFILING_ENABLED el middleware se quita de la cadena al arrancar.
+El contenido de las respuestas en streaming se genera después y no entra
+en el perfil.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+from .models import PerfilPeticion
+
+
+logger = logging.getLogger(__name__)
+
+PARAMETRO = '_perfil'
+CABECERA = 'HTTP_X_PROFILE'
+PREFIJO = 'accounts:perfiles'
+FUNCIONES = 20  # Funciones que se guardan en PerfilPeticion.funciones
+
+# cProfile y el muestreador son caros: un perfil a la vez por proceso
+_en_curso = threading.Lock()
+
+
+def carpeta():
+    return str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def ruta_fichero(perfil, extension):
+    return os.path.join(carpeta(), f'{perfil.fichero}.{extension}')
+
+
+def solicitado(request):
+    return PARAMETRO in request.GET or bool(request.META.get(CABECERA))
+
+
+def puede_perfilar(usuario):
+    return usuario.is_authenticated and usuario.role == 'admin'
+
+
+def reservar():
+    """Cuenta un perfil en la ventana actual; False si ya se alcanzó el límite"""
+    ventana = getattr(settings, 'PROFILING_RATE_WINDOW', 3600)
+    clave = f'{PREFIJO}:{int(time.time() // ventana)}'
+    cache = caches['default']
+    cache.add(clave, 0, timeout=ventana)
+    try:
+        usados = cache.incr(clave)
+    except ValueError:
+        # La clave caducó entre add() e incr()
+        cache.set(clave, 1, timeout=ventana)
+        usados = 1
+    return usados <= getattr(settings, 'PROFILING_RATE_LIMIT', 20)
+
+
+def _nombre(frame):
+    codigo = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(codigo, 'co_qualname', codigo.co_name)}"
+
+
+class Muestreador(threading.Thread):
+    """
+    Apunta cada `intervalo` segundos la pila del hilo con ident `hilo`, desde
+    `base` (el frame del middleware) hasta la función que se está ejecutando.
+    """
+
+    def __init__(self, hilo, base, intervalo):
+        super().__init__(name='perfilado-muestreador', daemon=True)
+        self.hilo = hilo
+        self.base = base
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.hilo)
+            pila = []
+            while frame is not None and frame is not self.base:
+                pila.append(_nombre(frame))
+                frame = frame.f_back
+            if pila:
+                self.pilas[';'.join(reversed(pila))] += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+    def colapsadas(self):
+        return ''.join(f'{pila} {cuenta}\n' for pila, cuenta in self.pilas.most_common())
+
+
+def funciones(perfilador, limite=FUNCIONES):
+    """Las `limite` funciones con más tiempo propio"""
+    estadisticas = pstats.Stats(perfilador).stats
+    filas = sorted(estadisticas.items(), key=lambda item: item[1][2], reverse=True)[:limite]
+    return [
+        {
+            'funcion': pstats.func_std_string(pstats.func_strip_path(funcion)),
+            'llamadas': llamadas,
+            'propio_ms': round(propio * 1000, 2),
+            'acumulado_ms': round(acumulado * 1000, 2),
+        }
+        for funcion, (_, llamadas, propio, acumulado, _) in filas
+    ]
+
+
+def guardar(request, response, perfilador, muestreador, duracion):
+    nombre = f'{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+    os.makedirs(carpeta(), exist_ok=True)
+    perfilador.dump_stats(os.path.join(carpeta(), f'{nombre}.prof'))
+    with open(os.path.join(carpeta(), f'{nombre}.txt'), 'w', encoding='utf-8') as fichero:
+        fichero.write(muestreador.colapsadas())
+
+    coincidencia = request.resolver_match
+    perfil = PerfilPeticion.objects.create(
+        usuario=request.user,
+        metodo=request.method,
+        ruta=request.get_full_path()[:500],
+        vista=coincidencia.view_name if coincidencia else '',
+        estado=response.status_code,
+        duracion=duracion,
+        muestras=sum(muestreador.pilas.values()),
+        fichero=nombre,
+        funciones=funciones(perfilador),
+    )
+    purgar()
+    return perfil
+
+
+def purgar():
+    """Borra los perfiles (y sus ficheros) que sobran de los PROFILING_KEEP más recientes"""
+    conservar = getattr(settings, 'PROFILING_KEEP', 50)
+    sobran = list(PerfilPeticion.objects.order_by('-fecha', '-id')[conservar:])
+    for perfil in sobran:
+        for extension in ('prof', 'txt'):
+            try:
+                os.remove(ruta_fichero(perfil, extension))
+            except FileNotFoundError:
+                pass
+    PerfilPeticion.objects.filter(id__in=[perfil.id for perfil in sobran]).delete()
+
+
+class PerfiladoMiddleware:
+    """Perfila las peticiones que lo piden; ver el docstring del módulo"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not solicitado(request) or not puede_perfilar(request.user):
+            return self.get_response(request)
+
+        if not _en_curso.acquire(blocking=False):
+            motivo = 'busy'
+        elif not reservar():
+            _en_curso.release()
+            motivo = 'limit'
+        else:
+            try:
+                return self.perfilar(request)
+            finally:
+                _en_curso.release()
+
+        response = self.get_response(request)
+        response['X-Profile'] = motivo
+        return response
+
+    def perfilar(self, request):
+        muestreador = Muestreador(
+            threading.get_ident(), sys._getframe(), getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.005),
+        )
+        perfilador = cProfile.Profile()
+        muestreador.start()
+        empezar = time.perf_counter()
+        perfilador.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            perfilador.disable()
+            duracion = time.perf_counter() - empezar
+            muestreador.parar()
+
+        try:
+            perfil = guardar(request, response, perfilador, muestreador, duracion)
+        except Exception:
+            # Un fallo al guardar el perfil no debe estropear la respuesta
+            logger.exception("Could not store the profile of %s", request.path)
+            response['X-Profile'] = 'error'
+        else:
+            response['X-Profile'] = str(perfil.id)
+            logger.info("Profiled %s %s in %.3f s (profile %s)", request.method, request.path, duracion, perfil.id)
+        return response
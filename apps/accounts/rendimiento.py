@@ -0,0 +1,228 @@
+"""
+Instrumentación de rendimiento por petición.
+
+Con PERFORMANCE_INSTRUMENTATION activado, RendimientoMiddleware mide cada
+petición con mediciones.Medicion (consultas y tiempo en base de datos,
+plantillas y LDAP) y:
+
+- Añade la cabecera Server-Timing, que las herramientas de desarrollo del
+  navegador muestran en la pestaña de red:
+  db;dur=12.3;desc="8 consultas", tpl;dur=4.1, ldap;dur=35.0, total;dur=60.2
+- Escribe una línea clave=valor en el logger apps.accounts.rendimiento, con
+  los mismos datos también en el atributo `rendimiento` del LogRecord.
+- Suma el tiempo total a un histograma por vista con una ventana móvil de
+  PERFORMANCE_HISTOGRAM_WINDOW segundos, que se ve en el dashboard de
+  reportes. Como los contadores de la caché, se acumulan en memoria y se
+  vuelcan a L2 cada PERFORMANCE_FLUSH_INTERVAL segundos, en claves por franja
+  de PERFORMANCE_HISTOGRAM_SLOT segundos que caducan solas.
+
+Desactivado, el middleware lanza MiddlewareNotUsed y Django lo quita de la
+cadena al arrancar: no queda ningún coste por petición.
+
+El tiempo total no incluye el de enviar el contenido de las respuestas en
+streaming (exportaciones CSV), que se genera después.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+
+from .mediciones import Medicion, instrumentar_plantillas
+
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = 'accounts:perf'
+# Límites superiores de los tramos del histograma, en ms; el último tramo no tiene límite
+LIMITES = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Sumas por vista además de los tramos: tiempo total y de BD en µs, consultas
+SUMAS = ('total_us', 'bd_us', 'consultas')
+
+_pendientes = Counter()
+_vistas_pendientes = set()
+_lock = threading.Lock()
+_ultimo_volcado = time.monotonic()
+
+
+def activo():
+    return getattr(settings, 'PERFORMANCE_INSTRUMENTATION', False)
+
+
+def _cache():
+    return caches['default']
+
+
+def _franja_segundos():
+    return getattr(settings, 'PERFORMANCE_HISTOGRAM_SLOT', 300)
+
+
+def _franjas():
+    """Franjas de la ventana móvil, de la más antigua a la actual"""
+    duracion = _franja_segundos()
+    actual = int(time.time() // duracion)
+    numero = max(getattr(settings, 'PERFORMANCE_HISTOGRAM_WINDOW', 3600) // duracion, 1)
+    return range(actual - numero + 1, actual + 1)
+
+
+def _clave(franja, vista, campo):
+    return f'{PREFIJO}:{franja}:{vista}:{campo}'
+
+
+def _clave_vistas():
+    return f'{PREFIJO}:vistas'
+
+
+def tramo(ms):
+    """Índice del tramo del histograma para una duración en ms"""
+    return bisect_left(LIMITES, ms)
+
+
+def etiquetas():
+    return [f'≤{limite}' for limite in LIMITES] + [f'>{LIMITES[-1]}']
+
+
+def registrar(vista, medicion, total):
+    """Acumula una petición de `vista` que tardó `total` segundos"""
+    global _ultimo_volcado
+    franja = int(time.time() // _franja_segundos())
+    with _lock:
+        _pendientes[(franja, vista, tramo(total * 1000))] += 1
+        _pendientes[(franja, vista, 'total_us')] += round(total * 1_000_000)
+        _pendientes[(franja, vista, 'bd_us')] += round(medicion.bd * 1_000_000)
+        _pendientes[(franja, vista, 'consultas')] += medicion.consultas
+        _vistas_pendientes.add(vista)
+        ahora = time.monotonic()
+        if ahora - _ultimo_volcado < getattr(settings, 'PERFORMANCE_FLUSH_INTERVAL', 10):
+            return
+        _ultimo_volcado = ahora
+    volcar()
+
+
+def volcar():
+    """Suma a L2 los contadores acumulados en este proceso"""
+    with _lock:
+        pendientes = dict(_pendientes)
+        vistas = set(_vistas_pendientes)
+        _pendientes.clear()
+        _vistas_pendientes.clear()
+    if not pendientes:
+        return
+
+    # Las claves caducan cuando su franja sale de la ventana
+    timeout = getattr(settings, 'PERFORMANCE_HISTOGRAM_WINDOW', 3600) + _franja_segundos()
+    for (franja, vista, campo), cantidad in pendientes.items():
+        clave = _clave(franja, vista, campo)
+        try:
+            _cache().incr(clave, cantidad)
+        except ValueError:
+            if not _cache().add(clave, cantidad, timeout=timeout):
+                _cache().incr(clave, cantidad)
+
+    # Lista de vistas conocidas para poder leer sus claves. Si dos procesos la
+    # escriben a la vez se puede perder una vista nueva, que se vuelve a añadir
+    # en el siguiente volcado de ese proceso.
+    conocidas = _cache().get(_clave_vistas(), set())
+    if not vistas <= conocidas:
+        _cache().set(_clave_vistas(), conocidas | vistas, timeout=None)
+
+
+def _percentil(cuentas, fraccion):
+    """Límite superior del tramo donde cae el percentil (None: el último tramo)"""
+    objetivo = sum(cuentas) * fraccion
+    acumulado = 0
+    for indice, cuenta in enumerate(cuentas):
+        acumulado += cuenta
+        if acumulado >= objetivo:
+            return LIMITES[indice] if indice < len(LIMITES) else None
+    return None
+
+
+def histogramas():
+    """Peticiones, medias, percentiles aproximados y tramos de cada vista en la ventana, las más lentas primero"""
+    volcar()
+    vistas = sorted(_cache().get(_clave_vistas(), set()))
+    campos = list(range(len(LIMITES) + 1)) + list(SUMAS)
+    franjas = _franjas()
+    valores = _cache().get_many([
+        _clave(franja, vista, campo) for franja in franjas for vista in vistas for campo in campos
+    ])
+
+    filas = []
+    for vista in vistas:
+        datos = {
+            campo: sum(valores.get(_clave(franja, vista, campo), 0) for franja in franjas)
+            for campo in campos
+        }
+        cuentas = [datos[indice] for indice in range(len(LIMITES) + 1)]
+        peticiones = sum(cuentas)
+        if not peticiones:
+            continue
+        filas.append({
+            'vista': vista,
+            'peticiones': peticiones,
+            'media_ms': datos['total_us'] / peticiones / 1000,
+            'bd_media_ms': datos['bd_us'] / peticiones / 1000,
+            'consultas_media': datos['consultas'] / peticiones,
+            'p50_ms': _percentil(cuentas, 0.5),
+            'p95_ms': _percentil(cuentas, 0.95),
+            'tramos': cuentas,
+        })
+    filas.sort(key=lambda fila: (-(fila['p95_ms'] or float('inf')), -fila['media_ms']))
+    return filas
+
+
+def server_timing(medicion, total):
+    partes = [
+        f'db;dur={medicion.bd * 1000:.1f};desc="{medicion.consultas} consultas"',
+        f'tpl;dur={medicion.plantillas * 1000:.1f}',
+    ]
+    if medicion.ldap:
+        partes.append(f'ldap;dur={medicion.ldap * 1000:.1f}')
+    partes.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(partes)
+
+
+class RendimientoMiddleware:
+    """Mide cada petición; ver el docstring del módulo"""
+
+    def __init__(self, get_response):
+        if not activo():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrumentar_plantillas()
+
+    def __call__(self, request):
+        medicion = Medicion()
+        empezar = time.perf_counter()
+        with medicion.medir():
+            response = self.get_response(request)
+        total = time.perf_counter() - empezar
+
+        response['Server-Timing'] = server_timing(medicion, total)
+        coincidencia = request.resolver_match
+        vista = coincidencia.view_name if coincidencia else None
+        datos = {
+            'vista': vista or '-',
+            'metodo': request.method,
+            'ruta': request.path,
+            'estado': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'bd_ms': round(medicion.bd * 1000, 1),
+            'consultas': medicion.consultas,
+            'plantillas_ms': round(medicion.plantillas * 1000, 1),
+            'ldap_ms': round(medicion.ldap * 1000, 1),
+        }
+        logger.info(
+            ' '.join(f'{clave}=%s' for clave in datos), *datos.values(),
+            extra={'rendimiento': datos},
+        )
+        # Las rutas que no existen no tienen vista; no se guardan para no
+        # llenar la lista de vistas con URLs arbitrarias
+        if vista:
+            registrar(vista, medicion, total)
+        return response
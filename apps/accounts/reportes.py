@@ -0,0 +1,232 @@
+"""
+Reportes de proyectos y trabajadores, en la petición o en segundo plano.
+
+Las estadísticas se calculan como diccionarios serializables en JSON
+{id: totales}; la vista las aplica después a las instancias de Proyecto o
+CustomUser que muestra la plantilla. Así el mismo cálculo sirve tanto para la
+respuesta directa como para un TrabajoReporte ejecutado por Celery.
+
+Los rangos grandes (más de REPORTS_ASYNC_MIN_DAYS días, o sin fecha de inicio)
+se piden con solicitar_reporte(): si ya hay un trabajo idéntico en marcha o un
+resultado sin caducar se reutiliza, y si no se crea uno nuevo y se encola.
+"""
+import hashlib
+import json
+import logging
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import materializadas
+from .cache import proyectos_activos
+from .models import CustomUser, TrabajoReporte
+
+
+logger = logging.getLogger(__name__)
+
+
+def _horas(filas):
+    """Segundos trabajados de varias filas de resúmenes (None si ninguna tiene horas)"""
+    filas = [datos for datos in filas if datos['registros_con_horas']]
+    if not filas:
+        return None
+    return sum((datos['horas'] for datos in filas), timedelta()).total_seconds()
+
+
+def estadisticas_proyectos(fecha_desde=None, fecha_hasta=None):
+    """Totales por proyecto activo: trabajadores, registros y segundos trabajados"""
+    totales = materializadas.agregar_totales(
+        ('proyecto_id', 'usuario_id'), fecha_desde, fecha_hasta, proyecto__activo=True
+    )
+    filas_por_proyecto = {}
+    for (proyecto_id, usuario_id), datos in totales.items():
+        filas_por_proyecto.setdefault(proyecto_id, []).append(datos)
+
+    return {
+        str(proyecto_id): {
+            'total_trabajadores': len(filas),
+            'total_registros': sum(datos['registros'] for datos in filas),
+            'total_horas': _horas(filas),
+        }
+        for proyecto_id, filas in filas_por_proyecto.items()
+    }
+
+
+def estadisticas_trabajadores(fecha_desde=None, fecha_hasta=None):
+    """Totales por trabajador activo: días, horas, proyectos, jornadas y último fichaje"""
+    totales = materializadas.agregar_totales(
+        ('usuario_id', 'proyecto_id', 'jornada'), fecha_desde, fecha_hasta, usuario__is_active=True
+    )
+    filas_por_usuario = {}
+    for (usuario_id, proyecto_id, jornada), datos in totales.items():
+        filas_por_usuario.setdefault(usuario_id, []).append((proyecto_id, jornada, datos))
+
+    resultado = {}
+    for usuario_id, filas in filas_por_usuario.items():
+        registros_con_horas = sum(datos['registros_con_horas'] for _, _, datos in filas)
+        ultimos_dias = [datos['ultimo_dia'] for _, _, datos in filas if datos['ultimo_dia']]
+        total_horas = _horas([datos for _, _, datos in filas])
+
+        resultado[str(usuario_id)] = {
+            'total_dias_trabajados': sum(datos['registros'] for _, _, datos in filas),
+            'total_horas': total_horas,
+            'proyectos_trabajados': len({proyecto_id for proyecto_id, _, _ in filas if proyecto_id}),
+            'horas_promedio_dia': total_horas / registros_con_horas if registros_con_horas else None,
+            'dias_presencial': sum(datos['registros'] for _, j, datos in filas if j == 'presencial'),
+            'dias_remoto': sum(datos['registros'] for _, j, datos in filas if j == 'remoto'),
+            'dias_desplazamiento': sum(datos['registros'] for _, j, datos in filas if j == 'desplazamiento'),
+            'ultimo_fichaje': max(ultimos_dias).isoformat() if ultimos_dias else None,
+        }
+    return resultado
+
+
+def _duracion(segundos):
+    return timedelta(seconds=segundos) if segundos is not None else None
+
+
+def ordenar_por_horas(objetos):
+    """Ordena por total_horas descendente dejando al final los que no tienen horas"""
+    objetos.sort(key=lambda obj: (obj.total_horas is not None, obj.total_horas or timedelta()), reverse=True)
+    return objetos
+
+
+def proyectos_con_estadisticas(estadisticas):
+    """Proyectos activos con las estadísticas aplicadas, como los espera la plantilla"""
+    proyectos = proyectos_activos()
+    for proyecto in proyectos:
+        datos = estadisticas.get(str(proyecto.id), {})
+        proyecto.total_trabajadores = datos.get('total_trabajadores', 0)
+        proyecto.total_registros = datos.get('total_registros', 0)
+        proyecto.total_horas = _duracion(datos.get('total_horas'))
+    proyectos.sort(key=lambda proyecto: proyecto.total_registros, reverse=True)
+    return proyectos
+
+
+def trabajadores_con_estadisticas(estadisticas):
+    """Trabajadores activos con las estadísticas aplicadas, como los espera la plantilla"""
+    trabajadores = list(CustomUser.objects.filter(is_active=True))
+    for trabajador in trabajadores:
+        datos = estadisticas.get(str(trabajador.id), {})
+        trabajador.total_dias_trabajados = datos.get('total_dias_trabajados', 0)
+        trabajador.total_horas = _duracion(datos.get('total_horas'))
+        trabajador.proyectos_trabajados = datos.get('proyectos_trabajados', 0)
+        trabajador.horas_promedio_dia = _duracion(datos.get('horas_promedio_dia'))
+        trabajador.dias_presencial = datos.get('dias_presencial', 0)
+        trabajador.dias_remoto = datos.get('dias_remoto', 0)
+        trabajador.dias_desplazamiento = datos.get('dias_desplazamiento', 0)
+
+        # Nombres usados por la plantilla
+        trabajador.total_dias = trabajador.total_dias_trabajados
+        trabajador.total_proyectos = trabajador.proyectos_trabajados
+        ultimo = datos.get('ultimo_fichaje')
+        trabajador.ultimo_fichaje = date.fromisoformat(ultimo) if ultimo else None
+    return ordenar_por_horas(trabajadores)
+
+
+TIPOS = {
+    'proyectos': estadisticas_proyectos,
+    'trabajadores': estadisticas_trabajadores,
+}
+
+
+def es_rango_grande(fecha_desde, fecha_hasta):
+    """True si el rango es lo bastante grande como para calcularlo en segundo plano"""
+    # La vista materializada lo resuelve en la petición sea cual sea el rango
+    if materializadas.cubre(fecha_desde, fecha_hasta):
+        return False
+    if fecha_desde is None:
+        return True
+    fecha_hasta = fecha_hasta or timezone.localdate()
+    return (fecha_hasta - fecha_desde).days > getattr(settings, 'REPORTS_ASYNC_MIN_DAYS', 92)
+
+
+def _parametros(fecha_desde, fecha_hasta):
+    return {
+        'fecha_desde': fecha_desde.isoformat() if fecha_desde else None,
+        'fecha_hasta': fecha_hasta.isoformat() if fecha_hasta else None,
+    }
+
+
+def _caducidad(ahora):
+    return ahora + timedelta(seconds=getattr(settings, 'REPORTS_RESULT_TTL', 15 * 60))
+
+
+def _huella(tipo, parametros):
+    return hashlib.sha256(json.dumps([tipo, parametros], sort_keys=True).encode()).hexdigest()
+
+
+def _reutilizable(huella):
+    ahora = timezone.now()
+    return TrabajoReporte.objects.filter(
+        Q(estado__in=TrabajoReporte.ESTADOS_ACTIVOS) | Q(estado='completado', expira__gt=ahora),
+        huella=huella,
+    ).order_by('-fecha_creacion').first()
+
+
+def solicitar_reporte(tipo, fecha_desde=None, fecha_hasta=None, usuario=None):
+    """
+    Devuelve el TrabajoReporte que calcula el reporte pedido: uno idéntico en
+    marcha o terminado y sin caducar, o uno nuevo que se encola al confirmar
+    la transacción.
+    """
+    from .tasks import generar_reporte
+
+    parametros = _parametros(fecha_desde, fecha_hasta)
+    huella = _huella(tipo, parametros)
+    ahora = timezone.now()
+
+    # Limpieza: resultados caducados y trabajos que ningún worker terminó
+    TrabajoReporte.objects.filter(expira__lt=ahora).delete()
+    TrabajoReporte.objects.filter(
+        estado__in=TrabajoReporte.ESTADOS_ACTIVOS,
+        fecha_creacion__lt=ahora - timedelta(seconds=getattr(settings, 'REPORTS_JOB_TIMEOUT', 30 * 60)),
+    ).update(estado='error', error='El trabajo no terminó a tiempo', fecha_fin=ahora, expira=_caducidad(ahora))
+
+    trabajo = _reutilizable(huella)
+    if trabajo:
+        return trabajo
+
+    try:
+        with transaction.atomic():
+            trabajo = TrabajoReporte.objects.create(
+                tipo=tipo, parametros=parametros, huella=huella, solicitado_por=usuario
+            )
+    except IntegrityError:
+        # Otra petición idéntica ha creado el trabajo a la vez que esta
+        return _reutilizable(huella)
+
+    transaction.on_commit(lambda: generar_reporte.delay(trabajo.id))
+    return trabajo
+
+
+def ejecutar_reporte(trabajo_id):
+    """Calcula un TrabajoReporte pendiente y guarda el resultado con su caducidad"""
+    # Solo un worker lo pasa de pendiente a en curso
+    if not TrabajoReporte.objects.filter(id=trabajo_id, estado='pendiente').update(estado='en_curso'):
+        return
+
+    trabajo = TrabajoReporte.objects.get(id=trabajo_id)
+    fechas = {
+        clave: date.fromisoformat(valor) if valor else None
+        for clave, valor in trabajo.parametros.items()
+    }
+    try:
+        resultado = TIPOS[trabajo.tipo](**fechas)
+    except Exception as e:
+        logger.exception("Error generando el reporte %s", trabajo_id)
+        ahora = timezone.now()
+        TrabajoReporte.objects.filter(id=trabajo_id).update(
+            estado='error', error=str(e), fecha_fin=ahora, expira=_caducidad(ahora)
+        )
+        return
+
+    ahora = timezone.now()
+    TrabajoReporte.objects.filter(id=trabajo_id).update(
+        estado='completado',
+        resultado=resultado,
+        fecha_fin=ahora,
+        expira=_caducidad(ahora),
+    )
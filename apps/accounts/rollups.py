@@ -0,0 +1,393 @@
+"""
+Resúmenes incrementales de fichajes para los reportes de administración.
+
+Cada RegistroFichaje aporta a un bucket diario (usuario, proyecto, jornada, fecha)
+y a uno mensual (usuario, proyecto, jornada, mes). Al guardar o borrar un registro
+solo se recalculan los buckets afectados, de forma que los reportes leen de tablas
+cuyo tamaño depende del número de filas del resultado y no del histórico completo.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import Signal, receiver
+
+from .models import CustomUser, Proyecto, RegistroFichaje, ResumenFichajeDiario, ResumenFichajeMensual
+
+
+# Se envía cada vez que cambian los resúmenes, es decir, cada vez que cambian
+# los fichajes por cualquier vía (save, delete, update en una sentencia, lotes)
+resumenes_actualizados = Signal()
+
+
+def inicio_mes(fecha):
+    """Primer día del mes de una fecha"""
+    return fecha.replace(day=1)
+
+
+def sumar_meses(mes, meses=1):
+    """Suma (o resta) meses a una fecha que ya es primer día de mes"""
+    indice = mes.year * 12 + mes.month - 1 + meses
+    return mes.replace(year=indice // 12, month=indice % 12 + 1, day=1)
+
+
+@transaction.atomic
+def actualizar_resumenes(claves):
+    """
+    Recalcula los buckets diarios y mensuales de las claves indicadas.
+    Cada clave es una tupla (usuario_id, proyecto_id, jornada, fecha); las
+    claves None se ignoran (por ejemplo, un registro recién creado no tiene
+    clave original).
+
+    El número de consultas no depende de cuántas claves se pasen, así que las
+    escrituras masivas (bulk_create/bulk_update) pueden recalcular todo de una vez.
+    """
+    claves = {clave for clave in claves if clave is not None}
+    if not claves:
+        return
+
+    usuarios = {clave[0] for clave in claves}
+
+    # Un recálculo a la vez por usuario: dos escritores concurrentes leerían los
+    # mismos buckets y ambos crearían el que falta (IntegrityError con proyecto,
+    # bucket duplicado con proyecto NULL, que unique_together no detecta).
+    # SQLite no tiene SELECT ... FOR UPDATE: ya ejecuta las escrituras de una en una.
+    if connection.features.has_select_for_update:
+        list(CustomUser.objects.select_for_update().filter(pk__in=usuarios).order_by('pk').values_list('pk', flat=True))
+
+    # Buckets diarios a partir de los registros
+    filas = (
+        RegistroFichaje.objects.filter(usuario_id__in=usuarios, fecha__in={clave[3] for clave in claves})
+        .order_by()
+        .values('usuario_id', 'proyecto_id', 'jornada', 'fecha')
+        .annotate(
+            total_registros=Count('id'),
+            total_con_horas=Count('horas_trabajadas'),
+            total_horas=Sum('horas_trabajadas'),
+        )
+    )
+    totales = {
+        (fila['usuario_id'], fila['proyecto_id'], fila['jornada'], fila['fecha']): {
+            'registros': fila['total_registros'],
+            'registros_con_horas': fila['total_con_horas'],
+            'horas': fila['total_horas'] or timedelta(),
+        }
+        for fila in filas
+    }
+    _sincronizar(ResumenFichajeDiario, 'fecha', claves, totales)
+
+    # Buckets mensuales a partir de los diarios
+    meses = {(usuario_id, proyecto_id, jornada, inicio_mes(fecha)) for usuario_id, proyecto_id, jornada, fecha in claves}
+    filas = (
+        ResumenFichajeDiario.objects.filter(
+            usuario_id__in=usuarios,
+            fecha__gte=min(clave[3] for clave in meses),
+            fecha__lt=sumar_meses(max(clave[3] for clave in meses)),
+        )
+        .order_by()
+        .annotate(mes_resumen=TruncMonth('fecha'))
+        .values('usuario_id', 'proyecto_id', 'jornada', 'mes_resumen')
+        .annotate(
+            total_registros=Sum('registros'),
+            total_con_horas=Sum('registros_con_horas'),
+            total_horas=Sum('horas'),
+            dia_min=Min('fecha'),
+            dia_max=Max('fecha'),
+        )
+    )
+    totales = {
+        (fila['usuario_id'], fila['proyecto_id'], fila['jornada'], fila['mes_resumen']): {
+            'registros': fila['total_registros'],
+            'registros_con_horas': fila['total_con_horas'],
+            'horas': fila['total_horas'] or timedelta(),
+            'primer_dia': fila['dia_min'],
+            'ultimo_dia': fila['dia_max'],
+        }
+        for fila in filas
+    }
+    _sincronizar(ResumenFichajeMensual, 'mes', meses, totales)
+    resumenes_actualizados.send(sender=RegistroFichaje, claves=claves)
+
+
+def actualizar_resumenes_dia(usuario_id, fecha):
+    """
+    Recalcula todos los buckets de un usuario en un día. Se usa tras las
+    actualizaciones en una sola sentencia (update/upsert), que no pasan por
+    save() y por tanto no conocen la clave de resumen anterior.
+    """
+    claves = {
+        (usuario_id, proyecto_id, jornada, fecha)
+        for proyecto_id, jornada in ResumenFichajeDiario.objects.filter(
+            usuario_id=usuario_id, fecha=fecha
+        ).values_list('proyecto_id', 'jornada').union(
+            RegistroFichaje.objects.filter(
+                usuario_id=usuario_id, fecha=fecha
+            ).order_by().values_list('proyecto_id', 'jornada')
+        )
+    }
+    actualizar_resumenes(claves)
+
+
+def _sincronizar(modelo, campo_fecha, claves, totales):
+    """Crea, actualiza o borra los buckets de `claves` para que coincidan con `totales`"""
+    existentes = {}
+    for bucket in modelo.objects.filter(
+        usuario_id__in={clave[0] for clave in claves},
+        **{f'{campo_fecha}__in': {clave[3] for clave in claves}},
+    ):
+        clave = (bucket.usuario_id, bucket.proyecto_id, bucket.jornada, getattr(bucket, campo_fecha))
+        if clave in claves:
+            existentes[clave] = bucket
+
+    crear, actualizar, borrar = [], [], []
+    campos = set()
+    for clave in claves:
+        datos = totales.get(clave)
+        bucket = existentes.get(clave)
+
+        if not datos:
+            if bucket:
+                borrar.append(bucket.pk)
+        elif bucket:
+            for campo, valor in datos.items():
+                setattr(bucket, campo, valor)
+            campos.update(datos)
+            actualizar.append(bucket)
+        else:
+            usuario_id, proyecto_id, jornada, fecha = clave
+            crear.append(modelo(
+                usuario_id=usuario_id, proyecto_id=proyecto_id, jornada=jornada,
+                **{campo_fecha: fecha}, **datos
+            ))
+
+    if borrar:
+        modelo.objects.filter(pk__in=borrar).delete()
+    if actualizar:
+        modelo.objects.bulk_update(actualizar, sorted(campos))
+    if crear:
+        modelo.objects.bulk_create(crear)
+
+
+@receiver(post_delete, sender=RegistroFichaje)
+def registro_fichaje_borrado(sender, instance, **kwargs):
+    """Mantiene los resúmenes al borrar registros (también desde querysets y cascadas)"""
+    actualizar_resumenes([
+        getattr(instance, '_clave_resumen_original', None),
+        instance.clave_resumen(),
+    ])
+
+
+@receiver(pre_delete, sender=Proyecto)
+def proyecto_a_borrar(sender, instance, **kwargs):
+    """
+    Al borrar un proyecto sus registros pasan a proyecto NULL (SET_NULL, con un
+    UPDATE que no pasa por save()). Si los buckets del proyecto pasaran también
+    a NULL quedarían duplicados junto a los que ya no tenían proyecto, así que se
+    borran aquí y se recalculan los buckets sin proyecto de esos días al terminar.
+    """
+    diarios = ResumenFichajeDiario.objects.filter(proyecto=instance)
+    instance._claves_resumen = {
+        (usuario_id, None, jornada, fecha)
+        for usuario_id, jornada, fecha in diarios.values_list('usuario_id', 'jornada', 'fecha')
+    }
+    ResumenFichajeMensual.objects.filter(proyecto=instance).delete()
+    diarios.delete()
+
+
+@receiver(post_delete, sender=Proyecto)
+def proyecto_borrado(sender, instance, **kwargs):
+    actualizar_resumenes(getattr(instance, '_claves_resumen', ()))
+
+
+def reconstruir_resumenes(chunk_size=2000):
+    """
+    Reconstruye desde cero las tablas de resúmenes a partir de RegistroFichaje.
+    Devuelve el número de buckets diarios y mensuales creados.
+    """
+    with transaction.atomic():
+        ResumenFichajeMensual.objects.all().delete()
+        ResumenFichajeDiario.objects.all().delete()
+
+        diarios = (
+            RegistroFichaje.objects.order_by()
+            .values('usuario_id', 'proyecto_id', 'jornada', 'fecha')
+            .annotate(
+                total_registros=Count('id'),
+                total_con_horas=Count('horas_trabajadas'),
+                total_horas=Sum('horas_trabajadas'),
+            )
+        )
+        total_diarios = _crear_en_bloques(
+            ResumenFichajeDiario,
+            (
+                ResumenFichajeDiario(
+                    usuario_id=fila['usuario_id'],
+                    proyecto_id=fila['proyecto_id'],
+                    jornada=fila['jornada'],
+                    fecha=fila['fecha'],
+                    registros=fila['total_registros'],
+                    registros_con_horas=fila['total_con_horas'],
+                    horas=fila['total_horas'] or timedelta(),
+                )
+                for fila in diarios.iterator(chunk_size=chunk_size)
+            ),
+            chunk_size,
+        )
+
+        mensuales = (
+            ResumenFichajeDiario.objects.order_by()
+            .annotate(mes_resumen=TruncMonth('fecha'))
+            .values('usuario_id', 'proyecto_id', 'jornada', 'mes_resumen')
+            .annotate(
+                total_registros=Sum('registros'),
+                total_con_horas=Sum('registros_con_horas'),
+                total_horas=Sum('horas'),
+                dia_min=Min('fecha'),
+                dia_max=Max('fecha'),
+            )
+        )
+        total_mensuales = _crear_en_bloques(
+            ResumenFichajeMensual,
+            (
+                ResumenFichajeMensual(
+                    usuario_id=fila['usuario_id'],
+                    proyecto_id=fila['proyecto_id'],
+                    jornada=fila['jornada'],
+                    mes=fila['mes_resumen'],
+                    registros=fila['total_registros'],
+                    registros_con_horas=fila['total_con_horas'],
+                    horas=fila['total_horas'] or timedelta(),
+                    primer_dia=fila['dia_min'],
+                    ultimo_dia=fila['dia_max'],
+                )
+                for fila in mensuales.iterator(chunk_size=chunk_size)
+            ),
+            chunk_size,
+        )
+
+    resumenes_actualizados.send(sender=RegistroFichaje, claves=None)
+    return total_diarios, total_mensuales
+
+
+def _crear_en_bloques(modelo, objetos, chunk_size):
+    total = 0
+    bloque = []
+    for objeto in objetos:
+        bloque.append(objeto)
+        if len(bloque) >= chunk_size:
+            modelo.objects.bulk_create(bloque)
+            total += len(bloque)
+            bloque = []
+    if bloque:
+        modelo.objects.bulk_create(bloque)
+        total += len(bloque)
+    return total
+
+
+def _tramos(fecha_desde, fecha_hasta):
+    """
+    Divide el rango [fecha_desde, fecha_hasta] en meses completos (tabla mensual)
+    y los días sueltos de los extremos (tabla diaria).
+    """
+    if fecha_desde is None or fecha_desde.day == 1:
+        mes_desde = fecha_desde and inicio_mes(fecha_desde)
+    else:
+        mes_desde = sumar_meses(inicio_mes(fecha_desde))
+
+    if fecha_hasta is None:
+        mes_hasta = None
+    elif fecha_hasta + timedelta(days=1) == sumar_meses(inicio_mes(fecha_hasta)):
+        mes_hasta = inicio_mes(fecha_hasta)
+    else:
+        mes_hasta = sumar_meses(inicio_mes(fecha_hasta), -1)
+
+    if mes_desde and mes_hasta and mes_desde > mes_hasta:
+        # El rango no contiene ningún mes completo
+        filtro = Q(fecha__gte=fecha_desde, fecha__lte=fecha_hasta)
+        return [(ResumenFichajeDiario, filtro, 'fecha')]
+
+    filtro_mensual = Q()
+    if mes_desde:
+        filtro_mensual &= Q(mes__gte=mes_desde)
+    if mes_hasta:
+        filtro_mensual &= Q(mes__lte=mes_hasta)
+    tramos = [(ResumenFichajeMensual, filtro_mensual, 'ultimo_dia')]
+
+    if fecha_desde and fecha_desde < mes_desde:
+        filtro = Q(fecha__gte=fecha_desde, fecha__lt=mes_desde)
+        tramos.append((ResumenFichajeDiario, filtro, 'fecha'))
+    if fecha_hasta and fecha_hasta >= sumar_meses(mes_hasta):
+        filtro = Q(fecha__gte=sumar_meses(mes_hasta), fecha__lte=fecha_hasta)
+        tramos.append((ResumenFichajeDiario, filtro, 'fecha'))
+
+    return tramos
+
+
+def agregar_resumenes(campos, fecha_desde=None, fecha_hasta=None, **filtros):
+    """
+    Agrega los resúmenes del rango de fechas agrupando por `campos`
+    (por ejemplo ('proyecto_id', 'usuario_id')).
+
+    Devuelve un diccionario {tupla de campos: totales} donde los totales son
+    registros, registros_con_horas, horas (timedelta) y ultimo_dia.
+    """
+    resultado = {}
+
+    for modelo, filtro_fechas, campo_ultimo_dia in _tramos(fecha_desde, fecha_hasta):
+        filas = (
+            modelo.objects.filter(filtro_fechas, **filtros)
+            .order_by()
+            .values(*campos)
+            .annotate(
+                total_registros=Sum('registros'),
+                total_con_horas=Sum('registros_con_horas'),
+                total_horas=Sum('horas'),
+                dia_max=Max(campo_ultimo_dia),
+            )
+        )
+        for fila in filas:
+            clave = tuple(fila[campo] for campo in campos)
+            totales = resultado.setdefault(clave, {
+                'registros': 0,
+                'registros_con_horas': 0,
+                'horas': timedelta(),
+                'ultimo_dia': None,
+            })
+            totales['registros'] += fila['total_registros'] or 0
+            totales['registros_con_horas'] += fila['total_con_horas'] or 0
+            totales['horas'] += fila['total_horas'] or timedelta()
+            if fila['dia_max'] and (totales['ultimo_dia'] is None or fila['dia_max'] > totales['ultimo_dia']):
+                totales['ultimo_dia'] = fila['dia_max']
+
+    return resultado
+
+
+def agregar_registros(campos, fecha_desde=None, fecha_hasta=None, **filtros):
+    """
+    Igual que agregar_resumenes() pero con un único GROUP BY sobre los propios
+    registros. Sale más barato cuando el filtro ya acota a pocas filas por día,
+    como los registros de un solo trabajador (uno al día por unique_together).
+    """
+    registros = RegistroFichaje.objects.filter(**filtros)
+    if fecha_desde:
+        registros = registros.filter(fecha__gte=fecha_desde)
+    if fecha_hasta:
+        registros = registros.filter(fecha__lte=fecha_hasta)
+
+    filas = registros.order_by().values(*campos).annotate(
+        total_registros=Count('id'),
+        total_con_horas=Count('horas_trabajadas'),
+        total_horas=Sum('horas_trabajadas'),
+        dia_max=Max('fecha'),
+    )
+    return {
+        tuple(fila[campo] for campo in campos): {
+            'registros': fila['total_registros'],
+            'registros_con_horas': fila['total_con_horas'],
+            'horas': fila['total_horas'] or timedelta(),
+            'ultimo_dia': fila['dia_max'],
+        }
+        for fila in filas
+    }
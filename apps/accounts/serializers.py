@@ -0,0 +1,24 @@
+from rest_framework import serializers
+
+from .models import RegistroFichaje
+
+
+ACCIONES_FICHAJE = [
+    ('fichar_entrada', 'Fichar entrada'),
+    ('fichar_salida', 'Fichar salida'),
+]
+
+
+# Un evento de fichaje enviado por un terminal
+class EventoFichajeSerializer(serializers.Serializer):
+    idempotency_key = serializers.CharField(max_length=64)
+    user = serializers.CharField(max_length=150)  # username
+    timestamp = serializers.DateTimeField()
+    action = serializers.ChoiceField(choices=ACCIONES_FICHAJE)
+    project = serializers.IntegerField(required=False, allow_null=True)
+    jornada = serializers.ChoiceField(choices=RegistroFichaje.JORNADA_CHOICES, required=False)
+
+
+# Lote de eventos de un terminal
+class LoteFichajesSerializer(serializers.Serializer):
+    events = EventoFichajeSerializer(many=True, allow_empty=False, max_length=500)
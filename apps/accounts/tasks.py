@@ -0,0 +1,28 @@
+from celery import shared_task
+
+from .reportes import ejecutar_reporte
+
+
+@shared_task(ignore_result=True)
+def generar_reporte(trabajo_id):
+    """Calcula en segundo plano un TrabajoReporte (ver reportes.solicitar_reporte)"""
+    ejecutar_reporte(trabajo_id)
+
+
+@shared_task(ignore_result=True)
+def sincronizar_directorio_ldap(completa=False):
+    """Sincroniza la copia local del directorio LDAP (ver directorio_ldap.py)"""
+    from .directorio_ldap import sincronizar_directorio
+
+    sincronizar_directorio(completa=completa)
+
+
+@shared_task(ignore_result=True)
+def generar_miniaturas_avatar(usuario_id):
+    """Genera las miniaturas del avatar de un usuario (ver avatares.py)"""
+    from .avatares import actualizar_miniaturas
+    from .models import CustomUser
+
+    usuario = CustomUser.objects.filter(pk=usuario_id).first()
+    if usuario:
+        actualizar_miniaturas(usuario)
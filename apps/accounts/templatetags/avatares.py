@@ -0,0 +1,38 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from ..avatares import al_dia, url_miniatura
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar(usuario, tamano=40, clase='avatar', estilo='', por_defecto='images/default-avatar.png'):
+    """
+    <img> del avatar de `usuario` a `tamano` píxeles usando la miniatura
+    adecuada: WebP con JPEG de respaldo y el doble de resolución para
+    pantallas de alta densidad. Sin avatar usa la imagen estática `por_defecto`.
+    """
+    tamano = int(tamano)
+    alt = getattr(usuario, 'username', '')
+    if not getattr(usuario, 'avatar', None):
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" width="{}" height="{}">',
+            static(por_defecto), alt, clase, estilo, tamano, tamano,
+        )
+    if not al_dia(usuario):
+        # Miniaturas aún sin generar: el original, escalado por el navegador
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" width="{}" height="{}" loading="lazy">',
+            usuario.avatar.url, alt, clase, estilo, tamano, tamano,
+        )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{} 1x, {} 2x">'
+        '<img src="{}" srcset="{} 1x, {} 2x" alt="{}" class="{}" style="{}" width="{}" height="{}" loading="lazy">'
+        '</picture>',
+        url_miniatura(usuario, tamano, 'webp'), url_miniatura(usuario, tamano * 2, 'webp'),
+        url_miniatura(usuario, tamano, 'jpeg'),
+        url_miniatura(usuario, tamano, 'jpeg'), url_miniatura(usuario, tamano * 2, 'jpeg'),
+        alt, clase, estilo, tamano, tamano,
+    )
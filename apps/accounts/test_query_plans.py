@@ -0,0 +1,134 @@
+"""
+Regresión de planes de consulta de los reportes de administración.
+
+Cada vista de reporte se ejecuta contra una base de datos sembrada y se pide
+el plan (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en Postgres) de todas las SELECT
+que lanza. El test falla si alguna recorre entera la tabla de fichajes o las de
+resúmenes, para que ningún cambio posterior vuelva a traer los escaneos completos.
+
+Los reportes sin filtro de fechas leen por diseño todos los resúmenes, así que
+los listados generales se comprueban con un rango de fechas.
+"""
+import re
+from datetime import date, time, timedelta
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import (
+    CustomUser,
+    Proyecto,
+    RegistroFichaje,
+    ResumenFichajeDiario,
+    ResumenFichajeMensual,
+)
+from .rollups import reconstruir_resumenes
+
+
+TABLAS_VIGILADAS = {
+    RegistroFichaje._meta.db_table,
+    ResumenFichajeDiario._meta.db_table,
+    ResumenFichajeMensual._meta.db_table,
+}
+
+RANGO = {'fecha_desde': '2025-01-10', 'fecha_hasta': '2025-03-20'}
+
+
+# Sin caché, para que cada petición lance sus consultas
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'local': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class ReportQueryPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(
+            'admin_reportes', 'admin_reportes@example.com', 'x', role='admin'
+        )
+        cls.trabajadores = [
+            CustomUser.objects.create_user(f'trabajador{i}', f'trabajador{i}@example.com', 'x')
+            for i in range(20)
+        ]
+        cls.proyectos = [Proyecto.objects.create(nombre=f'Proyecto {i}') for i in range(5)]
+
+        jornadas = [jornada for jornada, _ in RegistroFichaje.JORNADA_CHOICES]
+        registros = []
+        for i, trabajador in enumerate(cls.trabajadores):
+            for dia in range(120):
+                registros.append(RegistroFichaje(
+                    usuario=trabajador,
+                    fecha=date(2025, 1, 1) + timedelta(days=dia),
+                    hora_entrada=time(9, 0),
+                    hora_salida=time(17, 0) if dia % 7 else None,
+                    horas_trabajadas=timedelta(hours=8) if dia % 7 else None,
+                    completo=bool(dia % 7),
+                    proyecto=cls.proyectos[(i + dia) % len(cls.proyectos)],
+                    jornada=jornadas[dia % len(jornadas)],
+                ))
+        RegistroFichaje.objects.bulk_create(registros)
+        reconstruir_resumenes()
+
+    def setUp(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+    def _plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Con tablas pequeñas Postgres prefiere Seq Scan aunque haya índice
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [' '.join(str(columna) for columna in fila) for fila in cursor.fetchall()]
+
+    def _escaneos_completos(self, sql):
+        # Alias de subconsultas (U0, U1...) a su tabla real
+        alias = {nombre: tabla for tabla, nombre in re.findall(r'"(\w+)" (U\d+)', sql)}
+
+        escaneos = []
+        for linea in self._plan(sql):
+            if connection.vendor == 'postgresql':
+                encontrado = re.search(r'Seq Scan on (\w+)', linea)
+            else:
+                encontrado = re.search(r'\bSCAN (\w+)', linea)
+            if encontrado and alias.get(encontrado.group(1), encontrado.group(1)) in TABLAS_VIGILADAS:
+                escaneos.append(linea)
+        return escaneos
+
+    def assertSinEscaneoCompleto(self, url, params=None):
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+
+        for query in contexto.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            escaneos = self._escaneos_completos(sql)
+            self.assertFalse(escaneos, f"Escaneo completo en {url}:\n{sql}\n" + '\n'.join(escaneos))
+
+    def test_reports_dashboard(self):
+        self.assertSinEscaneoCompleto(reverse('admin_reports_dashboard'))
+
+    def test_projects_report(self):
+        self.assertSinEscaneoCompleto(reverse('admin_projects_report'), RANGO)
+
+    def test_project_detail(self):
+        url = reverse('admin_project_detail', args=[self.proyectos[0].id])
+        self.assertSinEscaneoCompleto(url)
+        self.assertSinEscaneoCompleto(url, RANGO)
+
+    def test_workers_report(self):
+        self.assertSinEscaneoCompleto(reverse('admin_workers_report'), RANGO)
+
+    def test_worker_detail(self):
+        url = reverse('admin_worker_detail', args=[self.trabajadores[0].id])
+        self.assertSinEscaneoCompleto(url)
+        self.assertSinEscaneoCompleto(url, RANGO)
+
+    def test_user_fichaje(self):
+        self.client.force_login(self.trabajadores[0], backend='django.contrib.auth.backends.ModelBackend')
+        self.assertSinEscaneoCompleto(reverse('user_fichaje'))
@@ -1,3 +1,1965 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time as reloj
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import ldap
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import caches
+from django.core.management import call_command
+from django.template import Context, Template
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    aprovisionamiento_ldap, avatares, bloqueos_sqlite, cache, circuito_ldap, consultas_lentas, datos_sinteticos,
+    fichajes, ldap_pool, listado_usuarios, materializadas, mediciones, perfilado, rendimiento, reportes, rollups,
+)
+from .paginacion import paginar_registros
+from .templatetags.time_filters import format_duration
+from .models import (
+    ConsultaLenta, CustomUser, EventoFichaje, LdapDirectoryEntry, PerfilPeticion, Proyecto, RegistroFichaje,
+    ResumenFichajeDiario, ResumenFichajeMensual, TrabajoReporte, VistaMaterializada,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _en_paralelo(funcion, hilos):
+    """Lanza `funcion` en varios hilos a la vez y devuelve sus resultados"""
+    barrera = threading.Barrier(hilos)
+    resultados = []
+    errores = []
+
+    def ejecutar():
+        try:
+            barrera.wait()
+            resultados.append(funcion())
+        except Exception as e:
+            errores.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=ejecutar) for _ in range(hilos)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados, errores
+
+
+class ResumenesTests(TestCase):
+    CAMPOS = ('usuario_id', 'proyecto_id', 'jornada')
+    # Rangos con meses parciales en uno o los dos extremos, un mes completo,
+    # un rango dentro de un mes y sin límites
+    RANGOS = [
+        (date(2025, 1, 25), date(2025, 3, 5)),
+        (date(2025, 1, 31), date(2025, 3, 1)),
+        (date(2025, 2, 1), date(2025, 2, 28)),
+        (date(2025, 2, 10), date(2025, 2, 20)),
+        (date(2025, 2, 15), date(2025, 4, 30)),
+        (None, date(2025, 2, 14)),
+        (date(2025, 3, 20), None),
+        (None, None),
+    ]
+
+    def _sembrar(self):
+        """Registros de dos usuarios entre el 20 de enero y el 10 de abril, con save()"""
+        self.usuarios = [
+            CustomUser.objects.create_user(f'resumen{i}', f'resumen{i}@example.com', 'x') for i in range(2)
+        ]
+        self.proyectos = [Proyecto.objects.create(nombre=f'Resumen {i}') for i in range(2)]
+        jornadas = [jornada for jornada, _ in RegistroFichaje.JORNADA_CHOICES]
+        dia = date(2025, 1, 20)
+        indice = 0
+        while dia <= date(2025, 4, 10):
+            for numero, usuario in enumerate(self.usuarios):
+                # Algunos sin proyecto y algunos sin salida (sin horas)
+                RegistroFichaje.objects.create(
+                    usuario=usuario,
+                    proyecto=None if indice % 5 == 0 else self.proyectos[(indice + numero) % 2],
+                    jornada=jornadas[indice % len(jornadas)],
+                    fecha=dia,
+                    hora_entrada=time(8, indice % 60),
+                    hora_salida=None if indice % 7 == 0 else time(14 + numero, 0),
+                )
+                indice += 1
+            dia += timedelta(days=3)
+
+    def assertResumenesCuadran(self):
+        for fecha_desde, fecha_hasta in self.RANGOS:
+            registros = RegistroFichaje.objects.all()
+            if fecha_desde:
+                registros = registros.filter(fecha__gte=fecha_desde)
+            if fecha_hasta:
+                registros = registros.filter(fecha__lte=fecha_hasta)
+            esperado = {
+                tuple(fila[campo] for campo in self.CAMPOS): {
+                    'registros': fila['total'],
+                    'registros_con_horas': fila['con_horas'],
+                    'horas': fila['horas'] or timedelta(),
+                    'ultimo_dia': fila['ultimo'],
+                }
+                for fila in registros.order_by().values(*self.CAMPOS).annotate(
+                    total=Count('id'), con_horas=Count('horas_trabajadas'),
+                    horas=Sum('horas_trabajadas'), ultimo=Max('fecha'),
+                )
+            }
+            with self.subTest(desde=fecha_desde, hasta=fecha_hasta):
+                self.assertEqual(rollups.agregar_resumenes(self.CAMPOS, fecha_desde, fecha_hasta), esperado)
+
+    def test_resumenes_cuadran_con_los_registros(self):
+        self._sembrar()
+        self.assertResumenesCuadran()
+
+        # Alta de un registro
+        RegistroFichaje.objects.create(
+            usuario=self.usuarios[0], proyecto=self.proyectos[1], fecha=date(2025, 2, 27),
+            hora_entrada=time(9, 0), hora_salida=time(17, 30),
+        )
+        self.assertResumenesCuadran()
+
+        # Cambio de fecha a otro mes y de proyecto en el mismo save()
+        registro = RegistroFichaje.objects.get(usuario=self.usuarios[1], fecha=date(2025, 2, 1))
+        registro.fecha = date(2025, 3, 4)
+        registro.proyecto = None if registro.proyecto_id else self.proyectos[0]
+        registro.hora_salida = time(18, 0)
+        registro.save()
+        self.assertResumenesCuadran()
+
+        # Borrado de un registro y de un queryset
+        RegistroFichaje.objects.filter(usuario=self.usuarios[0], fecha=date(2025, 1, 20)).get().delete()
+        RegistroFichaje.objects.filter(fecha__range=(date(2025, 3, 10), date(2025, 3, 20))).delete()
+        self.assertResumenesCuadran()
+
+    def test_borrar_proyecto_junta_sus_resumenes_con_los_sin_proyecto(self):
+        usuario = CustomUser.objects.create_user('resumenes', 'resumenes@example.com', 'x')
+        proyecto = Proyecto.objects.create(nombre='Proyecto borrado')
+        # Mismo mes y jornada, un día con el proyecto y otro sin proyecto
+        RegistroFichaje.objects.create(
+            usuario=usuario, proyecto=proyecto, fecha=date(2025, 3, 10),
+            hora_entrada=time(8, 0), hora_salida=time(12, 0),
+        )
+        RegistroFichaje.objects.create(
+            usuario=usuario, fecha=date(2025, 3, 11), hora_entrada=time(8, 0), hora_salida=time(15, 0),
+        )
+        self.assertEqual(ResumenFichajeMensual.objects.filter(usuario=usuario).count(), 2)
+
+        proyecto.delete()
+
+        diarios = ResumenFichajeDiario.objects.filter(usuario=usuario).order_by('fecha')
+        self.assertEqual(
+            [(diario.proyecto_id, diario.fecha, diario.horas) for diario in diarios],
+            [(None, date(2025, 3, 10), timedelta(hours=4)), (None, date(2025, 3, 11), timedelta(hours=7))],
+        )
+        mensual = ResumenFichajeMensual.objects.get(usuario=usuario)
+        self.assertIsNone(mensual.proyecto_id)
+        self.assertEqual(mensual.registros, 2)
+        self.assertEqual(mensual.horas, timedelta(hours=11))
+
+
+# Lotes de fichajes de los terminales de entrada (api/fichaje/batch/)
+class FichajeLoteTests(TestCase):
+    DIA = date(2025, 3, 10)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.terminal = CustomUser.objects.create_user('terminal', 'terminal@example.com', 'x', is_staff=True)
+        cls.proyecto = Proyecto.objects.create(nombre='Lotes')
+        cls.usuarios = CustomUser.objects.bulk_create([
+            CustomUser(username=f'lote{i}', email=f'lote{i}@example.com') for i in range(60)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.terminal)
+
+    def evento(self, clave, usuario, hora, accion='fichar_entrada', **extra):
+        momento = timezone.make_aware(datetime.combine(self.DIA, hora))
+        return {
+            'idempotency_key': clave, 'user': usuario.username, 'timestamp': momento.isoformat(),
+            'action': accion, **extra,
+        }
+
+    def enviar(self, eventos):
+        return self.client.post(reverse('api_fichaje_batch'), {'events': eventos}, content_type='application/json')
+
+    def resultados(self, eventos):
+        respuesta = self.enviar(eventos)
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return respuesta.json()['results']
+
+    def test_resultado_por_evento(self):
+        con_proyecto, sin_proyecto, sin_entrada = self.usuarios[:3]
+        resultados = self.resultados([
+            self.evento('a1', con_proyecto, time(8, 0), project=self.proyecto.id, jornada='remoto'),
+            self.evento('a2', sin_proyecto, time(8, 5)),
+            self.evento('a3', sin_entrada, time(8, 10), 'fichar_salida'),
+            self.evento('a4', con_proyecto, time(8, 15)),
+            self.evento('a5', con_proyecto, time(16, 30), 'fichar_salida'),
+            self.evento('a6', con_proyecto, time(17, 0), 'fichar_salida'),
+        ])
+
+        registro = RegistroFichaje.objects.get(usuario=con_proyecto)
+        self.assertEqual(
+            [(r['idempotency_key'], r['status'], r['detail']) for r in resultados],
+            [
+                ('a1', 'ok', 'Entrada fichada a las 08:00'),
+                ('a2', 'error', 'Debes seleccionar un proyecto antes de fichar la entrada'),
+                ('a3', 'error', 'Debes fichar la entrada primero'),
+                ('a4', 'error', 'Ya has fichado la entrada hoy'),
+                ('a5', 'ok', 'Salida fichada a las 16:30'),
+                ('a6', 'error', 'Ya has fichado la salida hoy'),
+            ],
+        )
+        self.assertEqual((resultados[0]['registro'], resultados[4]['registro']), (registro.pk, registro.pk))
+        self.assertEqual(
+            (registro.proyecto, registro.jornada, registro.hora_entrada, registro.hora_salida),
+            (self.proyecto, 'remoto', time(8, 0), time(16, 30)),
+        )
+        self.assertEqual(registro.horas_trabajadas, timedelta(hours=8, minutes=30))
+        self.assertFalse(RegistroFichaje.objects.filter(usuario__in=[sin_proyecto, sin_entrada]).exists())
+        self.assertEqual(EventoFichaje.objects.count(), 6)
+
+    def test_lote_reenviado_no_vuelve_a_escribir(self):
+        usuario = self.usuarios[0]
+        eventos = [
+            self.evento('r1', usuario, time(8, 0), project=self.proyecto.id),
+            self.evento('r2', usuario, time(15, 0), 'fichar_salida'),
+        ]
+        primeros = self.resultados(eventos)
+        registro = RegistroFichaje.objects.get(usuario=usuario)
+
+        repetidos = self.resultados(eventos)
+
+        self.assertEqual(repetidos, [{**resultado, 'duplicate': True} for resultado in primeros])
+        self.assertEqual(RegistroFichaje.objects.get(usuario=usuario).fecha_actualizacion, registro.fecha_actualizacion)
+        self.assertEqual(EventoFichaje.objects.count(), 2)
+        self.assertEqual(ResumenFichajeDiario.objects.get(usuario=usuario).horas, timedelta(hours=7))
+
+    def test_clave_repetida_en_el_mismo_lote(self):
+        usuario = self.usuarios[0]
+        resultados = self.resultados([
+            self.evento('x', usuario, time(16, 0), 'fichar_salida'),
+            self.evento('x', usuario, time(8, 0), project=self.proyecto.id),
+        ])
+
+        # Se aplica el primero en orden cronológico (la entrada); la salida es su duplicado
+        self.assertEqual(resultados[1]['status'], 'ok')
+        self.assertNotIn('duplicate', resultados[1])
+        self.assertEqual(resultados[0], {**resultados[1], 'duplicate': True})
+        registro = RegistroFichaje.objects.get(usuario=usuario)
+        self.assertEqual((registro.hora_entrada, registro.hora_salida), (time(8, 0), None))
+        self.assertEqual(EventoFichaje.objects.get().accion, 'fichar_entrada')
+
+    def test_maximo_500_eventos(self):
+        eventos = [
+            self.evento(f'm{i}', self.usuarios[i % len(self.usuarios)], time(8, 0), project=self.proyecto.id)
+            for i in range(501)
+        ]
+        respuesta = self.enviar(eventos)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(EventoFichaje.objects.exists())
+
+    def test_solo_staff(self):
+        self.client.force_login(self.usuarios[0])
+        respuesta = self.enviar([self.evento('s1', self.usuarios[0], time(8, 0), project=self.proyecto.id)])
+        self.assertEqual(respuesta.status_code, 403)
+        self.assertFalse(RegistroFichaje.objects.exists())
+
+    def test_resumenes_cuadran_tras_el_lote(self):
+        RegistroFichaje.objects.create(
+            usuario=self.usuarios[1], proyecto=self.proyecto, fecha=self.DIA, hora_entrada=time(9, 0),
+        )
+        eventos = []
+        for i, usuario in enumerate(self.usuarios[:10]):
+            if i != 1:
+                eventos.append(self.evento(f'e{i}', usuario, time(8, i), project=self.proyecto.id))
+            if i % 3:
+                eventos.append(self.evento(f's{i}', usuario, time(14 + i % 4, 0), 'fichar_salida'))
+        self.resultados(eventos)
+
+        def resumenes():
+            return (
+                sorted(ResumenFichajeDiario.objects.values_list(
+                    'usuario_id', 'proyecto_id', 'jornada', 'fecha', 'registros', 'registros_con_horas', 'horas',
+                )),
+                sorted(ResumenFichajeMensual.objects.values_list(
+                    'usuario_id', 'proyecto_id', 'jornada', 'mes', 'registros', 'registros_con_horas', 'horas',
+                    'primer_dia', 'ultimo_dia',
+                )),
+            )
+
+        incrementales = resumenes()
+        rollups.reconstruir_resumenes()
+        self.assertEqual(incrementales, resumenes())
+
+    def test_consultas_constantes(self):
+        def lote(usuarios, prefijo):
+            return [
+                self.evento(f'{prefijo}{i}', usuario, time(8, i % 60), project=self.proyecto.id)
+                for i, usuario in enumerate(usuarios)
+            ]
+
+        with CaptureQueriesContext(connection) as pocos:
+            self.resultados(lote(self.usuarios[:5], 'p'))
+        # El número de consultas no depende del tamaño del lote
+        with self.assertNumQueries(len(pocos)):
+            self.resultados(lote(self.usuarios[5:55], 'g'))
+        self.assertEqual(RegistroFichaje.objects.count(), 55)
+
+
+# Dobles clics y pestañas abiertas a la vez sobre el mismo registro
+class FichajeConcurrenteTests(TransactionTestCase):
+    HILOS = 8
+
+    def setUp(self):
+        self.usuario = CustomUser.objects.create_user('concurrente', 'concurrente@example.com', 'x')
+        self.proyecto = Proyecto.objects.create(nombre='Proyecto concurrente')
+        self.entrada = timezone.make_aware(datetime.combine(timezone.localdate(), time(8, 0)))
+
+    def test_actualizar_proyecto_concurrente_crea_un_solo_registro(self):
+        resultados, errores = _en_paralelo(
+            lambda: fichajes.actualizar_proyecto(self.usuario, self.proyecto, 'remoto', self.entrada.date()),
+            self.HILOS,
+        )
+
+        self.assertEqual(errores, [])
+        self.assertEqual(RegistroFichaje.objects.filter(usuario=self.usuario).count(), 1)
+        self.assertEqual(ResumenFichajeDiario.objects.get(usuario=self.usuario).registros, 1)
+
+    def test_entrada_concurrente_solo_ficha_una_vez(self):
+        fichajes.actualizar_proyecto(self.usuario, self.proyecto, fecha=self.entrada.date())
+
+        resultados, errores = _en_paralelo(
+            lambda: fichajes.fichar_entrada(self.usuario, self.entrada),
+            self.HILOS,
+        )
+
+        self.assertEqual(errores, [])
+        estados = [estado for estado, _ in resultados]
+        self.assertEqual(estados.count(fichajes.OK), 1)
+        self.assertEqual(estados.count(fichajes.YA_FICHADO), self.HILOS - 1)
+        self.assertEqual(RegistroFichaje.objects.get(usuario=self.usuario).hora_entrada, time(8, 0))
+
+    def test_salida_concurrente_no_pierde_ni_duplica_horas(self):
+        fichajes.actualizar_proyecto(self.usuario, self.proyecto, fecha=self.entrada.date())
+        fichajes.fichar_entrada(self.usuario, self.entrada)
+        salidas = [self.entrada + timedelta(hours=8, minutes=i) for i in range(self.HILOS)]
+
+        resultados, errores = _en_paralelo(
+            lambda: fichajes.fichar_salida(self.usuario, salidas.pop()),
+            self.HILOS,
+        )
+
+        self.assertEqual(errores, [])
+        self.assertEqual([estado for estado, _ in resultados].count(fichajes.OK), 1)
+
+        registro = RegistroFichaje.objects.get(usuario=self.usuario)
+        self.assertTrue(registro.completo)
+        self.assertEqual(
+            registro.horas_trabajadas,
+            datetime.combine(registro.fecha, registro.hora_salida) - datetime.combine(registro.fecha, registro.hora_entrada),
+        )
+        resumen = ResumenFichajeDiario.objects.get(usuario=self.usuario)
+        self.assertEqual((resumen.registros_con_horas, resumen.horas), (1, registro.horas_trabajadas))
+
+    def test_salida_nocturna_no_pisa_otra_salida(self):
+        # Salida con hora anterior a la entrada (cuenta como del día siguiente),
+        # pero otra petición ya fichó la salida después de que esta leyera el registro
+        entrada = self.entrada.replace(hour=23)
+        fichajes.actualizar_proyecto(self.usuario, self.proyecto, fecha=entrada.date())
+        fichajes.fichar_entrada(self.usuario, entrada)
+        leido = RegistroFichaje.objects.get(usuario=self.usuario)
+        self.assertEqual(fichajes.fichar_salida(self.usuario, entrada.replace(hour=6)), (fichajes.OK, time(6, 0)))
+        actual = RegistroFichaje.objects.get(usuario=self.usuario)
+
+        with mock.patch.object(fichajes, '_registro_del_dia', side_effect=[leido, actual]):
+            resultado = fichajes.fichar_salida(self.usuario, entrada.replace(hour=7))
+
+        self.assertEqual(resultado, (fichajes.YA_FICHADO, time(6, 0)))
+        registro = RegistroFichaje.objects.get(usuario=self.usuario)
+        self.assertEqual((registro.hora_salida, registro.horas_trabajadas), (time(6, 0), timedelta(hours=7)))
+        resumen = ResumenFichajeDiario.objects.get(usuario=self.usuario)
+        self.assertEqual((resumen.registros_con_horas, resumen.horas), (1, timedelta(hours=7)))
+
+
+
+# Acciones de la pantalla de fichaje en su versión JSON (fichaje/accion/)
+class FichajeAccionTests(TestCase):
+    MANANA = timezone.make_aware(datetime(2025, 3, 10, 8, 0))
+    TARDE = timezone.make_aware(datetime(2025, 3, 10, 16, 30))
+
+    def setUp(self):
+        self.usuario = CustomUser.objects.create_user('en_sitio', 'en_sitio@example.com', 'x')
+        self.client.force_login(self.usuario)
+        self.proyecto = Proyecto.objects.create(nombre='En sitio')
+
+    def accion(self, momento, **datos):
+        with mock.patch('django.utils.timezone.now', return_value=momento):
+            respuesta = self.client.post(reverse('user_fichaje_accion'), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def estado(self, **cambios):
+        return {
+            'hora_entrada': None, 'hora_salida': None, 'horas_trabajadas': None,
+            'puede_fichar_entrada': False, 'puede_fichar_salida': False, 'necesita_proyecto': False,
+            **cambios,
+        }
+
+    def test_jornada_completa(self):
+        datos = self.accion(self.MANANA, action='actualizar_proyecto', proyecto=self.proyecto.id, jornada='remoto')
+        self.assertEqual(
+            (datos['ok'], datos['nivel'], datos['mensaje'], datos['fecha']),
+            (True, 'success', 'Información actualizada correctamente', '2025-03-10'),
+        )
+        self.assertEqual(datos['registro'], self.estado(puede_fichar_entrada=True))
+
+        datos = self.accion(self.MANANA, action='fichar_entrada')
+        self.assertEqual((datos['nivel'], datos['mensaje']), ('success', 'Entrada fichada a las 08:00'))
+        self.assertEqual(datos['registro'], self.estado(hora_entrada='08:00', puede_fichar_salida=True))
+
+        datos = self.accion(self.TARDE, action='fichar_salida')
+        self.assertEqual((datos['nivel'], datos['mensaje']), ('success', 'Salida fichada a las 16:30'))
+        self.assertEqual(datos['registro'], self.estado(
+            hora_entrada='08:00', hora_salida='16:30',
+            horas_trabajadas=format_duration(timedelta(hours=8, minutes=30)),
+        ))
+
+        datos = self.accion(self.TARDE, action='fichar_entrada')
+        self.assertEqual(
+            (datos['ok'], datos['nivel'], datos['mensaje']), (False, 'warning', 'Ya has fichado la entrada hoy'),
+        )
+        self.assertEqual(datos['registro']['hora_salida'], '16:30')
+
+        registro = RegistroFichaje.objects.get(usuario=self.usuario)
+        self.assertEqual((registro.fecha, registro.jornada), (date(2025, 3, 10), 'remoto'))
+
+    def test_errores(self):
+        datos = self.accion(self.MANANA, action='fichar_entrada')
+        self.assertEqual(
+            (datos['ok'], datos['nivel'], datos['mensaje']),
+            (False, 'error', 'Debes seleccionar un proyecto antes de fichar la entrada'),
+        )
+        self.assertEqual(datos['registro'], self.estado(necesita_proyecto=True))
+
+        self.accion(self.MANANA, action='actualizar_proyecto', proyecto=self.proyecto.id)
+        datos = self.accion(self.TARDE, action='fichar_salida')
+        self.assertEqual((datos['nivel'], datos['mensaje']), ('error', 'Debes fichar la entrada primero'))
+        self.assertEqual(datos['registro'], self.estado(puede_fichar_entrada=True))
+
+        datos = self.accion(self.MANANA, action='actualizar_proyecto', proyecto='999999')
+        self.assertEqual((datos['nivel'], datos['mensaje']), ('error', 'Proyecto no válido'))
+
+        datos = self.accion(self.MANANA, action='otra')
+        self.assertEqual((datos['nivel'], datos['mensaje']), ('error', 'Acción no válida'))
+
+    def test_consultas_al_fichar(self):
+        self.accion(self.MANANA, action='actualizar_proyecto', proyecto=self.proyecto.id)
+        # Sesión y usuario, el UPDATE condicional y nada más: el estado ya se conoce
+        with self.assertNumQueries(3):
+            self.accion(self.MANANA, action='fichar_entrada')
+        # Además el recálculo de los resúmenes del día (con sus savepoints) y leer el estado
+        with self.assertNumQueries(15):
+            self.accion(self.TARDE, action='fichar_salida')
+
+
+# Hora punta de entradas: muchos usuarios distintos fichando a la vez
+class SqliteConcurrenteTests(TransactionTestCase):
+    HILOS = 16
+    POR_HILO = 4
+
+    def test_conexion_en_modo_wal(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Solo SQLite')
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+
+    @override_settings(SQLITE_LOCK_BACKOFF=0)
+    def test_reintenta_solo_si_la_base_esta_bloqueada(self):
+        llamadas = []
+
+        @bloqueos_sqlite.reintentar_si_bloqueada
+        def escribir(fallos, error='database is locked'):
+            llamadas.append(1)
+            if len(llamadas) <= fallos:
+                raise OperationalError(error)
+            return 'ok'
+
+        self.assertEqual(escribir(2), 'ok')
+        self.assertEqual(len(llamadas), 3)
+
+        for fallos, error in [(10, 'database is locked'), (1, 'no such table: x')]:
+            llamadas.clear()
+            with self.assertRaises(OperationalError):
+                escribir(fallos, error)
+        self.assertEqual(len(llamadas), 1)
+
+        # Dentro de una transacción se repite la transacción entera, no la sentencia
+        llamadas.clear()
+        with self.assertRaises(OperationalError), transaction.atomic():
+            escribir(1)
+        self.assertEqual(len(llamadas), 1)
+
+    def test_entradas_en_paralelo(self):
+        # Sin "database is locked". Las latencias dependen de la máquina: solo se
+        # registran en el log, sin comprobarlas (con detalle, benchmark_clock_in)
+        proyecto = Proyecto.objects.create(nombre='Hora punta')
+        usuarios = CustomUser.objects.bulk_create([
+            CustomUser(username=f'punta{i}', email=f'punta{i}@example.com')
+            for i in range(self.HILOS * self.POR_HILO)
+        ])
+        momento = timezone.make_aware(datetime.combine(timezone.localdate(), time(8, 58)))
+        tiempos = []
+
+        def fichar():
+            for _ in range(self.POR_HILO):
+                usuario = usuarios.pop()
+                empezar = reloj.perf_counter()
+                fichajes.actualizar_proyecto(usuario, proyecto, fecha=momento.date())
+                resultado, _ = fichajes.fichar_entrada(usuario, momento)
+                tiempos.append(reloj.perf_counter() - empezar)
+                self.assertEqual(resultado, fichajes.OK)
+
+        _, errores = _en_paralelo(fichar, self.HILOS)
+
+        self.assertEqual(errores, [])
+        self.assertEqual(RegistroFichaje.objects.filter(hora_entrada=time(8, 58)).count(), len(tiempos))
+        tiempos.sort()
+        logger.info(
+            "%d entradas con %d hilos: p50 %.0f ms, p99 %.0f ms", len(tiempos), self.HILOS,
+            tiempos[len(tiempos) // 2] * 1000, tiempos[int(len(tiempos) * 0.99) - 1] * 1000,
+        )
+
+
+# Detalle de trabajador: totales de agregar_registros() frente a la consulta anterior
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'local': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class DetalleTrabajadorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_detalle', 'admin_detalle@example.com', 'x', role='admin')
+        cls.trabajador = CustomUser.objects.create_user('detalle', 'detalle@example.com', 'x')
+        otro = CustomUser.objects.create_user('detalle_otro', 'detalle_otro@example.com', 'x')
+        proyectos = [Proyecto.objects.create(nombre=f'Detalle {i}') for i in range(3)]
+        jornadas = [jornada for jornada, _ in RegistroFichaje.JORNADA_CHOICES]
+        registros = []
+        for dia in range(40):
+            # Proyecto NULL cada 6 días, sin salida (horas NULL) cada 4; el tercer
+            # proyecto solo tiene registros sin horas
+            proyecto = None if dia % 6 == 0 else proyectos[dia % 3]
+            sin_horas = dia % 4 == 0 or proyecto == proyectos[2]
+            for usuario in (cls.trabajador, otro):
+                registros.append(RegistroFichaje(
+                    usuario=usuario, proyecto=proyecto, jornada=jornadas[dia % 5 % 3],
+                    fecha=date(2025, 1, 1) + timedelta(days=dia),
+                    hora_entrada=time(8, 0), hora_salida=None if sin_horas else time(12 + dia % 5, 15),
+                ))
+        for registro in registros:
+            registro.calcular_horas()
+        RegistroFichaje.objects.bulk_create(registros)
+        rollups.reconstruir_resumenes()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def esperado(self, fecha_desde=None, fecha_hasta=None):
+        """Lo que calculaba la vista con anotaciones Sum/Count sobre RegistroFichaje"""
+        filtros = Q(usuario=self.trabajador)
+        filtro_base = Q(registrofichaje__usuario=self.trabajador)
+        if fecha_desde:
+            filtros &= Q(fecha__gte=fecha_desde)
+            filtro_base &= Q(registrofichaje__fecha__gte=fecha_desde)
+        if fecha_hasta:
+            filtros &= Q(fecha__lte=fecha_hasta)
+            filtro_base &= Q(registrofichaje__fecha__lte=fecha_hasta)
+        con_horas = Q(registrofichaje__horas_trabajadas__isnull=False)
+
+        def horas(jornada=None):
+            filtro = filtro_base & con_horas
+            if jornada:
+                filtro &= Q(registrofichaje__jornada=jornada)
+            return Sum('registrofichaje__horas_trabajadas', filter=filtro)
+
+        proyectos = Proyecto.objects.filter(registrofichaje__usuario=self.trabajador).annotate(
+            total_horas=horas(),
+            total_dias=Count('registrofichaje', filter=filtro_base),
+            horas_presencial=horas('presencial'),
+            horas_remoto=horas('remoto'),
+            horas_desplazamiento=horas('desplazamiento'),
+        ).distinct()
+        stats = RegistroFichaje.objects.filter(filtros & Q(horas_trabajadas__isnull=False)).aggregate(
+            total_horas=Sum('horas_trabajadas'),
+            total_dias=Count('id'),
+            total_proyectos=Count('proyecto', distinct=True),
+        )
+        return self.por_proyecto(proyectos), stats
+
+    def por_proyecto(self, proyectos):
+        return {
+            proyecto.id: (
+                proyecto.total_horas, proyecto.total_dias,
+                proyecto.horas_presencial, proyecto.horas_remoto, proyecto.horas_desplazamiento,
+            )
+            for proyecto in proyectos
+        }
+
+    def test_mismos_totales_que_las_anotaciones(self):
+        rangos = [(None, None), (date(2025, 1, 5), date(2025, 1, 27)), (date(2025, 1, 20), None)]
+        for fecha_desde, fecha_hasta in rangos:
+            parametros = {}
+            if fecha_desde:
+                parametros['fecha_desde'] = fecha_desde.isoformat()
+            if fecha_hasta:
+                parametros['fecha_hasta'] = fecha_hasta.isoformat()
+            with self.subTest(desde=fecha_desde, hasta=fecha_hasta):
+                respuesta = self.client.get(reverse('admin_worker_detail', args=[self.trabajador.id]), parametros)
+                proyectos, stats = self.esperado(fecha_desde, fecha_hasta)
+                self.assertEqual(self.por_proyecto(respuesta.context['proyectos_stats']), proyectos)
+                self.assertEqual(respuesta.context['stats'], stats)
+                horas = [proyecto.total_horas for proyecto in respuesta.context['proyectos_stats']]
+                self.assertEqual(horas, sorted(horas, key=lambda total: (total is not None, total), reverse=True))
+
+
+CACHES_PRUEBA = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas-l2'},
+    'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas-l1'},
+}
+
+
+@override_settings(CACHES=CACHES_PRUEBA, CACHE_STATS_FLUSH_INTERVAL=0)
+class CacheDosNivelesTests(TestCase):
+
+    def setUp(self):
+        # LocMemCache conserva los datos entre tests del mismo proceso
+        cache._l1().clear()
+        cache._l2().clear()
+        self.proyecto = Proyecto.objects.create(nombre='Cacheado')
+        self.usuario = CustomUser.objects.create_user('cacheado', 'cacheado@example.com', 'x')
+
+    def _contadores(self, uso):
+        return next(fila for fila in cache.estadisticas() if fila['uso'] == uso.nombre)
+
+    def test_proyectos_activos_se_sirven_de_cache_hasta_que_cambian(self):
+        self.assertEqual(cache.proyectos_activos(), [self.proyecto])
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.proyectos_activos(), [self.proyecto])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            otro = Proyecto.objects.create(nombre='Nuevo')
+        with self.assertNumQueries(1):
+            self.assertEqual(set(cache.proyectos_activos()), {self.proyecto, otro})
+
+        contadores = self._contadores(cache.PROYECTOS_ACTIVOS)
+        self.assertEqual((contadores['l1'], contadores['l2'], contadores['miss']), (1, 0, 2))
+
+    def test_l2_sirve_a_procesos_con_l1_vacia(self):
+        cache.proyectos_activos()
+        cache._l1().clear()
+        with self.assertNumQueries(0):
+            cache.proyectos_activos()
+        self.assertEqual(self._contadores(cache.PROYECTOS_ACTIVOS)['l2'], 1)
+
+    def test_resultados_de_reportes_se_invalidan_al_fichar(self):
+        hoy = timezone.localdate()
+        rango = (('usuario_id',), hoy, hoy)
+
+        self.assertEqual(cache.agregar_resumenes_en_cache(*rango), {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroFichaje.objects.create(
+                usuario=self.usuario, proyecto=self.proyecto, fecha=hoy,
+                hora_entrada=time(9, 0), hora_salida=time(13, 0),
+            )
+        totales = cache.agregar_resumenes_en_cache(*rango)
+        self.assertEqual(totales[(self.usuario.id,)]['horas'], timedelta(hours=4))
+
+        # Las actualizaciones en una sola sentencia también invalidan
+        with self.captureOnCommitCallbacks(execute=True):
+            fichajes.actualizar_proyecto(self.usuario, jornada='remoto', fecha=hoy)
+        totales = cache.agregar_resumenes_en_cache(('jornada',), hoy, hoy)
+        self.assertEqual(list(totales), [('remoto',)])
+
+    def test_sin_confirmar_no_se_invalida(self):
+        cache.proyectos_activos()
+        Proyecto.objects.create(nombre='Sin confirmar')
+        self.assertEqual(cache.proyectos_activos(), [self.proyecto])
+
+
+# Sin caché: los totales de los reportes se leen siempre de los resúmenes
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'local': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class ExportacionCsvTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_csv', 'admin_csv@example.com', 'x', role='admin')
+        cls.usuario = CustomUser.objects.create_user('csv', 'csv@example.com', 'x', first_name='=HYPERLINK()')
+        cls.proyecto = Proyecto.objects.create(nombre='Exportado')
+        RegistroFichaje.objects.bulk_create([
+            RegistroFichaje(
+                usuario=cls.usuario, proyecto=cls.proyecto, fecha=date(2025, 1, 1) + timedelta(days=dia),
+                hora_entrada=time(9, 0), hora_salida=time(17, 30),
+                horas_trabajadas=timedelta(hours=8, minutes=30), completo=True,
+            )
+            for dia in range(60)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+    def _lineas(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+
+    def test_registros_respetan_el_rango_de_fechas(self):
+        lineas = self._lineas(reverse('admin_export_registros'), {
+            'fecha_desde': '2025-01-10', 'fecha_hasta': '2025-01-19', 'proyecto': self.proyecto.id,
+        })
+        self.assertEqual(len(lineas), 11)
+        self.assertEqual(lineas[1], "10/01/2025;csv;'=HYPERLINK();;Exportado;presencial;09:00;17:30;8,50;sí")
+
+    def test_trabajadores_suman_las_horas_del_rango(self):
+        from .rollups import reconstruir_resumenes
+
+        reconstruir_resumenes()
+        lineas = self._lineas(reverse('admin_export_workers'), {'fecha_desde': '2025-02-01'})
+        fila = next(linea for linea in lineas if linea.startswith('csv;'))
+        self.assertIn(';1;29;246,50;', fila)
+
+
+class PaginacionRegistrosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.proyecto = Proyecto.objects.create(nombre='Paginado')
+        usuarios = [
+            CustomUser.objects.create_user(f'paginado{i}', f'paginado{i}@example.com', 'x')
+            for i in range(4)
+        ]
+        # Varios registros por día, con horas repetidas y sin hora de entrada
+        horas = [time(9, 0), time(9, 0), None, time(8, 0)]
+        RegistroFichaje.objects.bulk_create([
+            RegistroFichaje(
+                usuario=usuario, proyecto=cls.proyecto, fecha=date(2025, 3, 1) + timedelta(days=dia),
+                hora_entrada=horas[(i + dia) % len(horas)],
+            )
+            for dia in range(10) for i, usuario in enumerate(usuarios)
+        ])
+        cls.usuarios = usuarios
+
+    def _pagina(self, **parametros):
+        query = QueryDict(mutable=True)
+        query.update(parametros)
+        return paginar_registros(RegistroFichaje.objects.filter(proyecto=self.proyecto), query, 7)
+
+    def _clave(self, registro):
+        return (registro.fecha, registro.hora_entrada is not None, registro.hora_entrada or time(0), registro.id)
+
+    def test_recorre_todos_los_registros_en_orden_y_vuelve_atras(self):
+        paginas = [self._pagina()]
+        while paginas[-1].hay_siguiente:
+            paginas.append(self._pagina(despues=paginas[-1].cursor_siguiente))
+
+        vistos = [registro for pagina in paginas for registro in pagina]
+        self.assertEqual(len(vistos), 40)
+        self.assertEqual(vistos, sorted(vistos, key=self._clave, reverse=True))
+        self.assertFalse(paginas[0].hay_anterior)
+
+        # Hacia atrás se obtienen exactamente las mismas páginas
+        for anterior, pagina in zip(paginas, paginas[1:]):
+            self.assertEqual(list(self._pagina(antes=pagina.cursor_anterior)), list(anterior))
+
+    def test_fichajes_nuevos_no_desplazan_la_pagina_siguiente(self):
+        primera = self._pagina()
+        esperada = list(self._pagina(despues=primera.cursor_siguiente))
+
+        nuevo = CustomUser.objects.create_user('tardio', 'tardio@example.com', 'x')
+        RegistroFichaje.objects.create(
+            usuario=nuevo, proyecto=self.proyecto, fecha=date(2025, 3, 10), hora_entrada=time(10, 0)
+        )
+        self.assertEqual(list(self._pagina(despues=primera.cursor_siguiente)), esperada)
+
+    def test_cursor_invalido_devuelve_la_primera_pagina(self):
+        self.assertEqual(list(self._pagina(despues='no-es-un-cursor')), list(self._pagina()))
+
+    def test_cada_pagina_cuesta_una_consulta(self):
+        pagina = self._pagina()
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                pagina = self._pagina(despues=pagina.cursor_siguiente)
+
+
+# Las tareas se ejecutan en el acto: sin CELERY_BROKER_URL Celery funciona en modo eager
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'local': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class ReporteEnSegundoPlanoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_async', 'admin_async@example.com', 'x', role='admin')
+        cls.proyecto = Proyecto.objects.create(nombre='Anual')
+        RegistroFichaje.objects.create(
+            usuario=cls.admin, proyecto=cls.proyecto, fecha=date(2025, 6, 2),
+            hora_entrada=time(9, 0), hora_salida=time(15, 0),
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_rango_grande_se_calcula_en_un_trabajo(self):
+        url = reverse('admin_projects_report')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url, {'fecha_desde': '2025-01-01', 'fecha_hasta': '2025-12-31'})
+
+        trabajo = TrabajoReporte.objects.get()
+        self.assertRedirects(response, reverse('admin_report_job', args=[trabajo.id]))
+        self.assertEqual(trabajo.estado, 'completado')
+        self.assertIsNotNone(trabajo.expira)
+
+        response = self.client.get(response.url)
+        proyecto = response.context['proyectos'][0]
+        self.assertEqual((proyecto.total_registros, proyecto.total_horas), (1, timedelta(hours=6)))
+
+    def test_peticiones_identicas_comparten_trabajo(self):
+        # Sin ejecutar los callbacks el trabajo se queda pendiente, como con un worker ocupado
+        primero = reportes.solicitar_reporte('trabajadores', date(2025, 1, 1), date(2025, 12, 31))
+        segundo = reportes.solicitar_reporte('trabajadores', date(2025, 1, 1), date(2025, 12, 31))
+        otro = reportes.solicitar_reporte('trabajadores', date(2024, 1, 1), date(2024, 12, 31))
+
+        self.assertEqual(primero.id, segundo.id)
+        self.assertNotEqual(primero.id, otro.id)
+
+        estado = self.client.get(reverse('admin_report_job', args=[primero.id]), {'formato': 'json'}).json()
+        self.assertEqual(estado['estado'], 'pendiente')
+
+        reportes.ejecutar_reporte(primero.id)
+        response = self.client.get(reverse('admin_report_job', args=[primero.id]))
+        trabajador = next(t for t in response.context['trabajadores'] if t.id == self.admin.id)
+        self.assertEqual(trabajador.total_dias, 1)
+        self.assertEqual(trabajador.ultimo_fichaje, date(2025, 6, 2))
+
+    def test_rango_pequeno_se_calcula_en_la_peticion(self):
+        response = self.client.get(
+            reverse('admin_workers_report'), {'fecha_desde': '2025-06-01', 'fecha_hasta': '2025-06-30'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TrabajoReporte.objects.exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class VistaMaterializadaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = CustomUser.objects.create_user('vista', 'vista@example.com', 'x')
+        cls.proyecto = Proyecto.objects.create(nombre='Vista')
+        RegistroFichaje.objects.create(
+            usuario=cls.usuario, proyecto=cls.proyecto, fecha=date(2025, 3, 10),
+            hora_entrada=time(9, 0), hora_salida=time(17, 0),
+        )
+
+    def test_sqlite_usa_los_resumenes(self):
+        with self.settings(REPORTS_MATERIALIZED_VIEWS=True):
+            self.assertFalse(materializadas.activas())
+            self.assertFalse(materializadas.cubre(date(2025, 1, 1), date(2025, 3, 31)))
+            totales = materializadas.agregar_totales(('proyecto_id',), date(2025, 1, 1), date(2025, 3, 31))
+
+            salida = StringIO()
+            call_command('refresh_report_views', stdout=salida)
+
+        self.assertEqual(totales[(self.proyecto.id,)]['horas'], timedelta(hours=8))
+        self.assertIn('disabled', salida.getvalue())
+        self.assertFalse(VistaMaterializada.objects.exists())
+
+    @mock.patch.object(materializadas, 'activas', return_value=True)
+    def test_rangos_cubiertos(self, activas):
+        self.assertFalse(materializadas.cubre(None, date(2025, 3, 31)))  # Aún sin refrescar
+
+        VistaMaterializada.objects.create(nombre=materializadas.NOMBRE, cubre_hasta=date(2025, 6, 15))
+        self.assertTrue(materializadas.cubre(None, date(2025, 3, 31)))
+        self.assertTrue(materializadas.cubre(date(2025, 1, 1), date(2025, 6, 14)))
+        self.assertFalse(materializadas.cubre(date(2025, 1, 2), date(2025, 3, 31)))  # Mes a medias
+        self.assertFalse(materializadas.cubre(date(2025, 1, 1), date(2025, 3, 30)))
+        self.assertFalse(materializadas.cubre(date(2025, 1, 1), date(2025, 6, 30)))  # Después del refresco
+        self.assertFalse(materializadas.cubre(date(2025, 1, 1), None))
+
+    @mock.patch.object(materializadas, 'activas', return_value=True)
+    def test_cambios_tras_el_refresco_dejan_de_estar_cubiertos(self, activas):
+        VistaMaterializada.objects.create(
+            nombre=materializadas.NOMBRE, cubre_hasta=date(2025, 6, 15), cambios_desde=date(2025, 5, 20)
+        )
+        # Los fichajes de después de cubre_hasta no afectan a la vista
+        RegistroFichaje.objects.create(usuario=self.usuario, fecha=date(2025, 6, 20), hora_entrada=time(9, 0))
+        self.assertTrue(materializadas.cubre(None, date(2025, 4, 30)))
+
+        RegistroFichaje.objects.create(usuario=self.usuario, fecha=date(2025, 2, 3), hora_entrada=time(9, 0))
+        self.assertEqual(VistaMaterializada.objects.get().cambios_desde, date(2025, 2, 3))
+        self.assertTrue(materializadas.cubre(None, date(2025, 1, 31)))
+        self.assertFalse(materializadas.cubre(None, date(2025, 4, 30)))
+
+
+class _ConexionFalsa:
+    def __init__(self):
+        self.caida = False
+        self.cerrada = False
+
+    def whoami_s(self):
+        if self.caida:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return 'dn:cn=admin,dc=example,dc=com'
+
+    def search_s(self, *args):
+        self.whoami_s()
+        return [('uid=ana,ou=users,dc=example,dc=com', {})]
+
+    def unbind_s(self):
+        self.cerrada = True
+
+
+class _PoolFalso(ldap_pool.PoolLDAP):
+    def __init__(self, **kwargs):
+        super().__init__('ldap://ldap', 'cn=admin,dc=example,dc=com', 'x', **kwargs)
+        self.creadas = []
+
+    def _conectar(self):
+        self.creadas.append(_ConexionFalsa())
+        return self.creadas[-1]
+
+
+@skipUnless(hasattr(ldap, 'SERVER_DOWN'), 'python-ldap no está instalado')
+class PoolLdapTests(TestCase):
+
+    def buscar(self, conexion):
+        return conexion.search_s('ou=users,dc=example,dc=com')
+
+    def test_reutiliza_la_conexion(self):
+        pool = _PoolFalso()
+        pool.ejecutar(self.buscar)
+        pool.ejecutar(self.buscar)
+        self.assertEqual(len(pool.creadas), 1)
+        self.assertEqual(pool.estado(), {'libres': 1, 'en_uso': 0, 'max': 4})
+
+    def test_reconecta_si_el_servidor_cerro_la_conexion(self):
+        pool = _PoolFalso(intervalo_comprobacion=3600)
+        pool.ejecutar(self.buscar)
+        pool.creadas[0].caida = True
+
+        self.assertEqual(len(pool.ejecutar(self.buscar, idempotente=True)), 1)
+        self.assertEqual(len(pool.creadas), 2)
+        self.assertTrue(pool.creadas[0].cerrada)
+
+    def test_no_repite_operaciones_no_idempotentes(self):
+        pool = _PoolFalso(intervalo_comprobacion=3600)
+        pool.ejecutar(self.buscar)
+        pool.creadas[0].caida = True
+        llamadas = []
+
+        def crear(conexion):
+            llamadas.append(conexion)
+            return conexion.search_s('ou=users,dc=example,dc=com')
+
+        with self.assertRaises(ldap.SERVER_DOWN):
+            pool.ejecutar(crear)
+        self.assertEqual(llamadas, [pool.creadas[0]])
+        self.assertTrue(pool.creadas[0].cerrada)
+        self.assertEqual(pool.estado()['en_uso'], 0)
+        # La siguiente operación ya usa una conexión nueva
+        pool.ejecutar(crear)
+        self.assertEqual(len(pool.creadas), 2)
+
+    def test_comprueba_las_conexiones_paradas(self):
+        pool = _PoolFalso(intervalo_comprobacion=0)
+        pool.ejecutar(self.buscar)
+        pool.creadas[0].caida = True
+
+        pool.ejecutar(self.buscar)
+        self.assertEqual(len(pool.creadas), 2)
+
+    def test_cierra_las_conexiones_inactivas(self):
+        pool = _PoolFalso(tiempo_inactivo=0)
+        pool.ejecutar(self.buscar)
+        pool.ejecutar(self.buscar)
+        self.assertEqual(len(pool.creadas), 2)
+        self.assertTrue(pool.creadas[0].cerrada)
+
+    def test_tamano_maximo(self):
+        pool = _PoolFalso(max_conexiones=2, tiempo_espera=0.05)
+        tomadas = [pool._tomar()[0], pool._tomar()[0]]
+        with self.assertRaises(ldap_pool.PoolAgotado):
+            pool._tomar()
+
+        pool._devolver(tomadas[0])
+        self.assertIs(pool._tomar()[0], tomadas[0])
+
+    def test_hilos_comparten_el_pool(self):
+        pool = _PoolFalso(max_conexiones=2)
+        resultados, errores = _en_paralelo(lambda: pool.ejecutar(self.buscar), 8)
+        self.assertEqual((len(resultados), errores), (8, []))
+        self.assertLessEqual(len(pool.creadas), 2)
+
+
+class _DirectorioFalso:
+    """Conexión con paginación RFC 2696: los cookies solo valen en la conexión que los dio"""
+
+    def __init__(self, total):
+        from ldap.controls import SimplePagedResultsControl
+
+        self.control = SimplePagedResultsControl
+        self.entradas = [
+            (f'uid=usuario{i:03},ou=users,dc=example,dc=com', {
+                'uid': [f'usuario{i:03}'.encode()],
+                'cn': [b'Nombre'],
+                'modifyTimestamp': [b'20250101120000Z'],
+                'entryCSN': [b'20250101120000.000000Z#000000#000#000000'],
+            })
+            for i in range(total)
+        ]
+        self.cookies = {}
+        self.busquedas = []
+
+    def search_ext(self, base, scope, filtro, atributos, serverctrls):
+        self.busquedas.append((filtro, atributos))
+        control = serverctrls[0]
+        if control.cookie and control.cookie not in self.cookies:
+            raise ldap.UNWILLING_TO_PERFORM({'desc': 'paged results cookie is invalid'})
+        self._pendiente = (self.cookies.get(control.cookie, 0), control.size, atributos)
+        return len(self.busquedas)
+
+    def result3(self, msgid):
+        inicio, tamano, atributos = self._pendiente
+        fin = inicio + tamano
+        cookie = b''
+        if fin < len(self.entradas):
+            cookie = f'{id(self)}:{fin}'.encode()
+            self.cookies[cookie] = fin
+        entradas = self.entradas[inicio:fin]
+        if atributos == ['1.1']:
+            entradas = [(dn, {}) for dn, _ in entradas]
+        return 101, entradas, msgid, [self.control(True, size=0, cookie=cookie)]
+
+
+@skipUnless(hasattr(ldap, 'SERVER_DOWN'), 'python-ldap no está instalado')
+class ListadoLdapPaginadoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_ldap', 'admin_ldap@example.com', 'x', role='admin')
+
+    def setUp(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+        self.conexion = _DirectorioFalso(60)
+        patcher = mock.patch.object(ldap_pool, 'ejecutar', side_effect=lambda operacion, **opciones: operacion(self.conexion))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pagina_con_cookie(self):
+        url = reverse('list_ldap_users')
+        response = self.client.get(url, {'tamano': 25})
+        self.assertEqual(len(response.context['users']), 25)
+        self.assertEqual(self.conexion.busquedas[0], ('(objectClass=inetOrgPerson)', ['uid', 'cn', 'mail', 'sn']))
+
+        response = self.client.get(url + response.context['query_siguiente'])
+        response = self.client.get(url + response.context['query_siguiente'])
+        usuarios = response.context['users']
+        self.assertEqual((usuarios[0]['username'], len(usuarios)), ('usuario050', 10))
+        self.assertIsNone(response.context['query_siguiente'])
+        self.assertEqual(len(self.conexion.busquedas), 3)
+
+    def test_cookie_de_otra_conexion(self):
+        url = reverse('list_ldap_users')
+        response = self.client.get(url, {'tamano': 25})
+
+        # La siguiente petición obtiene otra conexión (otro proceso o del pool)
+        self.conexion = _DirectorioFalso(60)
+        response = self.client.get(url + response.context['query_siguiente'])
+        self.assertEqual(response.context['users'][0]['username'], 'usuario025')
+        self.assertEqual(response.context['pagina'].numero, 2)
+
+    def test_filtro_de_busqueda(self):
+        self.client.get(reverse('list_ldap_users'), {'q': 'ana*)('})
+        filtro = self.conexion.busquedas[0][0]
+        self.assertIn('(mail=*ana\\2a\\29\\28*)', filtro)
+        self.assertTrue(filtro.startswith('(&(objectClass=inetOrgPerson)(|'))
+
+
+@skipUnless(hasattr(ldap, 'SERVER_DOWN'), 'python-ldap no está instalado')
+class EspejoDirectorioLdapTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_espejo', 'admin_espejo@example.com', 'x', role='admin')
+        cls.usuario = CustomUser.objects.create_user('usuario007', 'usuario007@example.com', 'x')
+
+    def setUp(self):
+        from . import directorio_ldap
+
+        self.directorio = directorio_ldap
+        self.conexion = _DirectorioFalso(600)
+        patcher = mock.patch.object(ldap_pool, 'ejecutar', side_effect=lambda operacion, **opciones: operacion(self.conexion))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sincronizacion_incremental(self):
+        primera = self.directorio.sincronizar_directorio()
+        self.assertEqual((primera.created, primera.updated, primera.deleted), (600, 0, 0))
+        self.assertEqual(LdapDirectoryEntry.objects.count(), 600)
+
+        self.conexion.busquedas.clear()
+        self.conexion.entradas[3][1]['cn'] = [b'Otro nombre']
+        segunda = self.directorio.sincronizar_directorio()
+        self.assertIn('(modifyTimestamp>=20250101120000Z)', self.conexion.busquedas[0][0])
+        self.assertEqual((segunda.created, segunda.updated, segunda.unchanged), (0, 1, 599))
+        self.assertEqual(LdapDirectoryEntry.objects.get(uid='usuario003').cn, 'Otro nombre')
+
+    def test_marca_usuarios_que_desaparecen(self):
+        self.directorio.sincronizar_directorio()
+        entrada = self.conexion.entradas.pop(7)
+
+        sincronizacion = self.directorio.sincronizar_directorio()
+        self.assertEqual((sincronizacion.deleted, sincronizacion.users_flagged), (1, 1))
+        self.usuario.refresh_from_db()
+        self.assertIsNotNone(self.usuario.ldap_missing_since)
+
+        self.conexion.entradas.append(entrada)
+        self.directorio.sincronizar_directorio()
+        self.usuario.refresh_from_db()
+        self.assertIsNone(self.usuario.ldap_missing_since)
+
+    def test_listados_leen_la_copia_local(self):
+        self.directorio.sincronizar_directorio()
+        self.conexion.busquedas.clear()
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+        response = self.client.get(reverse('list_ldap_users'), {'q': 'usuario01', 'tamano': 25})
+        self.assertEqual([u['username'] for u in response.context['users']][:2], ['usuario010', 'usuario011'])
+        self.assertEqual(len(response.context['users']), 10)
+
+        response = self.client.get(reverse('list_django_users'))
+        usuarios = {u['username']: u for u in response.context['users']}
+        self.assertTrue(usuarios['usuario007']['in_ldap'])
+        self.assertFalse(usuarios['admin_espejo']['in_ldap'])
+        self.assertEqual(self.conexion.busquedas, [])
+
+
+@skipUnless(importlib.util.find_spec('django_auth_ldap'), 'django-auth-ldap no está instalado')
+@override_settings(AUTH_LDAP_PROFILE_FLAGS_BY_GROUP={'role': {
+    rol: f'cn={rol},ou=groups,dc=example,dc=com' for rol in ('admin', 'hr', 'tech', 'user')
+}})
+class RolLdapLoginTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = CustomUser.objects.create_user('ldap_rol', 'ldap_rol@example.com', 'x', role='hr')
+
+    def login(self, usuario, grupos):
+        """Lo que hace django-auth-ldap: señal populate_user y a continuación save()"""
+        from django_auth_ldap.backend import LDAPBackend, populate_user
+
+        populate_user.send(LDAPBackend, user=usuario, ldap_user=SimpleNamespace(group_names=set(grupos)))
+        usuario.save()
+
+    def test_login_sin_cambios_no_escribe(self):
+        usuario = CustomUser.objects.get(pk=self.usuario.pk)
+        with self.assertNumQueries(0):
+            self.login(usuario, {'active', 'hr', 'user'})
+
+    def test_solo_guarda_las_columnas_cambiadas(self):
+        usuario = CustomUser.objects.get(pk=self.usuario.pk)
+        usuario.first_name = 'Nuevo'
+        with CaptureQueriesContext(connection) as contexto:
+            self.login(usuario, {'active', 'admin', 'hr'})
+
+        sql = contexto.captured_queries[-1]['sql']
+        self.assertIn('"role"', sql)
+        self.assertIn('"first_name"', sql)
+        self.assertNotIn('"email"', sql)
+        self.assertEqual(CustomUser.objects.get(pk=self.usuario.pk).role, 'admin')
+
+    def test_usuario_nuevo(self):
+        usuario = CustomUser(username='ldap_nuevo', email='ldap_nuevo@example.com')
+        self.login(usuario, {'active', 'tech'})
+        self.assertEqual(CustomUser.objects.get(username='ldap_nuevo').role, 'tech')
+
+
+@override_settings(CACHES=CACHES_PRUEBA, LDAP_BREAKER_FAILURE_THRESHOLD=3, LDAP_BREAKER_COOLDOWN=30)
+class CircuitoLdapTests(TestCase):
+
+    def setUp(self):
+        circuito_ldap.reiniciar()
+        self.addCleanup(circuito_ldap.reiniciar)
+
+    def test_se_abre_tras_fallos_seguidos(self):
+        for _ in range(2):
+            circuito_ldap.fallo()
+        self.assertEqual(circuito_ldap.estado(), circuito_ldap.CERRADO)
+
+        circuito_ldap.fallo()
+        self.assertEqual(circuito_ldap.estado(), circuito_ldap.ABIERTO)
+        self.assertFalse(circuito_ldap.permitir())
+
+    def test_un_exito_reinicia_la_cuenta(self):
+        circuito_ldap.fallo()
+        circuito_ldap.fallo()
+        circuito_ldap.exito()
+        circuito_ldap.fallo()
+        self.assertTrue(circuito_ldap.permitir())
+
+    def test_semiabierto_deja_pasar_una_sonda(self):
+        for _ in range(3):
+            circuito_ldap.fallo()
+
+        with mock.patch.object(circuito_ldap.time, 'time', return_value=reloj.time() + 31):
+            self.assertEqual(circuito_ldap.estado(), circuito_ldap.SEMIABIERTO)
+            self.assertTrue(circuito_ldap.permitir())
+            self.assertFalse(circuito_ldap.permitir())
+
+            # La sonda falla: otro periodo completo sin LDAP
+            circuito_ldap.fallo()
+            self.assertEqual(circuito_ldap.estado(), circuito_ldap.ABIERTO)
+
+        with mock.patch.object(circuito_ldap.time, 'time', return_value=reloj.time() + 62):
+            self.assertTrue(circuito_ldap.permitir())
+            circuito_ldap.exito()
+        self.assertEqual(circuito_ldap.estado(), circuito_ldap.CERRADO)
+        self.assertTrue(circuito_ldap.permitir())
+
+
+@skipUnless(
+    hasattr(ldap, 'initialize') and importlib.util.find_spec('django_auth_ldap'),
+    'python-ldap y django-auth-ldap no están instalados'
+)
+@override_settings(
+    CACHES=CACHES_PRUEBA,
+    AUTHENTICATION_BACKENDS=[
+        'apps.accounts.backends.CircuitBreakerLDAPBackend',
+        'django.contrib.auth.backends.ModelBackend',
+    ],
+    # Dirección no enrutable: la conexión no se rechaza, se queda esperando
+    AUTH_LDAP_SERVER_URI='ldap://10.255.255.1:389',
+    AUTH_LDAP_USER_DN_TEMPLATE='uid=%(user)s,ou=users,dc=example,dc=com',
+    AUTH_LDAP_BIND_AS_AUTHENTICATING_USER=True,
+    LDAP_BREAKER_FAILURE_THRESHOLD=2,
+    LDAP_BREAKER_COOLDOWN=60,
+    # Que el tiempo medido sea el de LDAP y no el del hash de la contraseña local
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class CircuitoLdapLoginTests(TestCase):
+    TIMEOUT = 0.5
+
+    def setUp(self):
+        opciones = self.settings(AUTH_LDAP_CONNECTION_OPTIONS={
+            ldap.OPT_REFERRALS: 0,
+            ldap.OPT_NETWORK_TIMEOUT: self.TIMEOUT,
+            ldap.OPT_TIMEOUT: self.TIMEOUT,
+        })
+        opciones.enable()
+        self.addCleanup(opciones.disable)
+        circuito_ldap.reiniciar()
+        self.addCleanup(circuito_ldap.reiniciar)
+        self.admin = CustomUser.objects.create_superuser('admin_local', 'admin_local@example.com', 'clave-local')
+
+    def login(self):
+        empezar = reloj.perf_counter()
+        usuario = authenticate(username='admin_local', password='clave-local')
+        self.assertEqual(usuario, self.admin)
+        return reloj.perf_counter() - empezar
+
+    def test_servidor_inalcanzable(self):
+        # Mientras el circuito está cerrado cada login espera como mucho el timeout
+        for _ in range(2):
+            self.assertLess(self.login(), self.TIMEOUT + 1)
+        self.assertEqual(circuito_ldap.estado(), circuito_ldap.ABIERTO)
+
+        # Abierto: ni se intenta conectar y el superusuario local no espera el timeout
+        with mock.patch.object(ldap, 'initialize') as initialize:
+            tiempos = [self.login() for _ in range(5)]
+        initialize.assert_not_called()
+        self.assertLess(max(tiempos), self.TIMEOUT)
+
+
+class _LdapAsincrono:
+    """Conexión con add/modify asíncronos: las respuestas se piden con result3(msgid)"""
+
+    def __init__(self, existentes=(), miembros=None):
+        self.entradas = {dn: {} for dn in existentes}
+        self.miembros = miembros or {}
+        self.pendientes = {}
+        self.max_pendientes = 0
+        self.modificaciones = []
+        self.msgid = 0
+
+    def _encolar(self, operacion):
+        self.msgid += 1
+        msgid = self.msgid
+        self.pendientes[msgid] = operacion
+        self.max_pendientes = max(self.max_pendientes, len(self.pendientes))
+        return msgid
+
+    def add(self, dn, atributos):
+        return self._encolar(lambda: self._add(dn, atributos))
+
+    def _add(self, dn, atributos):
+        if dn in self.entradas:
+            raise ldap.ALREADY_EXISTS({'desc': 'Already exists'})
+        self.entradas[dn] = dict(atributos)
+
+    def search_s(self, dn, scope, attrlist=None):
+        if dn not in self.entradas:
+            raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+        return [(dn, {nombre: valor for nombre, valor in self.entradas[dn].items() if nombre in attrlist})]
+
+    def modify(self, dn, cambios):
+        return self._encolar(lambda: self.modify_s(dn, cambios))
+
+    def modify_s(self, dn, cambios):
+        self.modificaciones.append((dn, cambios))
+        actuales = self.miembros.setdefault(dn, set())
+        (_, _, valores), = cambios
+        if actuales & set(valores):
+            raise ldap.TYPE_OR_VALUE_EXISTS({'desc': 'Type or value exists'})
+        actuales.update(valores)
+
+    def result3(self, msgid):
+        self.pendientes.pop(msgid)()
+        return 105, [], msgid, []
+
+
+class _LdapQueSeCae(_LdapAsincrono):
+    """
+    Pierde la conexión en las llamadas a result3 de `caidas`: el servidor ya
+    aplicó lo que estaba en vuelo, pero las respuestas no llegan.
+    """
+
+    def __init__(self, caidas, **kwargs):
+        super().__init__(**kwargs)
+        self.caidas = set(caidas)
+        self.llamadas = 0
+
+    def result3(self, msgid):
+        self.llamadas += 1
+        if self.llamadas in self.caidas:
+            for operacion in self.pendientes.values():
+                try:
+                    operacion()
+                except ldap.LDAPError:
+                    pass
+            self.pendientes.clear()
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return super().result3(msgid)
+
+
+CSV_ALTA = (
+    'username,first_name,last_name,email,password,role,is_staff\n'
+    'ana,Ana,Gil,ana@example.com,secreta123,tech,\n'
+    'luis,Luis,Sanz,luis@example.com,secreta123,user,si\n'
+    'eva,Eva,Mora,eva@example.com,secreta123,jefa,\n'
+    'ana,Ana,Otra,ana2@example.com,secreta123,user,\n'
+    'pepe,Pepe,Ruiz,pepe@example.com,secreta123,user,\n'
+    'marta,Marta,Vidal,marta@example.com,corta,hr,\n'
+    'rosa,Rosa,Leal,rosa@example.com,secreta123,hr,\n'
+)
+
+
+@skipUnless(hasattr(ldap, 'SERVER_DOWN'), 'python-ldap no está instalado')
+class AltaMasivaLdapTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_alta', 'admin_alta@example.com', 'x', role='admin')
+
+    def setUp(self):
+        dn_usuario = aprovisionamiento_ldap.dn_usuario
+        self.conexion = _LdapAsincrono(
+            existentes={dn_usuario('pepe')},
+            # Un miembro antiguo del grupo user hace fallar el MOD_ADD conjunto
+            miembros={aprovisionamiento_ldap.dn_grupo('user'): {dn_usuario('luis').encode()}},
+        )
+        patcher = mock.patch.object(
+            ldap_pool, 'ejecutar', side_effect=lambda operacion, **opciones: operacion(self.conexion)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _con_reintento(self, conexion):
+        """Como PoolLDAP.ejecutar: tras SERVER_DOWN repite una vez la operación"""
+        def ejecutar(operacion, idempotente=False):
+            self.assertTrue(idempotente)
+            try:
+                return operacion(conexion)
+            except ldap.SERVER_DOWN:
+                return operacion(conexion)
+        return mock.patch.object(ldap_pool, 'ejecutar', side_effect=ejecutar)
+
+    def test_informe_por_fila(self):
+        filas = aprovisionamiento_ldap.leer_csv(StringIO(CSV_ALTA))
+        aprovisionamiento_ldap.aprovisionar(filas, ventana=2)
+
+        resultados = {fila.numero: (fila.username, fila.resultado) for fila in filas}
+        self.assertEqual(resultados, {
+            2: ('ana', 'creado'), 3: ('luis', 'creado'), 4: ('eva', 'error'), 5: ('ana', 'error'),
+            6: ('pepe', 'error'), 7: ('marta', 'error'), 8: ('rosa', 'creado'),
+        })
+        self.assertIn('role', filas[2].detalle)
+        self.assertEqual(filas[3].detalle, 'Usuario repetido en el CSV')
+        self.assertEqual(filas[4].detalle, 'Ya existe en LDAP')
+        self.assertLessEqual(self.conexion.max_pendientes, 2)
+
+        grupos = aprovisionamiento_ldap.dn_grupo
+        miembros = self.conexion.miembros
+        self.assertEqual(miembros[grupos('active')], {
+            aprovisionamiento_ldap.dn_usuario(u).encode() for u in ('ana', 'luis', 'rosa')
+        })
+        self.assertEqual(len(miembros[grupos('staff')]), 2)
+
+        # Un modify por grupo, más el reintento uno a uno del grupo que ya tenía a luis
+        modificados = [dn for dn, _ in self.conexion.modificaciones]
+        self.assertEqual(sorted(set(modificados)), sorted(grupos(g) for g in ('active', 'hr', 'staff', 'tech', 'user')))
+        self.assertEqual(modificados.count(grupos('active')), 1)
+        self.assertEqual(modificados.count(grupos('user')), 2)
+
+    def test_reintento_tras_caida(self):
+        # Se cae al recoger el alta de luis: la de luis y la de pepe (que ya
+        # existía) se aplicaron en el servidor, pero no llegó su respuesta
+        dn_usuario = aprovisionamiento_ldap.dn_usuario
+        conexion = _LdapQueSeCae(caidas={2}, existentes={dn_usuario('pepe')})
+        filas = aprovisionamiento_ldap.leer_csv(StringIO(CSV_ALTA))
+        with self._con_reintento(conexion):
+            aprovisionamiento_ldap.aprovisionar(filas, ventana=2)
+
+        creados = {fila.username: fila.detalle for fila in filas if fila.resultado == 'creado'}
+        self.assertEqual(creados, {'ana': '', 'luis': '', 'rosa': ''})
+        self.assertEqual(filas[4].detalle, 'Ya existe en LDAP')
+        grupos = aprovisionamiento_ldap.dn_grupo
+        self.assertEqual(
+            conexion.miembros[grupos('active')], {dn_usuario(u).encode() for u in ('ana', 'luis', 'rosa')}
+        )
+        self.assertEqual(conexion.miembros[grupos('hr')], {dn_usuario('rosa').encode()})
+
+    def test_grupos_sin_asignar_por_fila(self):
+        # La conexión no vuelve tras caerse al recoger el modify del grupo hr
+        dn_usuario = aprovisionamiento_ldap.dn_usuario
+        conexion = _LdapQueSeCae(caidas=range(9, 20), existentes={dn_usuario('pepe')})
+        filas = aprovisionamiento_ldap.leer_csv(StringIO(CSV_ALTA))
+        with self._con_reintento(conexion):
+            aprovisionamiento_ldap.aprovisionar(filas, ventana=2)
+
+        creados = {fila.username: fila.detalle for fila in filas if fila.resultado == 'creado'}
+        self.assertEqual(creados, {'ana': '', 'luis': '', 'rosa': 'Grupos sin asignar: hr'})
+
+    def test_formulario_de_subida(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+        archivo = SimpleUploadedFile('alta.csv', CSV_ALTA.encode('utf-8'), content_type='text/csv')
+        response = self.client.post(reverse('bulk_provision_ldap_users'), {'archivo': archivo})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([fila.resultado for fila in response.context['filas']].count('creado'), 3)
+        self.assertContains(response, 'Ya existe en LDAP')
+
+    def test_csv_sin_columnas(self):
+        with self.assertRaises(aprovisionamiento_ldap.CsvInvalido):
+            aprovisionamiento_ldap.leer_csv(StringIO('username,email\nana,ana@example.com\n'))
+
+
+@override_settings(CACHES=CACHES_PRUEBA, CACHE_STATS_FLUSH_INTERVAL=0)
+class ListadoUsuariosDjangoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        roles = ('user', 'tech', 'hr')
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'persona{i:02}', email=f'persona{i:02}@example.com', role=roles[i % 3],
+                is_staff=i % 5 == 0, is_active=i != 7,
+            )
+            for i in range(30)
+        ])
+        cls.admin = CustomUser.objects.create_user('zadmin', 'zadmin@example.com', 'x', role='admin')
+        LdapDirectoryEntry.objects.create(
+            dn='uid=persona03,ou=users,dc=example,dc=com', uid='persona03', synced_at=timezone.now()
+        )
+
+    def setUp(self):
+        # LocMemCache conserva los datos entre tests del mismo proceso
+        for alias in ('default', 'local'):
+            caches[alias].clear()
+
+    def listar(self, query='', tamano=10):
+        return listado_usuarios.listar_usuarios(QueryDict(query), tamano)
+
+    def nombres(self, pagina):
+        return [usuario['username'] for usuario in pagina.usuarios]
+
+    def test_paginas_por_username(self):
+        pagina, _, total = self.listar()
+        self.assertEqual(total, 31)
+        self.assertEqual(self.nombres(pagina), [f'persona{i:02}' for i in range(10)])
+        self.assertTrue(pagina.usuarios[3]['in_ldap'])
+        self.assertNotIn('password', pagina.usuarios[0])
+
+        siguiente, _, _ = self.listar(pagina.query_siguiente[1:])
+        self.assertEqual(self.nombres(siguiente)[0], 'persona10')
+        anterior, _, _ = self.listar(siguiente.query_anterior[1:])
+        self.assertEqual(self.nombres(anterior), self.nombres(pagina))
+        self.assertIsNone(anterior.query_anterior)
+
+    def test_filtros(self):
+        pagina, filtros, total = self.listar('rol=tech&staff=si')
+        self.assertEqual(self.nombres(pagina), ['persona10', 'persona25'])
+        self.assertEqual((total, filtros.rol, filtros.staff), (2, 'tech', 'si'))
+
+        pagina, _, total = self.listar('q=persona2&activo=si&rol=otro')
+        self.assertEqual(total, 10)
+
+        _, _, total = self.listar('activo=no')
+        self.assertEqual(total, 1)
+
+    def test_total_en_cache(self):
+        self.listar('rol=hr')
+        with self.assertNumQueries(2):
+            _, _, total = self.listar('rol=hr')
+        self.assertEqual(total, 10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomUser.objects.create_user('nueva', 'nueva@example.com', 'x', role='hr')
+        self.assertEqual(self.listar('rol=hr')[2], 11)
+
+    def test_vista(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('list_django_users'), {'tamano': 25, 'rol': 'user'})
+        self.assertEqual(len(response.context['users']), 10)
+        self.assertEqual(response.context['total_users'], 10)
+        self.assertContains(response, 'persona27')
+
+
+def _imagen(ancho=800, alto=600, color=(200, 30, 30, 255)):
+    salida = io.BytesIO()
+    Image.new('RGBA', (ancho, alto), color).save(salida, 'PNG')
+    return salida.getvalue()
+
+
+class MiniaturasAvatarTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        ajustes = self.settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.media = media
+
+    def subir(self, username, contenido):
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario = CustomUser.objects.create_user(username, f'{username}@example.com', 'x')
+            usuario.avatar = SimpleUploadedFile('foto.png', contenido, content_type='image/png')
+            usuario.save()
+        return CustomUser.objects.get(pk=usuario.pk)
+
+    def test_genera_las_miniaturas_al_subir(self):
+        usuario = self.subir('con_foto', _imagen())
+
+        miniaturas = usuario.avatar_thumbnails
+        self.assertEqual(miniaturas['source'], usuario.avatar.name)
+        self.assertEqual(set(miniaturas['sizes']), {'40', '96', '256'})
+        nombre = miniaturas['sizes']['40']['webp']
+        self.assertTrue(nombre.startswith(f"profiles/miniaturas/{miniaturas['sha256'][:20]}-40"))
+        with Image.open(os.path.join(self.media, nombre)) as imagen:
+            self.assertEqual((imagen.format, imagen.size), ('WEBP', (40, 40)))
+
+        self.assertIn('-96.webp', avatares.url_miniatura(usuario, 80))
+        self.assertIn('-256.jpeg', avatares.url_miniatura(usuario, 400, 'jpeg'))
+
+    def test_misma_imagen_mismos_ficheros(self):
+        primero = self.subir('uno', _imagen())
+        segundo = self.subir('dos', _imagen())
+        self.assertEqual(primero.avatar_thumbnails['sizes'], segundo.avatar_thumbnails['sizes'])
+        self.assertEqual(len(os.listdir(os.path.join(self.media, 'profiles', 'miniaturas'))), 6)
+
+    def test_plantilla_usa_la_miniatura(self):
+        usuario = self.subir('plantilla', _imagen())
+        html = Template('{% load avatares %}{% avatar usuario 40 %}').render(Context({'usuario': usuario}))
+        self.assertIn('-40.webp 1x', html)
+        self.assertIn('-96.webp 2x', html)
+        self.assertNotIn(usuario.avatar.url, html)
+
+    def test_comando_rellena_los_avatares_antiguos(self):
+        contenido = _imagen(color=(0, 90, 200, 255))
+        os.makedirs(os.path.join(self.media, 'profiles'))
+        with open(os.path.join(self.media, 'profiles', 'antigua.png'), 'wb') as fichero:
+            fichero.write(contenido)
+        # Avatares anteriores a las miniaturas: sin pasar por post_save
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'antiguo{i}', email=f'antiguo{i}@example.com', avatar='profiles/antigua.png')
+            for i in range(3)
+        ] + [CustomUser(username='sin_fichero', email='sin_fichero@example.com', avatar='profiles/no.png')])
+
+        salida = StringIO()
+        call_command('generate_avatar_thumbnails', procesos=2, stdout=salida)
+        self.assertIn('3 users updated, 1 skipped', salida.getvalue())
+        for usuario in CustomUser.objects.filter(username__startswith='antiguo'):
+            self.assertTrue(avatares.al_dia(usuario))
+            self.assertEqual(usuario.avatar_thumbnails['sha256'], avatares.huella(contenido))
+
+
+class EstaticosTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        raiz = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, raiz)
+        ajustes = override_settings(STATIC_ROOT=raiz, STORAGES={
+            **settings.STORAGES, 'staticfiles': {'BACKEND': 'apps.accounts.estaticos.EstaticosComprimidos'},
+        })
+        ajustes.enable()
+        cls.addClassCleanup(ajustes.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.raiz = raiz
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_estaticos', 'estaticos@example.com', 'x', role='admin')
+
+    def setUp(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_collectstatic_guarda_version_con_hash_y_gz(self):
+        nombre = staticfiles_storage.stored_name('css/dashboard.css')
+        self.assertRegex(nombre, r'^css/dashboard\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.raiz, nombre), 'rb') as original, \
+                gzip.open(os.path.join(self.raiz, f'{nombre}.gz')) as comprimido:
+            self.assertEqual(comprimido.read(), original.read())
+
+    def test_sirve_gz_con_cache_larga(self):
+        nombre = staticfiles_storage.stored_name('css/reports/workers_report.css')
+        respuesta = self.client.get(f'/static/{nombre}', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        self.assertEqual(respuesta['Content-Type'], 'text/css')
+        self.assertIn('immutable', respuesta['Cache-Control'])
+        self.assertIn('Accept-Encoding', respuesta['Vary'])
+        with open(os.path.join(self.raiz, nombre), 'rb') as original:
+            self.assertEqual(gzip.decompress(b''.join(respuesta.streaming_content)), original.read())
+
+        sin_gzip = self.client.get(f'/static/{nombre}')
+        self.assertFalse(sin_gzip.has_header('Content-Encoding'))
+        # Sin hash el fichero puede cambiar: caché corta
+        self.assertNotIn('immutable', self.client.get('/static/css/dashboard.css')['Cache-Control'])
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+
+    def test_paginas_enlazan_css_versionado_y_html_comprimido(self):
+        respuesta = self.client.get(reverse('admin_reports_dashboard'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        html = gzip.decompress(respuesta.content).decode()
+        self.assertNotIn('<style', html)
+        self.assertIn(staticfiles_storage.url('css/dashboard.css'), html)
+        self.assertIn(staticfiles_storage.url('css/reports/reports_dashboard.css'), html)
+
+        plantillas = os.path.join(os.path.dirname(__file__), 'templates')
+        for carpeta, _, ficheros in os.walk(plantillas):
+            for fichero in ficheros:
+                with open(os.path.join(carpeta, fichero), encoding='utf-8') as plantilla:
+                    self.assertNotIn('<style', plantilla.read(), fichero)
+
+
+class DatosSinteticosTests(TestCase):
+
+    def test_sembrar_y_borrar(self):
+        creados = datos_sinteticos.sembrar(3000, usuarios=40, proyectos=6, fecha_fin=date(2024, 6, 30))
+        self.assertEqual(creados, {'usuarios': 40, 'proyectos': 6, 'registros': 3000})
+
+        registros = RegistroFichaje.objects.filter(usuario__username__startswith='seed_')
+        self.assertEqual(registros.count(), 3000)
+        self.assertTrue(registros.filter(hora_salida__isnull=True, completo=False).exists())
+        self.assertTrue(registros.filter(proyecto__isnull=True).exists())
+        self.assertEqual(set(registros.values_list('jornada', flat=True)), {'presencial', 'remoto', 'desplazamiento'})
+        # Turno de noche: la salida es al día siguiente y las horas son las de calcular_horas()
+        nocturnos = registros.filter(hora_salida__lt=F('hora_entrada'))
+        self.assertTrue(nocturnos.exists())
+        for registro in nocturnos[:20]:
+            horas = registro.horas_trabajadas
+            registro.calcular_horas()
+            self.assertEqual(registro.horas_trabajadas, horas)
+        self.assertEqual(
+            ResumenFichajeDiario.objects.aggregate(total=Sum('registros'))['total'],
+            registros.count(),
+        )
+
+        # Un usuario real con un registro en un proyecto sintético: solo cambia su bucket
+        real = CustomUser.objects.create_user('real', 'real@example.com', 'x')
+        RegistroFichaje.objects.create(
+            usuario=real, fecha=date(2024, 7, 1), proyecto=Proyecto.objects.get(nombre='seed_proyecto_0'),
+            hora_entrada=time(9), hora_salida=time(17), horas_trabajadas=timedelta(hours=8),
+        )
+
+        with mock.patch.object(datos_sinteticos, 'reconstruir_resumenes') as reconstruir:
+            self.assertEqual(datos_sinteticos.borrar(), 3000)
+        reconstruir.assert_not_called()
+        self.assertFalse(CustomUser.objects.filter(username__startswith='seed_').exists())
+        self.assertFalse(Proyecto.objects.filter(nombre__startswith='seed_').exists())
+        self.assertEqual(
+            list(ResumenFichajeDiario.objects.values_list('usuario', 'proyecto', 'registros', 'horas')),
+            [(real.pk, None, 1, timedelta(hours=8))],
+        )
+        self.assertEqual(list(ResumenFichajeMensual.objects.values_list('usuario', 'proyecto')), [(real.pk, None)])
+
+    def test_misma_semilla_mismos_datos(self):
+        def huella():
+            return list(RegistroFichaje.objects.order_by('id').values_list(
+                'fecha', 'hora_entrada', 'hora_salida', 'jornada',
+            ))
+
+        datos_sinteticos.sembrar(500, fecha_fin=date(2024, 6, 30))
+        primera = huella()
+        datos_sinteticos.borrar()
+        datos_sinteticos.sembrar(500, fecha_fin=date(2024, 6, 30))
+        self.assertEqual(huella(), primera)
+
+    def test_benchmark_reports(self):
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta)
+        salida = os.path.join(carpeta, 'benchmark.json')
+
+        call_command('benchmark_reports', escalas='300', repeticiones=1, salida=salida, stdout=StringIO())
+        with open(salida, encoding='utf-8') as fichero:
+            informe = json.load(fichero)
+        escala = informe['escalas'][0]
+        self.assertEqual(escala['registros'], 300)
+        datos = escala['vistas']['admin_reports_dashboard']
+        self.assertEqual(datos['estado'], 200)
+        self.assertGreater(datos['consultas'], 0)
+        self.assertGreater(datos['plantillas_ms'], 0)
+        self.assertFalse(CustomUser.objects.filter(username__startswith='seed_').exists())
+
+        comparacion = StringIO()
+        call_command(
+            'benchmark_reports', escalas='300', repeticiones=1, salida=salida, comparar=salida,
+            stdout=comparacion,
+        )
+        self.assertIn('admin_reports_dashboard', comparacion.getvalue().split('Compared with')[1])
+
+
+@override_settings(CACHES=CACHES_PRUEBA, PERFORMANCE_INSTRUMENTATION=True, PERFORMANCE_FLUSH_INTERVAL=0)
+class RendimientoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_rendimiento', 'rendimiento@example.com', 'x', role='admin')
+
+    def setUp(self):
+        cache._l2().clear()
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_server_timing_log_e_histograma(self):
+        with self.assertLogs('apps.accounts.rendimiento', 'INFO') as logs:
+            respuesta = self.client.get(reverse('list_django_users'))
+        self.assertRegex(
+            respuesta['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ consultas", tpl;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+        self.assertIn('vista=list_django_users metodo=GET', logs.output[0])
+        datos = logs.records[0].rendimiento
+        self.assertEqual(datos['estado'], 200)
+        self.assertGreater(datos['consultas'], 0)
+        self.assertGreater(datos['plantillas_ms'], 0)
+
+        respuesta = self.client.get(reverse('admin_reports_dashboard'))
+        fila = next(fila for fila in respuesta.context['rendimiento_vistas'] if fila['vista'] == 'list_django_users')
+        self.assertEqual(fila['peticiones'], 1)
+        self.assertEqual(sum(fila['tramos']), 1)
+        self.assertContains(respuesta, 'Tiempos por Vista')
+
+    def test_ldap_cuenta_solo_la_llamada_exterior(self):
+        # Reloj falso: solo avanza dentro de interior()
+        ahora = [0.0]
+
+        @mediciones.medir_ldap
+        def interior():
+            ahora[0] += 0.02
+
+        @mediciones.medir_ldap
+        def exterior():
+            interior()
+            interior()
+
+        medicion = mediciones.Medicion()
+        with medicion.medir(), mock.patch.object(mediciones.time, 'perf_counter', side_effect=lambda: ahora[0]):
+            exterior()
+        self.assertAlmostEqual(medicion.ldap, 0.04)
+        self.assertIn('ldap;dur=', rendimiento.server_timing(medicion, 0.1))
+        # Sin medición activa el decorador no hace nada
+        exterior()
+
+    def test_percentiles_por_tramo(self):
+        self.assertEqual(rendimiento.tramo(10), 0)
+        self.assertEqual(rendimiento.tramo(10.5), 1)
+        self.assertEqual(rendimiento.tramo(9000), len(rendimiento.LIMITES))
+        cuentas = [0] * (len(rendimiento.LIMITES) + 1)
+        cuentas[2], cuentas[-1] = 19, 1
+        self.assertEqual(rendimiento._percentil(cuentas, 0.5), 50)
+        self.assertEqual(rendimiento._percentil(cuentas, 0.95), 50)
+        self.assertIsNone(rendimiento._percentil(cuentas, 0.99))
+
+    @override_settings(PERFORMANCE_INSTRUMENTATION=False)
+    def test_desactivado_no_se_instala(self):
+        respuesta = self.client.get(reverse('admin_reports_dashboard'))
+        self.assertFalse(respuesta.has_header('Server-Timing'))
+        self.assertIsNone(respuesta.context['rendimiento_vistas'])
+
+
+@override_settings(CACHES=CACHES_PRUEBA, PROFILING_ENABLED=True, PROFILING_RATE_LIMIT=3, PROFILING_KEEP=2)
+class PerfiladoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_perfil', 'perfil@example.com', 'x', role='admin')
+        cls.tecnico = CustomUser.objects.create_user('tecnico_perfil', 'tecnico@example.com', 'x', role='tech')
+
+    def setUp(self):
+        cache._l2().clear()
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta)
+        ajustes = self.settings(PROFILING_DIR=carpeta)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_admin_perfila_una_peticion(self):
+        respuesta = self.client.get(reverse('list_django_users'), {'_perfil': '1'})
+        self.assertEqual(respuesta.status_code, 200)
+        perfil = PerfilPeticion.objects.get(id=respuesta['X-Profile'])
+        self.assertEqual((perfil.vista, perfil.usuario, perfil.estado), ('list_django_users', self.admin, 200))
+        self.assertTrue(perfil.funciones)
+        self.assertTrue(os.path.exists(perfilado.ruta_fichero(perfil, 'txt')))
+        self.assertGreater(pstats.Stats(perfilado.ruta_fichero(perfil, 'prof')).total_calls, 0)
+
+        listado = self.client.get(reverse('admin_profiles'))
+        self.assertContains(listado, perfil.ruta)
+        descarga = self.client.get(reverse('admin_profile_file', args=[perfil.id, 'prof']))
+        self.assertIn('attachment', descarga['Content-Disposition'])
+        self.assertEqual(self.client.get(reverse('admin_profile_file', args=[perfil.id, 'exe'])).status_code, 404)
+
+    def test_solo_admins(self):
+        self.client.force_login(self.tecnico, backend='django.contrib.auth.backends.ModelBackend')
+        respuesta = self.client.get(reverse('user_fichaje'), HTTP_X_PROFILE='1')
+        self.assertFalse(respuesta.has_header('X-Profile'))
+        self.assertFalse(PerfilPeticion.objects.exists())
+
+    def test_limite_y_purgado(self):
+        respuestas = [self.client.get(reverse('admin_dashboard'), HTTP_X_PROFILE='1') for _ in range(4)]
+        self.assertEqual(respuestas[-1]['X-Profile'], 'limit')
+        self.assertEqual(respuestas[-1].status_code, 200)
+        # Se conservan los PROFILING_KEEP más recientes, con sus ficheros
+        conservados = list(PerfilPeticion.objects.values_list('id', flat=True))
+        self.assertEqual(conservados, [int(respuestas[2]['X-Profile']), int(respuestas[1]['X-Profile'])])
+        self.assertEqual(len(os.listdir(perfilado.carpeta())), 4)
+
+    def test_muestreador_pilas_colapsadas(self):
+        def ocupado():
+            final = reloj.perf_counter() + 0.05
+            while reloj.perf_counter() < final:
+                pass
+
+        muestreador = perfilado.Muestreador(threading.get_ident(), sys._getframe(), 0.002)
+        muestreador.start()
+        ocupado()
+        muestreador.parar()
+        pila, cuenta = muestreador.colapsadas().splitlines()[0].rsplit(' ', 1)
+        self.assertTrue(pila.endswith('test_muestreador_pilas_colapsadas.<locals>.ocupado'))
+        self.assertGreater(int(cuenta), 5)
+
+
+class ConsultasLentasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin_lentas', 'lentas@example.com', 'x', role='admin')
+
+    def setUp(self):
+        # Lo acumulado en memoria por un test no se escribe en el siguiente
+        self.addCleanup(consultas_lentas._pendientes.clear)
+
+    def test_huella_ignora_los_valores(self):
+        self.assertEqual(
+            consultas_lentas.normalizar("SELECT * FROM t WHERE id IN (%s, %s, %s) AND nombre = 'a''b' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND nombre = ? LIMIT ?',
+        )
+        self.assertEqual(
+            consultas_lentas.normalizar('SELECT "U0"."id" FROM t WHERE x IN (%s)'),
+            'SELECT "U0"."id" FROM t WHERE x IN (...)',
+        )
+
+    def test_registra_consultas_lentas_con_plan(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0.000001), \
+                mock.patch.object(consultas_lentas, 'explicar', wraps=consultas_lentas.explicar) as explicar, \
+                self.assertLogs('apps.accounts.consultas_lentas', 'WARNING') as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('list_django_users'))
+            self.client.get(reverse('list_django_users'))
+
+        consulta = ConsultaLenta.objects.get(vista='list_django_users', sql__contains='ORDER BY')
+        self.assertEqual(consulta.ejecuciones, 2)
+        self.assertIn('SCAN', consulta.plan.upper())
+        self.assertRegex(consulta.origen, r'^apps/accounts/\w+\.py:\d+ in \w+')
+        self.assertEqual(explicar.call_count, ConsultaLenta.objects.count())
+        self.assertIn('in list_django_users at apps/accounts/', ''.join(logs.output))
+
+        salida = StringIO()
+        call_command('slow_queries', limite=3, stdout=salida)
+        self.assertIn('#3 ', salida.getvalue())
+        self.assertNotIn('#4 ', salida.getvalue())
+        self.assertIn('plan:', salida.getvalue())
+
+    def test_escribe_fuera_de_la_transaccion(self):
+        tabla = ConsultaLenta._meta.db_table
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0.000001), self.assertLogs('apps.accounts.consultas_lentas'), \
+                self.captureOnCommitCallbacks() as al_confirmar, CaptureQueriesContext(connection) as consultas:
+            for _ in range(3):
+                CustomUser.objects.filter(username='admin_lentas').exists()
+
+        # Dentro de la transacción solo se leyó: ni UPDATE ni INSERT de ConsultaLenta
+        self.assertFalse([consulta for consulta in consultas if tabla in consulta['sql']])
+        self.assertFalse(ConsultaLenta.objects.exists())
+
+        for callback in al_confirmar:
+            callback()
+        consulta = ConsultaLenta.objects.get(ejemplo__contains='"username" = ')
+        self.assertEqual(consulta.ejecuciones, 3)
+        self.assertFalse(consultas_lentas._pendientes)
+
+    def test_desactivado_no_registra(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            CustomUser.objects.count()
+        self.assertFalse(ConsultaLenta.objects.exists())
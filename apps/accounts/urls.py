@@ -2,7 +2,7 @@ from django.urls import path
 from django.contrib.auth import views as auth_views
 from django.shortcuts import redirect
 from django.http import HttpResponseRedirect
-from . import views
+from . import views, api
 from .forms import (
     CustomPasswordResetForm,
     CustomPasswordChangeForm,
@@ -48,7 +48,9 @@ urlpatterns = [
     
     # LDAP User Management (Admin only)
     path("ldap/create-user/", views.create_ldap_user, name="create_ldap_user"),
+    path("ldap/bulk-provision/", views.bulk_provision_ldap_users, name="bulk_provision_ldap_users"),
     path("ldap/list-users/", views.list_ldap_users, name="list_ldap_users"),
+    path("ldap/sync/", views.sync_ldap_directory, name="sync_ldap_directory"),
     
     # Django User Management (Admin only)
     path("django/list-users/", views.list_django_users, name="list_django_users"),
@@ -59,8 +61,18 @@ urlpatterns = [
     path("reports/project/<int:project_id>/", views.admin_project_detail, name="admin_project_detail"),
     path("reports/workers/", views.admin_workers_report, name="admin_workers_report"),
     path("reports/worker/<int:user_id>/", views.admin_worker_detail, name="admin_worker_detail"),
+    path("reports/jobs/<int:trabajo_id>/", views.admin_report_job, name="admin_report_job"),
+    path("reports/export/workers.csv", views.admin_export_workers, name="admin_export_workers"),
+    path("reports/export/projects.csv", views.admin_export_projects, name="admin_export_projects"),
+    path("reports/export/registros.csv", views.admin_export_registros, name="admin_export_registros"),
+    path("reports/profiles/", views.admin_profiles, name="admin_profiles"),
+    path("reports/profiles/<int:perfil_id>.<str:formato>", views.admin_profile_file, name="admin_profile_file"),
 
     # Fichaje
     path("fichaje/user_fichaje/", views.user_fichaje, name="user_fichaje"),
+    path("fichaje/accion/", views.user_fichaje_accion, name="user_fichaje_accion"),
+
+    # Fichaje API (terminales de entrada)
+    path("api/fichaje/batch/", api.fichaje_batch, name="api_fichaje_batch"),
 ]
 
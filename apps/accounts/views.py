@@ -6,19 +6,29 @@ from django.contrib.auth.decorators import login_required
 from django.views.generic.edit import FormView
 from django.contrib.auth.decorators import user_passes_test
 from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 from django.contrib.auth import logout
 import ldap
+import logging
 from django.conf import settings
 from django.db import models
+from datetime import timedelta
 from .models import CustomUser
+from . import fichajes, ldap_pool, materializadas, rendimiento, reportes
+from .cache import ESTADISTICAS_DASHBOARD, agregar_resumenes_en_cache, estadisticas, proyectos_activos
+from .mediciones import medir_ldap
+from .paginacion import paginar_registros
+from .rollups import agregar_registros
 
 from .forms import (
     CustomLoginForm,
     ProfileForm,
     RegistrationForm,
     LDAPUserCreationForm,
+    LDAPBulkProvisionForm,
 )
 
+logger = logging.getLogger(__name__)
 
 
 # RegisterView handles new user registration using the custom three-field form
@@ -103,85 +113,100 @@ def tech_dashboard(request):
 def user_dashboard(request):
     return render(request, "dashboard/user_dashboard.html")
 
+def _aplicar_accion_fichaje(usuario, datos, today):
+    """
+    Aplica una acción del formulario de fichaje.
+    Devuelve (nivel, mensaje, estado); estado es el registro de hoy cuando ya se
+    conoce tras la acción, o None si hay que leerlo de la base de datos.
+    """
+    from .models import Proyecto
+    
+    action = datos.get('action')
+    
+    if action == 'fichar_entrada':
+        resultado, hora = fichajes.fichar_entrada(usuario)
+        if resultado == fichajes.OK:
+            # Tras una entrada correcta el estado se conoce sin volver a consultar
+            estado = {'hora_entrada': hora, 'hora_salida': None, 'horas_trabajadas': None, 'tiene_proyecto': True}
+            return messages.SUCCESS, f'Entrada fichada a las {hora.strftime("%H:%M")}', estado
+        elif resultado == fichajes.SIN_PROYECTO:
+            return messages.ERROR, 'Debes seleccionar un proyecto antes de fichar la entrada', None
+        return messages.WARNING, 'Ya has fichado la entrada hoy', None
+    
+    elif action == 'fichar_salida':
+        resultado, hora = fichajes.fichar_salida(usuario)
+        if resultado == fichajes.OK:
+            return messages.SUCCESS, f'Salida fichada a las {hora.strftime("%H:%M")}', None
+        elif resultado == fichajes.SIN_PROYECTO:
+            return messages.ERROR, 'Debes seleccionar un proyecto antes de fichar la salida', None
+        elif resultado == fichajes.SIN_ENTRADA:
+            return messages.ERROR, 'Debes fichar la entrada primero', None
+        return messages.WARNING, 'Ya has fichado la salida hoy', None
+    
+    elif action == 'actualizar_proyecto':
+        proyecto_id = datos.get('proyecto')
+        jornada = datos.get('jornada')
+        proyecto = None
+        
+        if proyecto_id:
+            try:
+                proyecto = Proyecto.objects.get(id=proyecto_id)
+            except (Proyecto.DoesNotExist, ValueError):
+                fichajes.actualizar_proyecto(usuario, None, jornada, today)
+                return messages.ERROR, 'Proyecto no válido', None
+                
+        fichajes.actualizar_proyecto(usuario, proyecto, jornada, today)
+        return messages.SUCCESS, 'Información actualizada correctamente', None
+    
+    return messages.ERROR, 'Acción no válida', None
+
+
+def _estado_fichaje(registro):
+    """Estado del registro de hoy que necesita la pantalla de fichaje"""
+    from .templatetags.time_filters import format_duration
+    
+    hora_entrada = registro['hora_entrada']
+    hora_salida = registro['hora_salida']
+    tiene_proyecto = registro['tiene_proyecto']
+    
+    return {
+        'hora_entrada': hora_entrada and hora_entrada.strftime('%H:%M'),
+        'hora_salida': hora_salida and hora_salida.strftime('%H:%M'),
+        'horas_trabajadas': registro['horas_trabajadas'] and format_duration(registro['horas_trabajadas']),
+        'puede_fichar_entrada': not hora_entrada and tiene_proyecto,
+        'puede_fichar_salida': bool(hora_entrada) and not hora_salida and tiene_proyecto,
+        'necesita_proyecto': not tiene_proyecto,
+    }
+
+
 @login_required
 def user_fichaje(request):
-    from .models import RegistroFichaje, Proyecto
+    from .models import RegistroFichaje
     from django.utils import timezone
-    from django.utils.timezone import localtime
-    import datetime
-    import locale
     
-    # Configurar localización para fechas en español
-    try:
-        locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-    except:
-        try:
-            locale.setlocale(locale.LC_TIME, 'Spanish_Spain.1252')  # Windows
-        except:
-            pass  # Si no se puede configurar, usar el formato por defecto
+    today = timezone.localdate()
     
-    today = timezone.now().date()
+    if request.method == 'POST':
+        nivel, mensaje, _ = _aplicar_accion_fichaje(request.user, request.POST, today)
+        messages.add_message(request, nivel, mensaje)
+        return redirect('user_fichaje')
     
-    # Obtener o crear registro de hoy
-    registro_hoy, created = RegistroFichaje.objects.get_or_create(
-        usuario=request.user,
-        fecha=today,
-        defaults={'jornada': 'presencial'}
+    # Registro de hoy (se crea al elegir proyecto, no al visitar la página)
+    registro_hoy = RegistroFichaje.objects.filter(
+        usuario=request.user, fecha=today
+    ).select_related('proyecto').first() or RegistroFichaje(
+        usuario=request.user, fecha=today, jornada='presencial'
     )
     
-    # Obtener proyectos activos
-    proyectos = Proyecto.objects.filter(activo=True)
-    
-    # Obtener registros históricos (últimos 10 días)
-    registros_historicos = RegistroFichaje.objects.filter(
-        usuario=request.user
-    ).order_by('-fecha')[:10]
+    # Obtener proyectos activos (cambian pocas veces al mes)
+    proyectos = proyectos_activos()
     
-    if request.method == 'POST':
-        action = request.POST.get('action')
-        
-        if action == 'fichar_entrada':
-            if not registro_hoy.proyecto:
-                messages.error(request, 'Debes seleccionar un proyecto antes de fichar la entrada')
-            elif not registro_hoy.hora_entrada:
-                registro_hoy.hora_entrada = localtime(timezone.now()).time()
-                registro_hoy.save()
-                messages.success(request, f'Entrada fichada a las {registro_hoy.hora_entrada.strftime("%H:%M")} para el proyecto {registro_hoy.proyecto.nombre}')
-            else:
-                messages.warning(request, 'Ya has fichado la entrada hoy')
-                
-        elif action == 'fichar_salida':
-            if not registro_hoy.proyecto:
-                messages.error(request, 'Debes seleccionar un proyecto antes de fichar la salida')
-            elif registro_hoy.hora_entrada and not registro_hoy.hora_salida:
-                registro_hoy.hora_salida = localtime(timezone.now()).time()
-                registro_hoy.save()
-                messages.success(request, f'Salida fichada a las {registro_hoy.hora_salida.strftime("%H:%M")} para el proyecto {registro_hoy.proyecto.nombre}')
-            elif not registro_hoy.hora_entrada:
-                messages.error(request, 'Debes fichar la entrada primero')
-            else:
-                messages.warning(request, 'Ya has fichado la salida hoy')
-                
-        elif action == 'actualizar_proyecto':
-            proyecto_id = request.POST.get('proyecto')
-            jornada = request.POST.get('jornada')
-            
-            if proyecto_id:
-                try:
-                    proyecto = Proyecto.objects.get(id=proyecto_id)
-                    registro_hoy.proyecto = proyecto
-                except Proyecto.DoesNotExist:
-                    messages.error(request, 'Proyecto no válido')
-                    
-            if jornada:
-                registro_hoy.jornada = jornada
-                
-            registro_hoy.save()
-            messages.success(request, 'Información actualizada correctamente')
-        
-        return redirect('user_fichaje')
+    # Obtener registros históricos (10 días por página)
+    registros_historicos = paginar_registros(
+        RegistroFichaje.objects.filter(usuario=request.user).select_related('proyecto'), request.GET, 10
+    )
     
-    # Formatear fecha en español
+    # Formatear fecha en español (sin locale.setlocale, que es global al proceso)
     meses = [
         '', 'enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio',
         'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre'
@@ -201,6 +226,36 @@ def user_fichaje(request):
     return render(request, "fichaje/user_fichaje.html", context)
 
 
+@login_required
+@require_POST
+def user_fichaje_accion(request):
+    """
+    Versión JSON de las acciones de user_fichaje: aplica la acción y devuelve
+    solo el estado actualizado del registro de hoy, para que la página se
+    actualice sin recargarse.
+    """
+    from .models import RegistroFichaje
+    from django.utils import timezone
+    
+    today = timezone.localdate()
+    nivel, mensaje, estado = _aplicar_accion_fichaje(request.user, request.POST, today)
+    
+    if estado is None:
+        estado = RegistroFichaje.objects.filter(usuario=request.user, fecha=today).annotate(
+            tiene_proyecto=models.Q(proyecto__isnull=False)
+        ).values(
+            'hora_entrada', 'hora_salida', 'horas_trabajadas', 'tiene_proyecto'
+        ).first() or {'hora_entrada': None, 'hora_salida': None, 'horas_trabajadas': None, 'tiene_proyecto': False}
+    
+    return JsonResponse({
+        'ok': nivel == messages.SUCCESS,
+        'nivel': messages.DEFAULT_TAGS[nivel],
+        'mensaje': mensaje,
+        'fecha': today.isoformat(),
+        'registro': _estado_fichaje(estado),
+    })
+
+
 # Helper function to check if user is admin
 def is_admin(user):
     return user.is_authenticated and user.role == 'admin'
@@ -243,58 +298,46 @@ def create_ldap_user(request):
     return render(request, 'admin/create_ldap_user.html', {'form': form})
 
 
+@medir_ldap
 def create_user_in_ldap(username, first_name, last_name, email, password, role, is_staff):
     """
     Create a new user in the LDAP server
     """
+    from .aprovisionamiento_ldap import atributos_usuario, dn_grupo, dn_usuario, grupos_del_rol
+    
     try:
-        # Connect to LDAP server
-        ldap_conn = ldap.initialize(settings.AUTH_LDAP_SERVER_URI)
-        ldap_conn.simple_bind_s(settings.AUTH_LDAP_BIND_DN, settings.AUTH_LDAP_BIND_PASSWORD)
-        
         # User DN
-        user_dn = f"uid={username},ou=users,dc=example,dc=com"
+        user_dn = dn_usuario(username)
         
         # User attributes - LDAP handles password encoding automatically
-        user_attrs = [
-            ('objectClass', [b'inetOrgPerson']),
-            ('uid', [username.encode('utf-8')]),
-            ('cn', [f"{first_name} {last_name}".encode('utf-8')]),
-            ('sn', [last_name.encode('utf-8')]),
-            ('givenName', [first_name.encode('utf-8')]),
-            ('mail', [email.encode('utf-8')]),
-            ('userPassword', [password.encode('utf-8')]),  # No base64 encoding needed
-        ]
-        
-        # Add user to LDAP
-        ldap_conn.add_s(user_dn, user_attrs)
+        user_attrs = atributos_usuario(username, first_name, last_name, email, password)
         
         # Add user to groups based on role and permissions
-        groups_to_add = ['active']  # All users are active by default
-        
-        if role == 'admin':
-            groups_to_add.extend(['admin', 'staff', 'superuser'])
-        elif role == 'hr':
-            groups_to_add.append('hr')
-        elif role == 'tech':
-            groups_to_add.extend(['tech', 'staff'])
-        else:  # user
-            groups_to_add.append('user')
+        groups_to_add = grupos_del_rol(role, is_staff)
         
-        if is_staff and role not in ['admin', 'tech']:
-            groups_to_add.append('staff')
+        def add_user(ldap_conn):
+            # Add user to LDAP
+            ldap_conn.add_s(user_dn, user_attrs)
+            
+            # Add user to groups
+            for group in groups_to_add:
+                try:
+                    group_dn = dn_grupo(group)
+                    mod_attrs = [(ldap.MOD_ADD, 'member', [user_dn.encode('utf-8')])]
+                    ldap_conn.modify_s(group_dn, mod_attrs)
+                except ldap.TYPE_OR_VALUE_EXISTS:
+                    # User already in group, ignore
+                    pass
         
-        # Add user to groups
-        for group in groups_to_add:
-            try:
-                group_dn = f"cn={group},ou=groups,dc=example,dc=com"
-                mod_attrs = [(ldap.MOD_ADD, 'member', [user_dn.encode('utf-8')])]
-                ldap_conn.modify_s(group_dn, mod_attrs)
-            except ldap.TYPE_OR_VALUE_EXISTS:
-                # User already in group, ignore
-                pass
+        # Pooled connection already bound as the service account
+        ldap_pool.ejecutar(add_user)
         
-        ldap_conn.unbind_s()
+        # Show the new user in the local directory mirror right away
+        try:
+            from .directorio_ldap import sincronizar_usuario
+            sincronizar_usuario(username)
+        except Exception:
+            logger.exception("Could not copy LDAP user %s to the directory mirror", username)
         return True
         
     except ldap.ALREADY_EXISTS:
@@ -307,76 +350,120 @@ def create_user_in_ldap(username, first_name, last_name, email, password, role,
         raise Exception(f"Error al crear usuario en LDAP: {str(e)}")
 
 
+@user_passes_test(is_admin)
+def bulk_provision_ldap_users(request):
+    """
+    Create the LDAP users of an uploaded CSV in one go and show a per-row report
+    """
+    from .aprovisionamiento_ldap import CREADO, CsvInvalido, aprovisionar, leer_csv
+    
+    filas = None
+    if request.method == 'POST':
+        form = LDAPBulkProvisionForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                filas = aprovisionar(leer_csv(form.cleaned_data['archivo']))
+            except CsvInvalido as e:
+                form.add_error('archivo', str(e))
+            else:
+                creados = sum(1 for fila in filas if fila.resultado == CREADO)
+                if creados:
+                    messages.success(request, f'{creados} de {len(filas)} usuarios creados en LDAP.')
+                if creados < len(filas):
+                    messages.error(request, f'{len(filas) - creados} filas con errores, revise el informe.')
+    else:
+        form = LDAPBulkProvisionForm()
+    
+    return render(request, 'admin/bulk_provision_ldap.html', {'form': form, 'filas': filas})
+
+
 @user_passes_test(is_admin)
 def list_ldap_users(request):
     """
-    List all users from LDAP
+    List LDAP users one page at a time, optionally filtered by uid, name or email.
+    Reads the local directory mirror once it has been synced at least once.
     """
+    from .directorio_ldap import (
+        TAMANO_PAGINA, TAMANOS_PAGINA, buscar_usuarios, espejo_disponible, listar_espejo,
+    )
+    from .models import LdapDirectorySync
+    
+    texto = request.GET.get('q', '').strip()
     try:
-        # Connect to LDAP server
-        ldap_conn = ldap.initialize(settings.AUTH_LDAP_SERVER_URI)
-        ldap_conn.simple_bind_s(settings.AUTH_LDAP_BIND_DN, settings.AUTH_LDAP_BIND_PASSWORD)
-        
-        # Search for users
-        search_filter = "(objectClass=inetOrgPerson)"
-        search_base = "ou=users,dc=example,dc=com"
-        
-        result = ldap_conn.search_s(search_base, ldap.SCOPE_SUBTREE, search_filter)
-        
-        users = []
-        for dn, attrs in result:
-            if dn:  # Skip empty results
-                user_info = {
-                    'dn': dn,
-                    'username': attrs.get('uid', [b''])[0].decode('utf-8'),
-                    'name': attrs.get('cn', [b''])[0].decode('utf-8'),
-                    'email': attrs.get('mail', [b''])[0].decode('utf-8'),
-                    'surname': attrs.get('sn', [b''])[0].decode('utf-8'),
-                }
-                users.append(user_info)
-        
-        ldap_conn.unbind_s()
-        return render(request, 'admin/list_ldap_users.html', {'users': users})
-        
+        tamano = int(request.GET.get('tamano', TAMANO_PAGINA))
+    except ValueError:
+        tamano = TAMANO_PAGINA
+    if tamano not in TAMANOS_PAGINA:
+        tamano = TAMANO_PAGINA
+    
+    try:
+        if espejo_disponible():
+            pagina = listar_espejo(texto, tamano, request.GET.get('cursor', ''))
+        else:
+            # Paged search on a pooled connection, only the attributes shown
+            pagina = buscar_usuarios(texto, tamano, request.GET.get('cursor', ''))
     except Exception as e:
         messages.error(request, f'Error al obtener usuarios LDAP: {str(e)}')
         return redirect('admin_dashboard')
+    
+    siguiente = request.GET.copy()
+    siguiente['cursor'] = pagina.cursor_siguiente or ''
+    primera = request.GET.copy()
+    primera.pop('cursor', None)
+    
+    context = {
+        'users': pagina.usuarios,
+        'pagina': pagina,
+        'q': texto,
+        'tamano': tamano,
+        'tamanos': TAMANOS_PAGINA,
+        'query_siguiente': '?' + siguiente.urlencode() if pagina.hay_siguiente else None,
+        'query_primera': '?' + primera.urlencode() if pagina.numero > 1 else None,
+        'ultima_sincronizacion': LdapDirectorySync.objects.filter(
+            finished_at__isnull=False
+        ).order_by('-started_at').first(),
+    }
+    return render(request, 'admin/list_ldap_users.html', context)
+
+
+@user_passes_test(is_admin)
+@require_POST
+def sync_ldap_directory(request):
+    """
+    Sync the local LDAP directory mirror (in the background when Celery has a broker)
+    """
+    from .tasks import sincronizar_directorio_ldap
+    
+    sincronizar_directorio_ldap.delay()
+    messages.info(request, 'Sincronización del directorio LDAP solicitada.')
+    return redirect('list_ldap_users')
 
 
 @login_required
 @user_passes_test(lambda u: u.role == 'admin')
 def list_django_users(request):
     """
-    List all users from Django database
-    """
-    from django.contrib.auth import get_user_model
-    
-    User = get_user_model()
-    
-    # Obtener todos los usuarios de Django
-    users = User.objects.all().order_by('username')
-    
-    # Preparar datos para el template
-    user_list = []
-    for user in users:
-        user_info = {
-            'id': user.id,
-            'username': user.username,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'email': user.email,
-            'is_active': user.is_active,
-            'is_staff': user.is_staff,
-            'is_superuser': user.is_superuser,
-            'date_joined': user.date_joined,
-            'last_login': user.last_login,
-            'role': getattr(user, 'role', 'user'),  # Rol personalizado si existe
-        }
-        user_list.append(user_info)
+    List Django users one page at a time (keyset by username), with search and filters
+    """
+    from .listado_usuarios import ROLES, TAMANO_PAGINA, TAMANOS_PAGINA, listar_usuarios
+    
+    try:
+        tamano = int(request.GET.get('tamano', TAMANO_PAGINA))
+    except ValueError:
+        tamano = TAMANO_PAGINA
+    if tamano not in TAMANOS_PAGINA:
+        tamano = TAMANO_PAGINA
+    
+    pagina, filtros, total = listar_usuarios(request.GET, tamano)
     
     return render(request, 'admin/list_django_users.html', {
-        'users': user_list,
-        'total_users': users.count()
+        'users': pagina.usuarios,
+        'pagina': pagina,
+        'filtros': filtros,
+        'roles': ROLES,
+        'tamano': tamano,
+        'tamanos': TAMANOS_PAGINA,
+        'total_users': total,
     })
 
 
@@ -391,84 +478,86 @@ def admin_reports_dashboard(request):
     from django.db.models import Count, Sum, Avg
     from datetime import timedelta
     
-    # Estadísticas generales
-    total_proyectos = Proyecto.objects.filter(activo=True).count()
-    total_usuarios_activos = CustomUser.objects.filter(is_active=True).count()
-    
-    # Registros del último mes
     from django.utils import timezone
     hace_30_dias = timezone.now().date() - timedelta(days=30)
     
-    registros_mes = RegistroFichaje.objects.filter(fecha__gte=hace_30_dias)
-    total_registros_mes = registros_mes.count()
-    
-    # Proyectos más activos (por número de registros)
-    proyectos_activos = Proyecto.objects.annotate(
-        num_registros=Count('registrofichaje', filter=models.Q(registrofichaje__fecha__gte=hace_30_dias))
-    ).filter(activo=True).order_by('-num_registros')[:5]
-    
-    # Usuarios más activos
-    usuarios_activos = CustomUser.objects.annotate(
-        num_fichajes=Count('fichajes', filter=models.Q(fichajes__fecha__gte=hace_30_dias))
-    ).filter(is_active=True).order_by('-num_fichajes')[:5]
+    def calcular_estadisticas():
+        # Estadísticas generales
+        registros_mes = RegistroFichaje.objects.filter(fecha__gte=hace_30_dias)
+        
+        return {
+            'total_proyectos': Proyecto.objects.filter(activo=True).count(),
+            'total_usuarios_activos': CustomUser.objects.filter(is_active=True).count(),
+            # Registros del último mes
+            'total_registros_mes': registros_mes.count(),
+            # Proyectos más activos (por número de registros)
+            'proyectos_activos': list(Proyecto.objects.annotate(
+                num_registros=Count('registrofichaje', filter=models.Q(registrofichaje__fecha__gte=hace_30_dias))
+            ).filter(activo=True).order_by('-num_registros')[:5]),
+            # Usuarios más activos
+            'usuarios_activos': list(CustomUser.objects.annotate(
+                num_fichajes=Count('fichajes', filter=models.Q(fichajes__fecha__gte=hace_30_dias))
+            ).filter(is_active=True).order_by('-num_fichajes')[:5]),
+        }
     
     context = {
-        'total_proyectos': total_proyectos,
-        'total_usuarios_activos': total_usuarios_activos,
-        'total_registros_mes': total_registros_mes,
-        'proyectos_activos': proyectos_activos,
-        'usuarios_activos': usuarios_activos,
+        **ESTADISTICAS_DASHBOARD.obtener(calcular_estadisticas, hace_30_dias),
+        'estadisticas_cache': estadisticas(),
+        'rendimiento_vistas': rendimiento.histogramas() if rendimiento.activo() else None,
+        'tramos_rendimiento': rendimiento.etiquetas(),
     }
     
     return render(request, 'admin/reports_dashboard.html', context)
 
 
-@login_required
-@user_passes_test(lambda u: u.role == 'admin')
-def admin_projects_report(request):
+def _sumar_horas(filas):
+    """Suma las horas de varias filas de resúmenes (None si ninguna tiene horas)"""
+    filas = [datos for datos in filas if datos and datos['registros_con_horas']]
+    if not filas:
+        return None
+    return sum((datos['horas'] for datos in filas), timedelta())
+
+
+def _reporte_general(request, tipo, plantilla, nombre_lista):
     """
-    Reporte de todos los proyectos con estadísticas
+    Reporte de proyectos o trabajadores. Los rangos pequeños se calculan en la
+    petición; los grandes se delegan en un TrabajoReporte de Celery y se
+    redirige a su página de estado.
     """
-    from .models import RegistroFichaje, Proyecto
-    from django.db.models import Count, Sum, Q
-    from datetime import datetime, timedelta
-    
     # Filtros opcionales
     fecha_desde = request.GET.get('fecha_desde')
     fecha_hasta = request.GET.get('fecha_hasta')
+    fecha_desde_obj = _fecha_filtro(request, 'fecha_desde')
+    fecha_hasta_obj = _fecha_filtro(request, 'fecha_hasta')
     
-    # Construir filtros
-    filtros = Q(activo=True)
-    filtros_registros = Q()
-    
-    if fecha_desde:
-        try:
-            fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
-            filtros_registros &= Q(registrofichaje__fecha__gte=fecha_desde_obj)
-        except ValueError:
-            pass
-    
-    if fecha_hasta:
-        try:
-            fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
-            filtros_registros &= Q(registrofichaje__fecha__lte=fecha_hasta_obj)
-        except ValueError:
-            pass
-    
-    # Obtener proyectos con estadísticas
-    proyectos = Proyecto.objects.filter(filtros).annotate(
-        total_trabajadores=Count('registrofichaje__usuario', distinct=True, filter=filtros_registros),
-        total_registros=Count('registrofichaje', filter=filtros_registros),
-        total_horas=Sum('registrofichaje__horas_trabajadas', filter=filtros_registros)
-    ).order_by('-total_registros')
+    if reportes.es_rango_grande(fecha_desde_obj, fecha_hasta_obj):
+        trabajo = reportes.solicitar_reporte(tipo, fecha_desde_obj, fecha_hasta_obj, usuario=request.user)
+        return redirect('admin_report_job', trabajo_id=trabajo.id)
     
+    estadisticas = reportes.TIPOS[tipo](fecha_desde_obj, fecha_hasta_obj)
     context = {
-        'proyectos': proyectos,
+        nombre_lista: _objetos_reporte(tipo, estadisticas),
         'fecha_desde': fecha_desde,
         'fecha_hasta': fecha_hasta,
     }
     
-    return render(request, 'admin/projects_report.html', context)
+    return render(request, plantilla, context)
+
+
+def _objetos_reporte(tipo, estadisticas):
+    """Proyectos o trabajadores con las estadísticas del reporte aplicadas"""
+    if tipo == 'proyectos':
+        return reportes.proyectos_con_estadisticas(estadisticas)
+    return reportes.trabajadores_con_estadisticas(estadisticas)
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_projects_report(request):
+    """
+    Reporte de todos los proyectos con estadísticas
+    """
+    return _reporte_general(request, 'proyectos', 'admin/projects_report.html', 'proyectos')
 
 
 @login_required
@@ -477,8 +566,8 @@ def admin_project_detail(request, project_id):
     """
     Detalle de un proyecto específico con trabajadores asignados
     """
-    from .models import RegistroFichaje, Proyecto
-    from django.db.models import Sum, Count, Q
+    from .models import RegistroFichaje, Proyecto, ResumenFichajeMensual
+    from django.db.models import Q
     from datetime import datetime
     
     try:
@@ -509,35 +598,35 @@ def admin_project_detail(request, project_id):
         except ValueError:
             pass
     
-    # Construir filtros para anotaciones de CustomUser
-    filtro_base = Q(fichajes__proyecto=proyecto)
-    if fecha_desde_obj:
-        filtro_base &= Q(fichajes__fecha__gte=fecha_desde_obj)
-    if fecha_hasta_obj:
-        filtro_base &= Q(fichajes__fecha__lte=fecha_hasta_obj)
-    
-    # Trabajadores en este proyecto con sus estadísticas
-    trabajadores_stats = CustomUser.objects.filter(
-        fichajes__proyecto=proyecto
-    ).annotate(
-        total_horas=Sum('fichajes__horas_trabajadas', 
-                       filter=filtro_base & Q(fichajes__horas_trabajadas__isnull=False)),
-        total_dias=Count('fichajes', filter=filtro_base),
-        horas_presencial=Sum('fichajes__horas_trabajadas', 
-                           filter=filtro_base & Q(fichajes__jornada='presencial') & 
-                                 Q(fichajes__horas_trabajadas__isnull=False)),
-        horas_remoto=Sum('fichajes__horas_trabajadas', 
-                        filter=filtro_base & Q(fichajes__jornada='remoto') & 
-                               Q(fichajes__horas_trabajadas__isnull=False)),
-        horas_desplazamiento=Sum('fichajes__horas_trabajadas', 
-                               filter=filtro_base & Q(fichajes__jornada='desplazamiento') & 
-                                     Q(fichajes__horas_trabajadas__isnull=False))
-    ).distinct().order_by('-total_horas')
-    
-    # Registros detallados del proyecto
-    registros = RegistroFichaje.objects.filter(filtros_registros).select_related(
-        'usuario', 'proyecto'
-    ).order_by('-fecha', '-hora_entrada')[:50]  # Últimos 50 registros
+    # Totales por trabajador y jornada leídos de los resúmenes
+    totales = agregar_resumenes_en_cache(
+        ('usuario_id', 'jornada'), fecha_desde_obj, fecha_hasta_obj, proyecto_id=proyecto.id
+    )
+    
+    # Trabajadores que han fichado alguna vez en este proyecto
+    trabajadores_ids = ResumenFichajeMensual.objects.filter(
+        proyecto=proyecto
+    ).order_by().values_list('usuario_id', flat=True).distinct()
+    trabajadores_stats = list(CustomUser.objects.filter(id__in=trabajadores_ids))
+    
+    jornadas_por_id = {}
+    for (usuario_id, jornada), datos in totales.items():
+        jornadas_por_id.setdefault(usuario_id, {})[jornada] = datos
+    
+    for trabajador in trabajadores_stats:
+        filas = jornadas_por_id.get(trabajador.id, {})
+        trabajador.total_horas = _sumar_horas(filas.values())
+        trabajador.total_dias = sum(datos['registros'] for datos in filas.values())
+        trabajador.horas_presencial = _sumar_horas([filas.get('presencial')])
+        trabajador.horas_remoto = _sumar_horas([filas.get('remoto')])
+        trabajador.horas_desplazamiento = _sumar_horas([filas.get('desplazamiento')])
+    reportes.ordenar_por_horas(trabajadores_stats)
+    
+    # Registros detallados del proyecto, paginados por cursor (50 por página)
+    registros = paginar_registros(
+        RegistroFichaje.objects.filter(filtros_registros).select_related('usuario', 'proyecto'),
+        request.GET, 50,
+    )
     
     context = {
         'proyecto': proyecto,
@@ -556,48 +645,41 @@ def admin_workers_report(request):
     """
     Reporte de todos los trabajadores con estadísticas
     """
-    from .models import RegistroFichaje
-    from django.db.models import Count, Sum, Q, Avg
-    from datetime import datetime, timedelta
-    
-    # Filtros opcionales
-    fecha_desde = request.GET.get('fecha_desde')
-    fecha_hasta = request.GET.get('fecha_hasta')
-    
-    filtros = Q()
+    return _reporte_general(request, 'trabajadores', 'admin/workers_report.html', 'trabajadores')
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_report_job(request, trabajo_id):
+    """
+    Estado de un reporte calculado en segundo plano. Mientras no termina se
+    muestra una página que consulta el estado (?formato=json); al terminar se
+    muestra el reporte con el resultado guardado.
+    """
+    from django.shortcuts import get_object_or_404
+    from .models import TrabajoReporte
     
-    if fecha_desde:
-        try:
-            fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
-            filtros &= Q(fichajes__fecha__gte=fecha_desde_obj)
-        except ValueError:
-            pass
+    trabajo = get_object_or_404(TrabajoReporte, id=trabajo_id)
     
-    if fecha_hasta:
-        try:
-            fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
-            filtros &= Q(fichajes__fecha__lte=fecha_hasta_obj)
-        except ValueError:
-            pass
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({'estado': trabajo.estado, 'error': trabajo.error})
     
-    # Trabajadores con estadísticas
-    trabajadores = CustomUser.objects.filter(is_active=True).annotate(
-        total_dias_trabajados=Count('fichajes', filter=filtros),
-        total_horas=Sum('fichajes__horas_trabajadas', filter=filtros),
-        proyectos_trabajados=Count('fichajes__proyecto', distinct=True, filter=filtros),
-        horas_promedio_dia=Avg('fichajes__horas_trabajadas', filter=filtros),
-        dias_presencial=Count('fichajes', filter=filtros & Q(fichajes__jornada='presencial')),
-        dias_remoto=Count('fichajes', filter=filtros & Q(fichajes__jornada='remoto')),
-        dias_desplazamiento=Count('fichajes', filter=filtros & Q(fichajes__jornada='desplazamiento'))
-    ).order_by('-total_horas')
+    plantillas = {
+        'proyectos': ('admin/projects_report.html', 'proyectos'),
+        'trabajadores': ('admin/workers_report.html', 'trabajadores'),
+    }
+    if trabajo.estado != 'completado':
+        return render(request, 'admin/report_job.html', {'trabajo': trabajo})
     
+    plantilla, nombre_lista = plantillas[trabajo.tipo]
     context = {
-        'trabajadores': trabajadores,
-        'fecha_desde': fecha_desde,
-        'fecha_hasta': fecha_hasta,
+        nombre_lista: _objetos_reporte(trabajo.tipo, trabajo.resultado),
+        'fecha_desde': trabajo.parametros.get('fecha_desde') or '',
+        'fecha_hasta': trabajo.parametros.get('fecha_hasta') or '',
+        'trabajo': trabajo,
     }
     
-    return render(request, 'admin/workers_report.html', context)
+    return render(request, plantilla, context)
 
 
 @login_required
@@ -606,8 +688,8 @@ def admin_worker_detail(request, user_id):
     """
     Detalle de un trabajador específico con todos sus proyectos y horarios
     """
-    from .models import RegistroFichaje, Proyecto
-    from django.db.models import Sum, Count, Q
+    from .models import RegistroFichaje, Proyecto, ResumenFichajeMensual
+    from django.db.models import Q
     from datetime import datetime
     
     try:
@@ -638,45 +720,44 @@ def admin_worker_detail(request, user_id):
         except ValueError:
             pass
     
-    # Construir filtros para anotaciones de Proyecto
-    filtro_base = Q(registrofichaje__usuario=trabajador)
-    if fecha_desde_obj:
-        filtro_base &= Q(registrofichaje__fecha__gte=fecha_desde_obj)
-    if fecha_hasta_obj:
-        filtro_base &= Q(registrofichaje__fecha__lte=fecha_hasta_obj)
-    
-    # Proyectos del trabajador con estadísticas
-    proyectos_stats = Proyecto.objects.filter(
-        registrofichaje__usuario=trabajador
-    ).annotate(
-        total_horas=Sum('registrofichaje__horas_trabajadas', 
-                       filter=filtro_base & Q(registrofichaje__horas_trabajadas__isnull=False)),
-        total_dias=Count('registrofichaje', filter=filtro_base),
-        horas_presencial=Sum('registrofichaje__horas_trabajadas', 
-                           filter=filtro_base & Q(registrofichaje__jornada='presencial') & 
-                                 Q(registrofichaje__horas_trabajadas__isnull=False)),
-        horas_remoto=Sum('registrofichaje__horas_trabajadas', 
-                        filter=filtro_base & Q(registrofichaje__jornada='remoto') & 
-                               Q(registrofichaje__horas_trabajadas__isnull=False)),
-        horas_desplazamiento=Sum('registrofichaje__horas_trabajadas', 
-                               filter=filtro_base & Q(registrofichaje__jornada='desplazamiento') & 
-                                     Q(registrofichaje__horas_trabajadas__isnull=False))
-    ).distinct().order_by('-total_horas')
-    
-    # Registros detallados del trabajador (horarios diarios)
-    registros = RegistroFichaje.objects.filter(filtros_registros).select_related(
-        'proyecto'
-    ).order_by('-fecha')[:30]  # Últimos 30 días
-    
-    # Estadísticas generales
-    stats_generales = RegistroFichaje.objects.filter(
-        filtros_registros & Q(horas_trabajadas__isnull=False)
-    ).aggregate(
-        total_horas=Sum('horas_trabajadas'),
-        total_dias=Count('id'),
-        total_proyectos=Count('proyecto', distinct=True)
+    # Totales por proyecto y jornada: un solo GROUP BY sobre sus registros
+    totales = agregar_registros(
+        ('proyecto_id', 'jornada'), fecha_desde_obj, fecha_hasta_obj, usuario=trabajador
+    )
+    
+    # Proyectos en los que ha fichado alguna vez el trabajador
+    proyectos_ids = ResumenFichajeMensual.objects.filter(
+        usuario=trabajador, proyecto__isnull=False
+    ).order_by().values_list('proyecto_id', flat=True).distinct()
+    proyectos_stats = list(Proyecto.objects.filter(id__in=proyectos_ids))
+    
+    jornadas_por_id = {}
+    for (proyecto_id, jornada), datos in totales.items():
+        jornadas_por_id.setdefault(proyecto_id, {})[jornada] = datos
+    
+    for proyecto in proyectos_stats:
+        filas = jornadas_por_id.get(proyecto.id, {})
+        proyecto.total_horas = _sumar_horas(filas.values())
+        proyecto.total_dias = sum(datos['registros'] for datos in filas.values())
+        proyecto.horas_presencial = _sumar_horas([filas.get('presencial')])
+        proyecto.horas_remoto = _sumar_horas([filas.get('remoto')])
+        proyecto.horas_desplazamiento = _sumar_horas([filas.get('desplazamiento')])
+    reportes.ordenar_por_horas(proyectos_stats)
+    
+    # Registros detallados del trabajador (horarios diarios), 30 días por página
+    registros = paginar_registros(
+        RegistroFichaje.objects.filter(filtros_registros).select_related('proyecto'),
+        request.GET, 30,
     )
     
+    # Estadísticas generales (solo registros con horas calculadas)
+    filas_con_horas = [(proyecto_id, datos) for (proyecto_id, _), datos in totales.items() if datos['registros_con_horas']]
+    stats_generales = {
+        'total_horas': _sumar_horas([datos for _, datos in filas_con_horas]),
+        'total_dias': sum(datos['registros_con_horas'] for _, datos in filas_con_horas),
+        'total_proyectos': len({proyecto_id for proyecto_id, _ in filas_con_horas if proyecto_id}),
+    }
+    
     context = {
         'trabajador': trabajador,
         'proyectos_stats': proyectos_stats,
@@ -686,4 +767,125 @@ def admin_worker_detail(request, user_id):
         'fecha_hasta': fecha_hasta,
     }
     
-    return render(request, 'admin/worker_detail.html', context)
\ No newline at end of file
+    return render(request, 'admin/worker_detail.html', context)
+
+
+def _fecha_filtro(request, nombre):
+    """Fecha YYYY-MM-DD de un parámetro GET, o None si falta o no es válida"""
+    from datetime import datetime
+    
+    valor = request.GET.get(nombre)
+    if valor:
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    return None
+
+
+# Exportaciones CSV (Admin only): se envían por bloques, sin cargar todo en memoria
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_export_workers(request):
+    """
+    Exporta el reporte de trabajadores en CSV
+    """
+    from . import exports
+    
+    fecha_desde = _fecha_filtro(request, 'fecha_desde')
+    fecha_hasta = _fecha_filtro(request, 'fecha_hasta')
+    
+    totales = materializadas.agregar_totales(
+        ('usuario_id', 'proyecto_id', 'jornada'), fecha_desde, fecha_hasta, usuario__is_active=True
+    )
+    return exports.respuesta_csv(
+        exports.nombre_fichero('trabajadores', fecha_desde, fecha_hasta),
+        exports.CABECERA_TRABAJADORES,
+        exports.filas_trabajadores(totales),
+    )
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_export_projects(request):
+    """
+    Exporta el reporte de proyectos en CSV
+    """
+    from . import exports
+    
+    fecha_desde = _fecha_filtro(request, 'fecha_desde')
+    fecha_hasta = _fecha_filtro(request, 'fecha_hasta')
+    
+    totales = materializadas.agregar_totales(
+        ('proyecto_id', 'usuario_id', 'jornada'), fecha_desde, fecha_hasta, proyecto__activo=True
+    )
+    return exports.respuesta_csv(
+        exports.nombre_fichero('proyectos', fecha_desde, fecha_hasta),
+        exports.CABECERA_PROYECTOS,
+        exports.filas_proyectos(totales),
+    )
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_export_registros(request):
+    """
+    Exporta los registros de fichaje en CSV, opcionalmente de un solo
+    trabajador (?usuario=<id>) o proyecto (?proyecto=<id>)
+    """
+    from . import exports
+    
+    fecha_desde = _fecha_filtro(request, 'fecha_desde')
+    fecha_hasta = _fecha_filtro(request, 'fecha_hasta')
+    
+    filtros = {}
+    prefijo = 'registros'
+    for parametro, campo in (('usuario', 'usuario_id'), ('proyecto', 'proyecto_id')):
+        valor = request.GET.get(parametro, '')
+        if valor.isdigit():
+            filtros[campo] = int(valor)
+            prefijo += f'_{parametro}_{valor}'
+    
+    return exports.respuesta_csv(
+        exports.nombre_fichero(prefijo, fecha_desde, fecha_hasta),
+        exports.CABECERA_REGISTROS,
+        exports.filas_registros(fecha_desde, fecha_hasta, **filtros),
+    )
+
+
+# Perfiles de peticiones (Admin only), ver perfilado.py
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_profiles(request):
+    """
+    Perfiles recientes pedidos con ?_perfil=1, con sus funciones más costosas
+    """
+    from .models import PerfilPeticion
+    
+    perfiles = PerfilPeticion.objects.select_related('usuario')
+    return render(request, 'admin/profiles.html', {
+        'perfiles': perfiles,
+        'limite': getattr(settings, 'PROFILING_RATE_LIMIT', 20),
+        'ventana_minutos': getattr(settings, 'PROFILING_RATE_WINDOW', 3600) // 60,
+    })
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'admin')
+def admin_profile_file(request, perfil_id, formato):
+    """
+    Descarga el .prof (cProfile) o el .txt (pilas colapsadas) de un perfil
+    """
+    from django.http import FileResponse, Http404
+    from django.shortcuts import get_object_or_404
+    from . import perfilado
+    from .models import PerfilPeticion
+    
+    if formato not in ('prof', 'txt'):
+        raise Http404
+    perfil = get_object_or_404(PerfilPeticion, id=perfil_id)
+    try:
+        fichero = open(perfilado.ruta_fichero(perfil, formato), 'rb')
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(fichero, as_attachment=True, filename=f'{perfil.fichero}.{formato}')
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import environ
 import os
+import sys
 from pathlib import Path
 import ldap
 from django_auth_ldap.config import LDAPSearch, GroupOfNamesType
@@ -62,14 +63,22 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'apps.accounts.apps.AccountsConfig',
     'widget_tweaks',
+    'rest_framework',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Server-Timing header, log line and per-view histogram for each request
+    # when PERFORMANCE_INSTRUMENTATION is on; removed at startup otherwise
+    'apps.accounts.rendimiento.RendimientoMiddleware',
+    # Compress HTML/JSON responses; static files are pre-compressed (apps/accounts/estaticos.py)
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # cProfile of single requests for admins (?_perfil=1), needs request.user
+    'apps.accounts.perfilado.PerfiladoMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -104,10 +113,27 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
         'OPTIONS': {
             'timeout': 20,
-        }
+            # WAL: readers never block the writer and vice versa, and with
+            # synchronous=NORMAL a commit does not fsync (durable at checkpoint).
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            # Take the write lock when the transaction starts, so two
+            # read-then-write transactions cannot deadlock upgrading their locks
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Test database on disk: the in-memory one does not allow concurrent
+        # writers from several threads (fichaje concurrency tests)
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Clock-in writes that still hit "database is locked" are retried this many
+# times with jittered exponential backoff (apps/accounts/bloqueos_sqlite.py)
+SQLITE_LOCK_RETRIES = 4
+SQLITE_LOCK_BACKOFF = 0.05      # seconds, doubled on each retry
+SQLITE_LOCK_BACKOFF_MAX = 1.0
+
 # For Postgres
 # DATABASES = {
 #     'default': {
@@ -120,8 +146,100 @@ DATABASES = {
 #     }
 # }
 
+# Cache
+# Two tiers (see apps/accounts/cache.py): 'local' is the in-process L1 and
+# 'default' the L2 shared by every process, which also holds the invalidation
+# generation counters. Use CACHE_URL=redis://host:6379/1 to share it through Redis.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='filecache:///tmp/mainlylabs_cache'),
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mainlylabs-l1',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# Seconds a process trusts its L1 copy of a generation counter, i.e. how long
+# other processes may keep serving data after it changes
+CACHE_GENERATION_L1_TIMEOUT = 5
+
+# Seconds between flushes of the per-process hit/miss counters to L2
+CACHE_STATS_FLUSH_INTERVAL = 10
+
+
+# Per-request performance instrumentation (apps/accounts/rendimiento.py)
+# Off by default: the middleware then removes itself and costs nothing
+PERFORMANCE_INSTRUMENTATION = env.bool('PERFORMANCE_INSTRUMENTATION', default=False)
+# Seconds covered by the per-view histograms on the reports dashboard,
+# stored in L2 in slots of PERFORMANCE_HISTOGRAM_SLOT seconds
+PERFORMANCE_HISTOGRAM_WINDOW = 3600
+PERFORMANCE_HISTOGRAM_SLOT = 300
+# Seconds between flushes of the per-process histogram counters to L2
+PERFORMANCE_FLUSH_INTERVAL = 10
+
+# On-demand profiling of single requests by admins (apps/accounts/perfilado.py)
+# Off unless PROFILING_ENABLED=True is set (commented out in .env.example/.env.docker)
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+# Where the .prof and collapsed-stack .txt files are written
+PROFILING_DIR = env('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+# At most PROFILING_RATE_LIMIT profiles per PROFILING_RATE_WINDOW seconds,
+# counted across processes in the 'default' cache
+PROFILING_RATE_LIMIT = 20
+PROFILING_RATE_WINDOW = 3600
+# Seconds between stack samples for the collapsed stacks
+PROFILING_SAMPLE_INTERVAL = 0.005
+# Profiles kept; older ones are deleted with their files
+PROFILING_KEEP = 50
+
+# Queries slower than this (ms) are logged with their SQL, view and caller, and
+# their EXPLAIN is kept per normalized query (apps/accounts/consultas_lentas.py,
+# `python manage.py slow_queries`). 0, the default, disables it; samples are
+# written outside the caller's transaction, after it commits.
+SLOW_QUERY_THRESHOLD_MS = env.int('SLOW_QUERY_THRESHOLD_MS', default=0)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One key=value line per request while PERFORMANCE_INSTRUMENTATION is on
+        'apps.accounts.rendimiento': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Celery
+# Without CELERY_BROKER_URL tasks run eagerly inside the request (in-memory
+# broker), which is also what the tests use. Set it to redis://redis:6379/0
+# and start a worker (see docker-compose.yml) to run them in the background.
+CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='memory://')
+CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=CELERY_BROKER_URL.startswith('memory://'))
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TIMEZONE = 'Europe/Madrid'
+
+# Background reports (apps/accounts/reportes.py)
+# Date ranges longer than this (or with no start date) are computed by Celery
+REPORTS_ASYNC_MIN_DAYS = 92
+# Seconds a finished report is kept and reused for identical requests
+REPORTS_RESULT_TTL = 15 * 60
+# Seconds after which a job that never finished is considered lost
+REPORTS_JOB_TIMEOUT = 30 * 60
+# Postgres only: read month-aligned report ranges from the materialized view
+# accounts_totalmensualreporte (apps/accounts/materializadas.py). Schedule
+# `manage.py refresh_report_views` (e.g. nightly) to keep it current.
+REPORTS_MATERIALIZED_VIEWS = env.bool('REPORTS_MATERIALIZED_VIEWS', default=False)
+
+
 AUTHENTICATION_BACKENDS = [
-    'django_auth_ldap.backend.LDAPBackend',
+    # django-auth-ldap's LDAPBackend behind a circuit breaker (apps/accounts/circuito_ldap.py)
+    'apps.accounts.backends.CircuitBreakerLDAPBackend',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
@@ -143,6 +261,13 @@ AUTH_LDAP_USER_SEARCH = LDAPSearch(
     env("AUTH_LDAP_USER_FILTER", default="(uid=%(user)s)")
 )
 
+# Direct bind (login fast path): with a template such as
+# uid=%(user)s,ou=users,dc=example,dc=com the user's DN is built instead of
+# searched for, and the user's own bind is reused for the group lookup, so a
+# login skips the service-account bind and the user search.
+AUTH_LDAP_USER_DN_TEMPLATE = env("AUTH_LDAP_USER_DN_TEMPLATE", default=None)
+AUTH_LDAP_BIND_AS_AUTHENTICATING_USER = bool(AUTH_LDAP_USER_DN_TEMPLATE)
+
 # Attribute mapping
 AUTH_LDAP_USER_ATTR_MAP = {
     "username": "uid",
@@ -177,8 +302,9 @@ AUTH_LDAP_PROFILE_FLAGS_BY_GROUP = {
     }
 }
 
-# Cache settings
-AUTH_LDAP_CACHE_TIMEOUT = 3600
+# Cache settings: seconds the user's DN and group memberships are cached
+# (in the 'default' cache) between logins
+AUTH_LDAP_CACHE_TIMEOUT = env.int("AUTH_LDAP_CACHE_TIMEOUT", default=3600)
 
 # Always update user on login
 AUTH_LDAP_ALWAYS_UPDATE_USER = True
@@ -193,12 +319,35 @@ AUTH_LDAP_FIND_GROUP_PERMS = True
 AUTH_LDAP_CONNECTION_OPTIONS = {
     ldap.OPT_DEBUG_LEVEL: 1,
     ldap.OPT_REFERRALS: 0,
+    # Seconds to wait for the TCP connection and for each operation, so a
+    # slow or unreachable server fails fast instead of hanging the login
+    ldap.OPT_NETWORK_TIMEOUT: env.float("AUTH_LDAP_CONNECT_TIMEOUT", default=2),
+    ldap.OPT_TIMEOUT: env.float("AUTH_LDAP_OPERATION_TIMEOUT", default=5),
 }
 
 # TLS options (uncomment if using TLS)
 # AUTH_LDAP_START_TLS = True
 # AUTH_LDAP_CONNECTION_OPTIONS[ldap.OPT_X_TLS_REQUIRE_CERT] = ldap.OPT_X_TLS_NEVER
 
+# Pool of service-account connections used by the LDAP admin views
+# (apps/accounts/ldap_pool.py), per process
+LDAP_POOL_MAX_SIZE = env.int('LDAP_POOL_MAX_SIZE', default=4)
+# Seconds an unused connection is kept open
+LDAP_POOL_IDLE_TIMEOUT = 300
+# A connection idle for longer than this is checked with a whoami before reuse
+LDAP_POOL_CHECK_INTERVAL = 30
+# Seconds to wait for a free connection when all of them are in use
+LDAP_POOL_WAIT_TIMEOUT = 5
+
+# Circuit breaker for LDAP logins (apps/accounts/circuito_ldap.py), state
+# shared by every process through the 'default' cache
+# Consecutive unreachable-server errors that open the circuit
+LDAP_BREAKER_FAILURE_THRESHOLD = env.int('LDAP_BREAKER_FAILURE_THRESHOLD', default=3)
+# Seconds logins skip LDAP once open, before a single probe login is let through
+LDAP_BREAKER_COOLDOWN = env.int('LDAP_BREAKER_COOLDOWN', default=30)
+# Seconds after which a probe that never finished lets another one through
+LDAP_BREAKER_PROBE_TIMEOUT = 10
+
 
 # from django.conf import settings
 # from django.conf.urls.static import static
@@ -243,6 +392,27 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic writes content-hashed copies (plus .gz variants) and a manifest
+# here; {% static %} then points at the hashed names, which are served with
+# far-future cache headers (apps/accounts/estaticos.py).
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# The hashed names only exist after collectstatic, so development and the test
+# runner use the plain storage and serve the source files as they are.
+TESTING = sys.argv[1:2] == ['test']
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG or TESTING
+            else 'apps.accounts.estaticos.EstaticosComprimidos'
+        ),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
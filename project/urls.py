@@ -30,17 +30,25 @@ Including another URLconf
 
 
 
+import re
+
 from django.conf import settings
 from django.conf.urls.static import static
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.contrib import admin
 
+from apps.accounts import estaticos
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('apps.accounts.urls')),
 ]
 
+# Media files are served by the web server outside DEBUG
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-else:
-    urlpatterns = [path('admin/', admin.site.urls)]
\ No newline at end of file
+
+# Files collected into STATIC_ROOT (in DEBUG, runserver serves static files itself)
+urlpatterns += [
+    re_path(rf"^{re.escape(settings.STATIC_URL.lstrip('/'))}(?P<path>.*)$", estaticos.servir),
+]